@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+Per-block ACK latency of fw_updater.read_exact over a pseudo-terminal.
+
+A responder thread plays the radio: it swallows each 5-byte address header
+and 1 KB block and answers with a single 'A', exactly like the firmware
+upload loop. The same exchange is timed with the current event-driven
+read_exact and with the previous sleep-polling version, and the totals are
+extrapolated to a full ~460 KB image.
+
+    python benchmarks/ack_latency.py [--blocks 200] [--ack-delay-ms 0]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import serial  # noqa: E402
+
+import fw_updater  # noqa: E402
+
+FRAME_SIZE = 5 + fw_updater.BLOCK_SIZE
+IMAGE_SIZE = 458752  # Payload of the v1.0.9x images
+
+def legacy_read_exact(ser, length, timeout=5, description="data"):
+    """The sleep-polling read_exact this benchmark compares against"""
+    buf = b''
+    start = time.time()
+    attempts = 0
+    while len(buf) < length:
+        if ser.in_waiting:
+            new_data = ser.read(min(ser.in_waiting, length - len(buf)))
+            if new_data:
+                buf += new_data
+                attempts = 0
+            else:
+                attempts += 1
+                if attempts >= fw_updater.MAX_READ_ATTEMPTS:
+                    raise TimeoutError(f"Failed to read {description} after multiple attempts")
+        if time.time() - start > timeout:
+            raise TimeoutError(f"Timeout waiting for {description}")
+        remaining_pct = (length - len(buf)) / length
+        time.sleep(min(0.01, remaining_pct * 0.05))
+    return buf
+
+def responder(master_fd, ack_delay, stop):
+    """ACK every complete block frame written by the host"""
+    pending = 0
+    while not stop.is_set():
+        try:
+            chunk = os.read(master_fd, 65536)
+        except OSError:
+            return
+        pending += len(chunk)
+        while pending >= FRAME_SIZE:
+            pending -= FRAME_SIZE
+            if ack_delay:
+                time.sleep(ack_delay)
+            os.write(master_fd, b'A')
+
+def run(reader, blocks, ack_delay):
+    """Send 'blocks' frames and return the per-block ACK latencies and CPU time"""
+    master_fd, slave_fd = os.openpty()
+    stop = threading.Event()
+    thread = threading.Thread(target=responder, args=(master_fd, ack_delay, stop), daemon=True)
+    thread.start()
+    frame = bytes(FRAME_SIZE)
+    latencies = []
+    try:
+        with serial.Serial(os.ttyname(slave_fd), 115200, timeout=0.1, write_timeout=2) as ser:
+            cpu_start = time.process_time()
+            for _ in range(blocks):
+                start = time.perf_counter()
+                ser.write(frame)
+                reader(ser, 1, timeout=5, description="block ACK")
+                latencies.append(time.perf_counter() - start)
+            cpu = time.process_time() - cpu_start
+    finally:
+        stop.set()
+        os.close(slave_fd)
+        os.close(master_fd)
+        thread.join(1)
+    return latencies, cpu
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--blocks', type=int, default=200, help='Blocks to send per run (default: 200)')
+    parser.add_argument('--ack-delay-ms', type=float, default=0.0, help='Simulated radio write time per block')
+    args = parser.parse_args()
+    
+    image_blocks = IMAGE_SIZE // fw_updater.BLOCK_SIZE
+    print(f"{args.blocks} blocks per run, extrapolated to {image_blocks} blocks ({IMAGE_SIZE} bytes)")
+    print(f"{'reader':<10} {'median':>9} {'p95':>9} {'max':>9} {'cpu/blk':>9} {'image':>8}")
+    for name, reader in (('polling', legacy_read_exact), ('event', fw_updater.read_exact)):
+        latencies, cpu = run(reader, args.blocks, args.ack_delay_ms / 1000)
+        latencies.sort()
+        median = statistics.median(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        total = sum(latencies) / len(latencies) * image_blocks
+        print(f"{name:<10} {median*1000:8.3f}ms {p95*1000:8.3f}ms {latencies[-1]*1000:8.3f}ms "
+              f"{cpu/args.blocks*1e6:7.0f}us {total:7.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+End-to-end flashing benchmark against radio_emulator.py.
+
+Every image in firmware/ is flashed with fw_updater.updater and the bundled
+font.TXT is sent with font_updater.update_font_data, each against a fresh
+emulated radio on a pty. For each run the table shows wall time, host CPU
+time (the updater's thread only, not the emulator's) and effective bytes/s.
+With --baud auto the updaters negotiate the line rate (radio_link) against a
+radio that understands --rates, and the emulator paces at the chosen rate.
+
+    python benchmarks/flash_bench.py [--ack-latency-ms 2] [--baud 115200] [--window 4]
+    python benchmarks/flash_bench.py --baud auto --rates 115200,230400,460800
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import font_updater  # noqa: E402
+import fw_updater  # noqa: E402
+from radio_emulator import RadioEmulator, emulator_for_image  # noqa: E402
+from radio_link import parse_baud  # noqa: E402
+
+DEFAULT_FONT = os.path.join(ROOT, 'FontTool', 'bin', 'Release', 'net20', 'font.TXT')
+
+def timed(func, *args, **kwargs):
+    """Run 'func' with its console output swallowed; return (result, wall, cpu)"""
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            result = func(*args, **kwargs)
+        except font_updater.FontTransferError:
+            result = False
+    return result, time.perf_counter() - wall_start, time.thread_time() - cpu_start
+
+def host_baud(options):
+    """Rate the updaters are asked to use for an emulator built from 'options'"""
+    return 'auto' if options.get('baud') == 'host' else options.get('baud') or 115200
+
+def bench_firmware(path, options, window, baud_cache):
+    """Flash one image; return a result row"""
+    radio = emulator_for_image(path, **options)
+    with radio:
+        ok, wall, cpu = timed(fw_updater.updater, radio.port, host_baud(options), path,
+                              window=window, check_port=False, baud_cache=baud_cache)
+        radio.wait(2)
+    with open(path, 'rb') as f:
+        payload = f.read()[fw_updater.HEADER_SIZE:]
+    ok = bool(ok) and radio.completed and radio.flash[:len(payload)] == payload
+    return os.path.basename(path), len(payload), ok, wall, cpu
+
+def bench_font(path, options, baud_cache):
+    """Send one font; return a result row"""
+    font_buffer = font_updater.parse_font_file(path)
+    radio = RadioEmulator('font', **options)
+    with radio:
+        ok, wall, cpu = timed(font_updater.update_font_data, radio.port, host_baud(options),
+                              font_buffer, check_port=False, assume_yes=True, baud_cache=baud_cache)
+        radio.wait(2)
+    ok = ok is not False and radio.completed and radio.flash[:len(font_buffer)] == font_buffer
+    return os.path.basename(path), len(font_buffer), ok, wall, cpu
+
+def format_results(rows):
+    lines = [f"{'image':<28} {'bytes':>8} {'ok':>4} {'wall':>8} {'cpu':>9} {'bytes/s':>10}"]
+    for name, size, ok, wall, cpu in rows:
+        lines.append(f"{name:<28} {size:>8} {'yes' if ok else 'NO':>4} {wall:7.2f}s {cpu*1000:7.1f}ms {size/wall:>10.0f}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', nargs='*', help='Firmware images (default: firmware/*.dat)')
+    parser.add_argument('--font', default=DEFAULT_FONT, help='Font text file (default: bundled font.TXT)')
+    parser.add_argument('--no-font', action='store_true', help='Skip the font benchmark')
+    parser.add_argument('--ack-latency-ms', type=float, default=0.0, help='Emulated radio reply delay')
+    parser.add_argument('--baud', type=parse_baud,
+                        help="Pace the emulated line at this rate, or 'auto' to let the updaters negotiate it")
+    parser.add_argument('--rates', type=lambda v: [int(r) for r in v.split(',')],
+                        help='Comma-separated line rates the emulated radio understands (default: any)')
+    parser.add_argument('--erase-time', type=float, default=0.0, help='Emulated F-ERASE time in seconds')
+    parser.add_argument('--window', type=int, default=1, help='fw_updater send window')
+    parser.add_argument('--boot-time', type=float, default=0.0,
+                        help='Seconds each emulated radio ignores the host after the port opens')
+    args = parser.parse_args()
+    
+    # Keep the updaters' log output off the console and out of fw_update.log
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    
+    options = dict(ack_latency=args.ack_latency_ms / 1000, erase_time=args.erase_time,
+                   boot_time=args.boot_time, rates=args.rates,
+                   baud='host' if args.baud == 'auto' else args.baud)
+    images = args.images or sorted(glob.glob(os.path.join(ROOT, 'firmware', '*.dat')))
+    # Negotiated rates are remembered across the runs of one benchmark only
+    with tempfile.TemporaryDirectory() as tmp:
+        baud_cache = os.path.join(tmp, 'baud.json')
+        rows = [bench_firmware(path, options, args.window, baud_cache) for path in images]
+        if not args.no_font:
+            font_options = dict(options)
+            font_options.pop('erase_time')
+            rows.append(bench_font(args.font, font_options, baud_cache))
+    
+    print(format_results(rows))
+    sys.exit(0 if all(row[2] for row in rows) else 1)
+
+if __name__ == '__main__':
+    main()
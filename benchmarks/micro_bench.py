@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Micro-benchmarks for the host-side hot paths, checked against baselines.
+
+Every case runs over the real firmware/*.dat corpus (or the bundled
+font.TXT), repeated until each sample takes a measurable time. Raw wall
+times drift with CPU frequency and whatever else the host is doing, so
+each case sample is taken between two samples of a fixed reference loop
+and scored as case time / reference time; the median of ROUNDS such
+ratios counts. Those ratios are compared with
+benchmarks/micro_baseline.json and the exit status is 1 if any case is
+slower than its baseline by more than --threshold. Record new baselines
+with --update when a change makes a path faster on purpose, and commit
+them with it. Baselines are only comparable on the machine (and Python)
+that recorded them; the header line says which one that was. A case over
+the threshold is measured again (RECHECKS times) first. fwtool.process_file
+writes to os.devnull so the disk stays out of it.
+
+    python benchmarks/micro_bench.py [--threshold 0.25] [-k xor]
+    python benchmarks/micro_bench.py --update
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import font_updater  # noqa: E402
+import fw_updater  # noqa: E402
+import fw_inspect  # noqa: E402
+import fwtool  # noqa: E402
+from firmware_image import OFFSET, XOR_KEY, FirmwareImage, validate_header  # noqa: E402
+from radio_protocol import payload_checksum, plan_frames  # noqa: E402
+from xor_engine import XOR_ENGINES, xor_payload  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_baseline.json')
+DEFAULT_FONT = os.path.join(ROOT, 'FontTool', 'bin', 'Release', 'net20', 'font.TXT')
+THRESHOLD = 0.25  # Allowed slowdown over the baseline (0.25 = 25%)
+MIN_SAMPLE = 0.02  # Seconds; calls per sample grow until one sample takes this long
+ROUNDS = 9  # Case samples per measurement, each between two reference samples
+RECHECKS = 2  # Extra measurements of a case over threshold before calling it a regression
+
+# Fixed work the cases are scored against: some interpreter looping and
+# some C-level bytes work, like the cases themselves
+REFERENCE_TABLE = bytes(b ^ 0x5A for b in range(256))
+REFERENCE_DATA = bytes(range(256)) * 256
+
+def reference_loop():
+    total = 0
+    for i in range(3000):
+        total += i * i
+    REFERENCE_DATA.translate(REFERENCE_TABLE)
+    sorted(REFERENCE_DATA[:4096])
+    return total
+
+def build_cases(images, font_path):
+    """
+    Return {name: callable}. Each callable does one pass over the corpus;
+    the data it needs is prepared here so only the hot path is timed.
+    """
+    raw = [open(path, 'rb').read() for path in images]
+    buffers = [bytearray(data) for data in raw]
+    cases = {}
+    
+    for engine in sorted(XOR_ENGINES):
+        def xor(engine=engine):
+            for buf in buffers:
+                xor_payload(buf, OFFSET, key=XOR_KEY, engine=engine)
+        cases[f"xor.{engine}"] = xor
+    
+    def process_file():
+        # Output goes to /dev/null: writing real files made this case follow
+        # the disk rather than the code
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in images:
+                fwtool.process_file(path, os.devnull, 'decrypt', 'translate')  # What a fresh bf5rh decrypt uses
+    cases['fwtool.process_file'] = process_file
+    
+    def header():
+        for data in raw:
+            validate_header(data)
+    cases['validate_header'] = header
+    
+    def image_validate():
+        for path in images:
+            FirmwareImage.from_file(path).validate()
+    cases['FirmwareImage.validate'] = image_validate
+    
+    def hex_dump_head():
+        for data in raw:
+            fw_updater.hex_dump(data[:128])
+    cases['hex_dump.128'] = hex_dump_head
+    
+    def hex_dump_full():
+        fw_updater.hex_dump(raw[0])
+    cases['hex_dump.image'] = hex_dump_full
+    
+    def inspect_map():
+        with fw_inspect.Inspector(images[0]) as inspector:
+            inspector.block_map()
+    cases['fw_inspect.block_map'] = inspect_map
+    
+    def inspect_page():
+        with fw_inspect.Inspector(images[0]) as inspector:
+            list(inspector.page(100))
+    cases['fw_inspect.page'] = inspect_page
+    
+    def frames():
+        for data in raw:
+            plan_frames(data)
+    cases['plan_frames'] = frames
+    
+    payloads = [memoryview(data)[OFFSET:OFFSET + plan_frames(data).data_end] for data in raw]
+    
+    def check_sum():
+        for payload in payloads:
+            payload_checksum(payload)
+    cases['check_sum'] = check_sum
+    
+    if font_path:
+        with open(font_path, 'rb') as f:
+            text = f.read()
+        cases['parse_font_text'] = lambda: font_updater.parse_font_text(text)
+        cases['parse_font_file'] = lambda: font_updater.parse_font_file(font_path)
+    return cases
+
+def calls_per_sample(func, min_sample=MIN_SAMPLE):
+    """How many calls of 'func' take at least 'min_sample' seconds"""
+    number = 1
+    while True:
+        elapsed = time_calls(func, number) * number
+        if elapsed >= min_sample:
+            return number
+        number *= 2 if elapsed * 4 >= min_sample else 10
+
+def time_calls(func, number):
+    """Seconds per call over 'number' calls"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number
+
+def measure(func, rounds=ROUNDS):
+    """
+    Median seconds per call of 'func' and median ratio to reference_loop()
+    over 'rounds' samples, each ratio taken against the mean of the
+    reference samples just before and just after it
+    """
+    number = calls_per_sample(func)
+    ref_number = calls_per_sample(reference_loop)
+    before = time_calls(reference_loop, ref_number)
+    seconds, ratios = [], []
+    for _ in range(rounds):
+        sample = time_calls(func, number)
+        after = time_calls(reference_loop, ref_number)
+        seconds.append(sample)
+        ratios.append(sample / ((before + after) / 2))
+        before = after
+    return statistics.median(seconds), statistics.median(ratios)
+
+def host_info():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+        'numpy': 'numpy' in XOR_ENGINES,
+    }
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', nargs='*', help='Firmware images (default: firmware/*.dat)')
+    parser.add_argument('--font', default=DEFAULT_FONT, help='Font text file (default: bundled font.TXT)')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline file (default: benchmarks/micro_baseline.json)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help=f'Fail when a case is this much slower than its baseline (default: {THRESHOLD})')
+    parser.add_argument('--update', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('-k', dest='match', help='Only run cases whose name contains this')
+    parser.add_argument('--rounds', type=int, default=ROUNDS,
+                        help=f'Samples per case, each between two reference samples (default: {ROUNDS})')
+    args = parser.parse_args()
+    
+    # parse_font_file warns about the short bundled font on every call
+    logging.basicConfig(level=logging.ERROR)
+    images = args.images or sorted(glob.glob(os.path.join(ROOT, 'firmware', '*.dat')))
+    
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get('units') != 'reference':
+            print("Note: baseline holds raw times, not reference ratios; ignoring it (re-record with --update)")
+        else:
+            baseline = stored.get('results', {})
+        if stored.get('host') != host_info():
+            print(f"Note: baseline was recorded on {stored.get('host')}, this is {host_info()}")
+    
+    results = {}
+    regressions = []
+    print(f"{len(images)} images, threshold {args.threshold:.0%}, median of {args.rounds} rounds")
+    print(f"{'case':<24} {'time':>10} {'x ref':>8} {'baseline':>9} {'change':>8}")
+    for name, func in build_cases(images, args.font).items():
+        if args.match and args.match not in name:
+            continue
+        seconds, ratio = measure(func, rounds=args.rounds)
+        base = baseline.get(name)
+        for _ in range(RECHECKS):
+            if not base or ratio / base - 1 <= args.threshold:
+                break
+            seconds, ratio = min((seconds, ratio), measure(func, rounds=args.rounds), key=lambda r: r[1])
+        results[name] = ratio
+        if base:
+            change = ratio / base - 1
+            flag = ' !' if change > args.threshold else ''
+            if flag:
+                regressions.append(name)
+            print(f"{name:<24} {format_seconds(seconds):>10} {ratio:>8.3g} {base:>9.3g} {change:>+7.0%}{flag}")
+        else:
+            print(f"{name:<24} {format_seconds(seconds):>10} {ratio:>8.3g} {'-':>9} {'new':>8}")
+
+    if args.update:
+        merged = dict(baseline) if args.match else {}
+        merged.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'host': host_info(), 'units': 'reference', 'images': [os.path.basename(p) for p in images],
+                       'results': {k: float(f"{v:.4g}") for k, v in sorted(merged.items())}}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+    if regressions:
+        print(f"Slower than baseline by more than the threshold: {', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
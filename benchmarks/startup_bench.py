@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Start-up time of the bf5rh commands, against an import-time budget.
+
+Each command runs as a fresh process several times; the table shows the
+median wall time and how much of it comes on top of a bare interpreter
+('python -c pass'), which is what bf5rh's own imports and work cost. The
+offline commands must stay within BUDGET_MS of that overhead; the exit
+status is 1 if any of them does not. Every run also reports modules that
+an offline command should never load (pyserial, NumPy, logging).
+
+    python benchmarks/startup_bench.py [--runs 15] [--budget-ms 40]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BF5RH = os.path.join(ROOT, 'bf5rh.py')
+IMAGE = os.path.join(ROOT, 'firmware', 'BF_5RH_501_v2_0_9.dat')
+
+BUDGET_MS = 40  # Overhead over a bare interpreter for the offline commands
+HEAVY_MODULES = ('serial', 'numpy', 'logging')
+
+# Prints the heavy modules a command pulled in, after running it
+PROBE = """
+import runpy, sys
+sys.argv = {argv!r}
+try:
+    runpy.run_path({script!r}, run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print(' '.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+"""
+
+def time_command(argv, runs, env):
+    """Median wall time of 'argv' in milliseconds"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+def heavy_modules(args, env):
+    code = PROBE.format(argv=[BF5RH] + args, script=BF5RH, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            env=env, text=True)
+    return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15, help='Runs per command (default: 15)')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help=f'Allowed overhead for offline commands (default: {BUDGET_MS})')
+    args = parser.parse_args()
+    
+    # Time what an installed copy does: with cached bytecode
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'plain.bin')
+        # (command line, offline)
+        commands = [
+            (['validate', IMAGE], True),
+            (['decrypt', IMAGE, plain], True),
+            (['encrypt', plain, os.path.join(tmp, 'again.dat')], True),
+            (['inspect', IMAGE, '--hex', '0x1000+256'], True),
+            (['ports'], False),
+            (['flash', '--help'], False),
+            (['font', '--help'], False),
+        ]
+        subprocess.run([sys.executable, BF5RH, 'decrypt', IMAGE, plain], stdout=subprocess.DEVNULL, env=env)
+        for command, _ in commands:  # Warm up the bytecode cache and the OS
+            subprocess.run([sys.executable, BF5RH] + command, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, env=env)
+        
+        bare = time_command([sys.executable, '-c', 'pass'], args.runs, env)
+        print(f"python -c pass: {bare:.1f} ms (median of {args.runs})")
+        print(f"{'command':<10} {'wall':>9} {'overhead':>9} {'budget':>8}  heavy modules")
+        over = []
+        for command, offline in commands:
+            wall = time_command([sys.executable, BF5RH] + command, args.runs, env)
+            overhead = wall - bare
+            heavy = heavy_modules(command, env)
+            budget = f"{args.budget_ms:.0f} ms" if offline else '-'
+            if offline and (overhead > args.budget_ms or heavy):
+                over.append(command[0])
+                budget += ' !'
+            print(f"{' '.join(command[:1]):<10} {wall:6.1f} ms {overhead:6.1f} ms {budget:>8}  {heavy or '-'}")
+    if over:
+        print(f"Over budget: {', '.join(over)}")
+    sys.exit(1 if over else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Plug-in latency of flash_station.py against emulated radios.
+
+A station watches a temporary directory standing in for /dev/serial/by-id.
+For each radio a radio_emulator.py pty is started and a by-id style link to
+it is created, as udev would on plug-in. The table shows the time from the
+link appearing to the first byte reaching the radio, and the whole job.
+
+    python benchmarks/station_bench.py [--radios 4] [--poll] [--mode font]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from flash_station import FirmwareJob, FlashStation, FontJob  # noqa: E402
+from radio_emulator import RadioEmulator, emulator_for_image  # noqa: E402
+
+DEFAULT_IMAGE = os.path.join(ROOT, 'firmware', 'BF_5RH_501_v2_0_9.dat')
+DEFAULT_FONT = os.path.join(ROOT, 'FontTool', 'bin', 'Release', 'net20', 'font.TXT')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--radios', type=int, default=4, help='Radios plugged in one after another')
+    parser.add_argument('--gap', type=float, default=0.3, help='Seconds between plug-ins')
+    parser.add_argument('--mode', choices=['firmware', 'font'], default='firmware', help='Job to run')
+    parser.add_argument('--poll', action='store_true', help='Make the station poll instead of using inotify')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    quiet = logging.getLogger('station-bench')
+    quiet.addHandler(logging.NullHandler())
+    quiet.propagate = False
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        by_id = os.path.join(tmp, 'by-id')
+        os.mkdir(by_id)
+        if args.mode == 'firmware':
+            job = FirmwareJob(DEFAULT_IMAGE, connect_timeout=5, baud_cache=os.path.join(tmp, 'baud.json'),
+                              log_dir=tmp)
+            make_radio = lambda: emulator_for_image(DEFAULT_IMAGE)
+        else:
+            job = FontJob(DEFAULT_FONT, connect_timeout=5, baud_cache=os.path.join(tmp, 'baud.json'),
+                          log_dir=tmp)
+            make_radio = lambda: RadioEmulator('font')
+        station = FlashStation(job, by_id, workers=args.radios, use_inotify=not args.poll, logger=quiet)
+        runner = threading.Thread(target=station.run, kwargs={'max_jobs': args.radios}, daemon=True)
+        
+        radios, plugged = [], []
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner.start()
+            time.sleep(0.2)  # Let the station take its first look at the empty directory
+            for i in range(args.radios):
+                radio = make_radio()
+                radio.start()
+                radios.append(radio)
+                link = os.path.join(by_id, f"usb-1a86_USB_Serial_{i:04d}-if00-port0")
+                plugged.append(time.monotonic())
+                os.symlink(radio.port, link)
+                time.sleep(args.gap)
+            runner.join(120)
+        
+        print(f"station: {station.watcher_kind}, {args.radios} radios ({args.mode})")
+        print(f"{'radio':<8} {'port':<12} {'first byte':>11} {'job':>8} {'ok':>4}")
+        by_port = {r['port']: r for r in station.results}
+        ok_all = True
+        for i, (radio, t0) in enumerate(zip(radios, plugged)):
+            result = by_port.get(os.path.realpath(radio.port), {})
+            ok = bool(result.get('ok')) and radio.completed
+            ok_all &= ok
+            first = f"{(radio.first_rx - t0) * 1000:8.1f} ms" if radio.first_rx else "       none"
+            print(f"{i:<8} {radio.port:<12} {first:>11} {result.get('seconds', 0):7.2f}s {'yes' if ok else 'NO':>4}")
+            radio.stop()
+    sys.exit(0 if ok_all else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+One entry point for the 5RH firmware and font tools.
+
+    bf5rh decrypt BF_5RH_501_v2_0_9.dat
+    bf5rh encrypt patched.bin patched.dat
+    bf5rh validate firmware/*.dat
+    bf5rh inspect BF_5RH_501_v2_0_9.dat --hex 0x1000+256
+    bf5rh flash --port /dev/ttyUSB0 --flash BF_5RH_501_v2_0_9.dat
+    bf5rh font --port /dev/ttyUSB0 --font font.TXT
+    bf5rh ports
+
+Each command imports only the module behind it when it runs, so offline
+commands never load pyserial or logging (NumPy only for the inspect block
+map) and start in tens of milliseconds; benchmarks/startup_bench.py checks
+that budget. Options after the command go to the tool it wraps
+(decrypt/encrypt: fwtool.py, inspect: fw_inspect.py, flash: fw_updater.py,
+font: font_updater.py); 'bf5rh COMMAND --help' lists them.
+Without installing, run it as 'python bf5rh.py'.
+"""
+
+import argparse
+import sys
+
+def run_decrypt(argv, prog):
+    import fwtool
+    fwtool.main(['--mode', 'decrypt'] + argv, prog)
+
+def run_encrypt(argv, prog):
+    import fwtool
+    fwtool.main(['--mode', 'encrypt'] + argv, prog)
+
+def run_validate(argv, prog):
+    parser = argparse.ArgumentParser(prog=prog, description='Check firmware headers without converting anything')
+    parser.add_argument('files', nargs='+', help='Firmware files (.dat or .bin)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Only set the exit status')
+    args = parser.parse_args(argv)
+    
+    from firmware_image import FirmwareImage
+    failed = 0
+    for path in args.files:
+        try:
+            image = FirmwareImage.from_file(path)
+        except OSError as e:
+            ok, message = False, e.strerror or str(e)
+        else:
+            ok, message = image.validate()
+            if ok:
+                message = f"{image.model}, V{image.hardware} hardware, {image.status}"
+        failed += not ok
+        if not args.quiet:
+            print(f"{path}: {'OK' if ok else 'INVALID'} - {message}")
+    sys.exit(1 if failed else 0)
+
+def run_inspect(argv, prog):
+    import fw_inspect
+    fw_inspect.main(argv, prog)
+
+def run_flash(argv, prog):
+    import fw_updater
+    fw_updater.main(argv, prog)
+
+def run_font(argv, prog):
+    import font_updater
+    font_updater.main(argv, prog)
+
+def run_ports(argv, prog):
+    argparse.ArgumentParser(prog=prog, description='List serial ports').parse_args(argv)
+    from serial_port import print_ports
+    print_ports()
+
+# name: (runner, summary)
+COMMANDS = {
+    'decrypt': (run_decrypt, 'Decrypt .dat firmware to .bin (fwtool.py --mode decrypt)'),
+    'encrypt': (run_encrypt, 'Encrypt .bin firmware to .dat (fwtool.py --mode encrypt)'),
+    'validate': (run_validate, 'Check firmware headers'),
+    'inspect': (run_inspect, 'Block map, strings and paged hexdump of an image (fw_inspect.py)'),
+    'flash': (run_flash, 'Flash firmware over a serial port (fw_updater.py)'),
+    'font': (run_font, 'Upload font data over a serial port (font_updater.py)'),
+    'ports': (run_ports, 'List serial ports'),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='bf5rh',
+        description='Baofeng 5RH firmware and font tools',
+        epilog='commands:\n' + '\n'.join(f"  {name:<10} {summary}" for name, (_, summary) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='COMMAND', help='One of: ' + ', '.join(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Options for the command (see COMMAND --help)')
+    args = parser.parse_args(argv)
+    runner = COMMANDS[args.command][0]
+    runner(args.args, f"bf5rh {args.command}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+The firmware image model shared by fwtool and fw_updater.
+
+A FirmwareImage wraps the bytes of one .dat/.bin file (read once), parses
+header fields only when they are asked for, exposes header and payload as
+memoryviews and caches its SHA-256. decrypted()/encrypted() return the
+image in the wanted XOR state, converting only when needed:
+
+    image = FirmwareImage.from_file('firmware/BF_5RH_501_v2_0_9.dat')
+    ok, message = image.validate()
+    plain = image.decrypted().payload
+"""
+
+import hashlib
+import os
+import struct
+from collections import namedtuple
+
+from xor_engine import xor_payload
+
+# Layout of the 0x50-byte header
+HEADER_SIZE = 0x50
+OFFSET = HEADER_SIZE  # First XORed byte (fwtool's name for it)
+XOR_KEY = 200
+VENDOR = b'BaoFeng'
+MODEL = b'BF_5RH'
+VERSION = b'V1.0.0.0'
+MARKER_OFFSET = 0x53
+MARKER_DECRYPTED = 0x20
+MARKER_ENCRYPTED = MARKER_DECRYPTED ^ XOR_KEY
+EXPECTED_FLASH_SIZE = 524288
+
+class HeaderFields(namedtuple('HeaderFields', 'vendor model version version2 data_end')):
+    """Decoded header strings (0xFF/0x00 padding stripped) and the size field at 0x40"""
+    __slots__ = ()
+
+def _header_string(raw):
+    return bytes(raw).rstrip(b'\xFF\x00').decode('ascii', 'replace')
+
+def _padded(data, start, signature):
+    """True if the 16-byte field at 'start' holds 'signature' padded with 0xFF"""
+    field = data[start:start + 16]
+    return field[:len(signature)] == signature and all(b == 0xFF for b in field[len(signature):])
+
+def check_encryption_status(data):
+    """
+    Check if the firmware is encrypted or decrypted by examining byte 0x53.
+    
+    Returns:
+        tuple: (status, message) where status is 'encrypted', 'decrypted', or 'unknown'
+    """
+    if len(data) <= MARKER_OFFSET:
+        return "unknown", "File too small to determine encryption status"
+    
+    marker_byte = data[MARKER_OFFSET]
+    if marker_byte == MARKER_DECRYPTED:
+        return "decrypted", f"File appears to be decrypted (marker byte 0x53 = 0x{MARKER_DECRYPTED:02X})"
+    elif marker_byte == MARKER_ENCRYPTED:
+        return "encrypted", f"File appears to be encrypted (marker byte 0x53 = 0x{MARKER_ENCRYPTED:02X})"
+    else:
+        return "unknown", f"Unknown encryption status (marker byte 0x53 = 0x{marker_byte:02X})"
+
+def validate_header(data, total_size=None):
+    """
+    Validate Baofeng firmware header structure.
+    
+    Header should have:
+    - 0x00: "BaoFeng" (0xFF padded)
+    - 0x10: "BF_5RH" (0xFF padded)
+    - 0x20: "V1.0.0.0" (0xFF padded)
+    - 0x30: May be "V2.0.0.0" (0xFF padded)
+    - 0x40: Size of file minus the 0x50 header, at most EXPECTED_FLASH_SIZE
+    
+    Args:
+        data: The file contents, or at least its first 0x50 bytes
+        total_size: Size of the whole file (default: len(data))
+    
+    Returns:
+        tuple: (is_valid, message)
+    """
+    if len(data) < HEADER_SIZE:
+        return False, "File too small to possibly be valid firmware"
+    
+    if not _padded(data, 0x00, VENDOR):
+        return False, f"Invalid header: Missing '{VENDOR.decode()}' signature"
+    if not _padded(data, 0x10, MODEL):
+        return False, f"Invalid header: Missing '{MODEL.decode()}' model signature"
+    if not _padded(data, 0x20, VERSION):
+        return False, "Invalid header: Missing version signature"
+    
+    size_field = struct.unpack('>I', data[0x40:0x44])[0]
+    if size_field <= 0 or size_field > EXPECTED_FLASH_SIZE:
+        return False, f"Invalid file size in header: {size_field} bytes"
+    actual_size = (len(data) if total_size is None else total_size) - HEADER_SIZE
+    if size_field != actual_size:
+        return False, f"Size mismatch: Header claims {size_field} bytes, actual data size is {actual_size} bytes"
+    
+    return True, "Valid Baofeng firmware header"
+
+class FirmwareImage:
+    """
+    One firmware image in memory.
+    
+    'data' is whatever buffer the image was built from (bytes, bytearray or
+    an mmap); nothing else is copied. Header fields, the encryption status
+    and the hash are worked out on first use and cached, so pass the same
+    object around instead of re-reading the file.
+    
+    Args:
+        data: Image contents
+        path: File the image came from (for messages only)
+    """
+    __slots__ = ('data', 'path', '_view', '_fields', '_status', '_sha256', '_converted')
+    
+    def __init__(self, data, path=None):
+        self.data = data
+        self.path = path
+        self._view = memoryview(data)
+        self._reset()
+    
+    def _reset(self):
+        self._fields = None
+        self._status = None
+        self._sha256 = None
+        self._converted = None
+    
+    @classmethod
+    def from_file(cls, path, writable=False):
+        """Read 'path' in one go; 'writable' gives a bytearray for in-place conversion"""
+        with open(path, 'rb') as f:
+            if not writable:
+                return cls(f.read(), path)
+            data = bytearray(os.fstat(f.fileno()).st_size)
+            n = f.readinto(data)
+            del data[n:]
+            return cls(data, path)
+    
+    @classmethod
+    def coerce(cls, image, path=None):
+        """Return 'image' as a FirmwareImage, wrapping raw bytes if needed"""
+        return image if isinstance(image, cls) else cls(image, path)
+    
+    def __len__(self):
+        return len(self._view)
+    
+    def __repr__(self):
+        return f"FirmwareImage({self.path or '<memory>'!r}, {len(self)} bytes, {self.status})"
+    
+    # --- Views ---
+    @property
+    def view(self):
+        """The whole image as a memoryview"""
+        return self._view
+    
+    @property
+    def header(self):
+        return self._view[:HEADER_SIZE]
+    
+    @property
+    def payload(self):
+        """The data the header describes, clipped to what the file holds"""
+        return self._view[HEADER_SIZE:HEADER_SIZE + self.fields.data_end]
+    
+    # --- Header fields ---
+    @property
+    def fields(self):
+        if self._fields is None:
+            view = self._view
+            if len(view) < 0x44:
+                self._fields = HeaderFields(None, None, None, None, 0)
+            else:
+                self._fields = HeaderFields(_header_string(view[0x00:0x10]), _header_string(view[0x10:0x20]),
+                                            _header_string(view[0x20:0x30]), _header_string(view[0x30:0x40]),
+                                            int.from_bytes(view[0x40:0x44], 'big'))
+        return self._fields
+    
+    @property
+    def model(self):
+        return self.fields.model
+    
+    @property
+    def data_end(self):
+        """The size field at 0x40: payload bytes the bootloader is told about"""
+        return self.fields.data_end
+    
+    @property
+    def hardware(self):
+        """2 for V2 hardware images ('2' at 0x31), 1 otherwise"""
+        return 2 if len(self._view) > 0x31 and self._view[0x31] == ord('2') else 1
+    
+    @property
+    def new_hardware(self):
+        return self.hardware == 2
+    
+    @property
+    def size_ok(self):
+        """Whether the size field matches the payload length (None without a header)"""
+        if len(self._view) < 0x44:
+            return None
+        return self.data_end == len(self._view) - HEADER_SIZE
+    
+    def validate(self):
+        """Validate the header against the whole image, see validate_header()"""
+        return validate_header(self._view)
+    
+    # --- Encryption ---
+    @property
+    def status(self):
+        """'encrypted', 'decrypted' or 'unknown', from the marker byte at 0x53"""
+        if self._status is None:
+            self._status = check_encryption_status(self._view)[0]
+        return self._status
+    
+    def status_message(self):
+        return check_encryption_status(self._view)[1]
+    
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self._view).hexdigest()
+        return self._sha256
+    
+    def xor(self, engine=None, in_place=False):
+        """
+        Flip the payload between encrypted and decrypted.
+        
+        With 'in_place' the image's own (writable) buffer is converted and
+        self is returned; otherwise a converted copy is made once and cached.
+        """
+        if in_place:
+            self._view.release()
+            xor_payload(self.data, HEADER_SIZE, key=XOR_KEY, engine=engine)
+            self._view = memoryview(self.data)
+            self._reset()
+            return self
+        if self._converted is None:
+            self._converted = FirmwareImage(xor_payload(bytearray(self._view), HEADER_SIZE, key=XOR_KEY,
+                                                        engine=engine), self.path)
+            self._converted._converted = self
+        return self._converted
+    
+    def _in_state(self, status, engine):
+        if self.status == status:
+            return self
+        if self.status == 'unknown':
+            raise ValueError(f"Cannot tell whether {self.path or 'the image'} is encrypted: "
+                             f"{self.status_message()}")
+        return self.xor(engine)
+    
+    def decrypted(self, engine=None):
+        """This image with a plain payload (self if it already is)"""
+        return self._in_state('decrypted', engine)
+    
+    def encrypted(self, engine=None):
+        """This image with an XORed payload, as the bootloader expects it"""
+        return self._in_state('encrypted', engine)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Structured timing for flashing sessions.
+
+fw_updater.updater and font_updater.update_font_data fill a SessionMetrics
+as they go: wall time per phase, a histogram of per-block ACK latency,
+retry and failure counters and the effective upload rate. export() appends
+the session as one JSON line to flash_sessions.jsonl and rewrites a
+Prometheus text-format file per tool and port, suitable for the
+node_exporter textfile collector:
+
+    python fw_updater.py --port /dev/ttyUSB0 --flash fw.dat --metrics-dir /var/lib/node_exporter
+"""
+
+import json
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from serial_port import port_tag
+
+# Upper bounds of the ACK latency histogram buckets, in seconds
+ACK_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNTERS = ('retries', 'failed_blocks', 'timeouts', 'nacks')
+SESSIONS_FILE = 'flash_sessions.jsonl'
+METRIC_PREFIX = 'bf5rh_flash'
+
+_write_lock = threading.Lock()
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class SessionMetrics:
+    """
+    Timings and counters for one flashing session.
+    
+    Args:
+        tool: 'firmware' or 'font'
+        port: Serial port the session runs on
+        image: Firmware or font file (for the record only)
+    """
+    
+    def __init__(self, tool, port, image=None):
+        self.tool = tool
+        self.port = port
+        self.image = image
+        self.host = socket.gethostname()
+        self.started = time.time()
+        self.seconds = 0.0
+        self.ok = False
+        self.baud = None
+        self.bytes = 0
+        self.phases = OrderedDict()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.ack_buckets = [0] * len(ACK_BUCKETS)
+        self.ack_count = 0
+        self.ack_sum = 0.0
+        self.ack_max = 0.0
+        self._start = time.perf_counter()
+    
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase 'name' (repeated phases add up)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+    
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+    
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+    
+    def observe_ack(self, seconds):
+        """Add one block's write-to-ACK latency to the histogram"""
+        for i, bound in enumerate(ACK_BUCKETS):
+            if seconds <= bound:
+                self.ack_buckets[i] += 1
+                break
+        self.ack_count += 1
+        self.ack_sum += seconds
+        self.ack_max = max(self.ack_max, seconds)
+    
+    def finish(self, ok):
+        self.ok = bool(ok)
+        self.seconds = time.perf_counter() - self._start
+    
+    @property
+    def bytes_per_second(self):
+        upload = self.phases.get('upload', 0.0)
+        return self.bytes / upload if upload > 0 else 0.0
+    
+    def to_dict(self):
+        return {
+            'tool': self.tool,
+            'port': self.port,
+            'host': self.host,
+            'image': self.image,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'ok': self.ok,
+            'seconds': round(self.seconds, 6),
+            'baud': self.baud,
+            'bytes': self.bytes,
+            'bytes_per_second': round(self.bytes_per_second, 1),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'ack_latency': {
+                'count': self.ack_count,
+                'sum': round(self.ack_sum, 6),
+                'max': round(self.ack_max, 6),
+                'buckets': {str(bound): n for bound, n in zip(ACK_BUCKETS, self.ack_buckets)},
+            },
+        }
+    
+    def prometheus_text(self, sessions_total=0, failures_total=0):
+        """
+        The session in Prometheus text format. Gauges describe this (the
+        latest) session; the two *_total counters carry over between sessions.
+        """
+        p = METRIC_PREFIX
+        labels = f'tool="{_label(self.tool)}",port="{_label(self.port)}"'
+        lines = [
+            f"# HELP {p}_sessions_total Flashing sessions run on this port",
+            f"# TYPE {p}_sessions_total counter",
+            f"{p}_sessions_total{{{labels}}} {sessions_total}",
+            f"# HELP {p}_failures_total Flashing sessions that failed on this port",
+            f"# TYPE {p}_failures_total counter",
+            f"{p}_failures_total{{{labels}}} {failures_total}",
+            f"# HELP {p}_last_success Whether the last session succeeded",
+            f"# TYPE {p}_last_success gauge",
+            f"{p}_last_success{{{labels}}} {int(self.ok)}",
+            f"# HELP {p}_last_timestamp_seconds Start of the last session",
+            f"# TYPE {p}_last_timestamp_seconds gauge",
+            f"{p}_last_timestamp_seconds{{{labels}}} {self.started:.3f}",
+            f"# HELP {p}_last_duration_seconds Wall time of the last session",
+            f"# TYPE {p}_last_duration_seconds gauge",
+            f"{p}_last_duration_seconds{{{labels}}} {self.seconds:.6f}",
+            f"# HELP {p}_last_bytes_per_second Effective upload rate of the last session",
+            f"# TYPE {p}_last_bytes_per_second gauge",
+            f"{p}_last_bytes_per_second{{{labels}}} {self.bytes_per_second:.1f}",
+            f"# HELP {p}_last_phase_seconds Wall time per phase of the last session",
+            f"# TYPE {p}_last_phase_seconds gauge",
+        ]
+        lines += [f'{p}_last_phase_seconds{{{labels},phase="{_label(name)}"}} {seconds:.6f}'
+                  for name, seconds in self.phases.items()]
+        lines += [f"# HELP {p}_last_events Retries and failures in the last session",
+                  f"# TYPE {p}_last_events gauge"]
+        lines += [f'{p}_last_events{{{labels},event="{_label(name)}"}} {n}'
+                  for name, n in self.counters.items()]
+        lines += [f"# HELP {p}_last_ack_latency_seconds Per-block write-to-ACK latency in the last session",
+                  f"# TYPE {p}_last_ack_latency_seconds histogram"]
+        cumulative = 0
+        for bound, n in zip(ACK_BUCKETS, self.ack_buckets):
+            cumulative += n
+            lines.append(f'{p}_last_ack_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines += [f'{p}_last_ack_latency_seconds_bucket{{{labels},le="+Inf"}} {self.ack_count}',
+                  f"{p}_last_ack_latency_seconds_sum{{{labels}}} {self.ack_sum:.6f}",
+                  f"{p}_last_ack_latency_seconds_count{{{labels}}} {self.ack_count}"]
+        return '\n'.join(lines) + '\n'
+    
+    def prometheus_path(self, directory):
+        return os.path.join(directory, f"{METRIC_PREFIX}_{self.tool}_{port_tag(self.port)}.prom")
+    
+    def export(self, directory):
+        """
+        Append the session to flash_sessions.jsonl in 'directory' and rewrite
+        this port's .prom file. Returns the two paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        prom_path = self.prometheus_path(directory)
+        jsonl_path = os.path.join(directory, SESSIONS_FILE)
+        with _write_lock:
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.to_dict(), sort_keys=True) + '\n')
+            
+            sessions, failures = _read_totals(prom_path)
+            text = self.prometheus_text(sessions + 1, failures + (not self.ok))
+            # Write and rename so the collector never reads a half-written file
+            tmp = f"{prom_path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, prom_path)
+        return jsonl_path, prom_path
+
+def _read_totals(prom_path):
+    """Session and failure counts from a previous .prom file"""
+    totals = {'sessions': 0, 'failures': 0}
+    try:
+        with open(prom_path, encoding='utf-8') as f:
+            for line in f:
+                match = re.match(rf'{METRIC_PREFIX}_(sessions|failures)_total\{{.*\}} (\d+)', line)
+                if match:
+                    totals[match.group(1)] = int(match.group(2))
+    except OSError:
+        pass
+    return totals['sessions'], totals['failures']
+
+def format_metrics(metrics):
+    """Short human-readable summary of a session"""
+    phases = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in metrics.phases.items())
+    events = ', '.join(f"{name} {n}" for name, n in metrics.counters.items() if n) or 'no retries'
+    mean = metrics.ack_sum / metrics.ack_count * 1000 if metrics.ack_count else 0
+    return (f"{metrics.tool} on {metrics.port}: {'OK' if metrics.ok else 'FAILED'} in {metrics.seconds:.2f}s "
+            f"({metrics.bytes_per_second:.0f} bytes/s); {phases}; "
+            f"ACK mean {mean:.2f} ms, max {metrics.ack_max * 1000:.2f} ms over {metrics.ack_count} blocks; {events}")
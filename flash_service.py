@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Long-running flashing service with a small local HTTP API.
+
+Instead of one process per flash, production line systems submit jobs to
+this service over a Unix socket (or a TCP port on localhost). Workers wrap
+fw_updater.updater and font_updater.update_font_data; validated firmware
+images and font buffers stay cached in memory until their file changes.
+At most one job runs per serial port at a time.
+
+    python flash_service.py --socket /run/bf5rh.sock --workers 8
+
+    curl --unix-socket /run/bf5rh.sock localhost/jobs -d \\
+        '{"kind": "firmware", "port": "/dev/ttyUSB0", "image": "/srv/fw/BF_5RH_501_v2_0_9.dat"}'
+    curl --unix-socket /run/bf5rh.sock localhost/jobs/1/events     # progress as JSON lines
+    curl --unix-socket /run/bf5rh.sock -X DELETE localhost/jobs/1  # cancel
+    curl --unix-socket /run/bf5rh.sock 'localhost/jobs?state=failed'
+
+Endpoints:
+    POST   /jobs              submit {kind, port, image, options} (or sha256/hardware, see
+                              below); 202 with the job
+    GET    /jobs[?state=S]    all jobs still in the history, oldest first
+    GET    /jobs/ID           one job (state, progress, error, metrics)
+    GET    /jobs/ID/events    stream state and progress changes until the job ends
+    DELETE /jobs/ID           cancel (a running job stops after its current block)
+    GET    /catalog           images in --firmware-dir, newest build first
+    GET    /cache             cached images and hit counts
+    GET    /health            worker, queue and cache totals
+
+Job options: baud (int or "auto"), window (int), connect_timeout (number),
+force and resume (true/false; firmware), write_size (int; font).
+
+With --firmware-dir the service keeps a fw_catalog.py catalog of that
+directory, and a firmware job can name its image by catalog lookup instead
+of by path: "image": "latest" (optionally with "hardware": 1 or 2) picks
+the newest valid encrypted build, "sha256": "<hex>" a known image.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import font_updater
+import fw_updater
+from firmware_image import FirmwareImage
+from fw_catalog import DEFAULT_DB_NAME, FirmwareCatalog
+from flash_metrics import SessionMetrics
+from radio_link import BAUD_CACHE, parse_baud
+from serial_port import port_tag
+
+KINDS = ('firmware', 'font')
+STATES = ('queued', 'running', 'ok', 'failed', 'cancelled')
+FINAL_STATES = ('ok', 'failed', 'cancelled')
+JOB_OPTIONS = {
+    'firmware': {'baud', 'window', 'connect_timeout', 'force', 'resume'},
+    'font': {'baud', 'connect_timeout', 'write_size'},
+}
+DEFAULT_WORKERS = 4
+MAX_QUEUE = 10000
+HISTORY = 10000  # Finished jobs kept for GET /jobs
+CACHE_ENTRIES = 16
+
+class JobCancelled(KeyboardInterrupt):
+    """
+    Raised from the progress callback of a cancelled job. The updaters
+    already treat KeyboardInterrupt as a clean user cancel.
+    """
+
+class ServiceError(Exception):
+    """A request the service refuses; carries the HTTP status"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# --- Image cache ---
+class ImageCache:
+    """
+    Validated firmware images and font buffers by path, reloaded when the
+    file's size or mtime changes. The least recently used entry is dropped
+    beyond 'max_entries'.
+    """
+    
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, kind, path):
+        """Return the cached value for (kind, path), loading it if needed"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (kind, path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        # Load outside the lock; two racing loads of one file are harmless
+        value = self._load(kind, path)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+    
+    @staticmethod
+    def _load(kind, path):
+        if kind == 'firmware':
+            image = FirmwareImage.from_file(path)
+            return image, image.validate()
+        return bytes(font_updater.load_font(path))
+    
+    def describe(self):
+        with self._lock:
+            entries = [{'kind': kind, 'path': path, 'size': stamp[0]}
+                       for (kind, path), (stamp, _) in self._entries.items()]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+# --- Jobs ---
+class Job:
+    """One submitted flash and everything reported about it"""
+    
+    def __init__(self, job_id, kind, port, image, options):
+        self.id = job_id
+        self.kind = kind
+        self.port = port
+        self.image = image
+        self.options = options
+        self.state = 'queued'
+        self.progress = None
+        self.error = ''
+        self.metrics = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.events = []
+        self.changed = threading.Condition()
+    
+    def emit(self, **event):
+        """Record a state or progress change and wake up event streams"""
+        event['time'] = round(time.time(), 3)
+        with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+    
+    def set_state(self, state, error=''):
+        self.state = state
+        self.error = error
+        if state == 'running':
+            self.started = time.time()
+        elif state in FINAL_STATES:
+            self.finished = time.time()
+        self.emit(state=state, **({'error': error} if error else {}))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'port': self.port,
+            'image': self.image,
+            'options': self.options,
+            'state': self.state,
+            'progress': self.progress,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'seconds': round(self.finished - self.started, 3) if self.finished and self.started else None,
+            'metrics': self.metrics,
+        }
+
+def check_options(kind, options):
+    """Validate the options of a submitted job and normalize their types"""
+    unknown = set(options) - JOB_OPTIONS[kind]
+    if unknown:
+        raise ServiceError(f"Unknown {kind} options: {', '.join(sorted(unknown))}")
+    checked = dict(options)
+    if 'baud' in checked:
+        try:
+            checked['baud'] = parse_baud(str(checked['baud']))
+        except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+            raise ServiceError(f"Bad option value: {e}")
+    # JSON has real booleans and numbers, so nothing is coerced: int(True)
+    # would be 1 and bool("false") would be True
+    for name, minimum in (('window', 1), ('write_size', 0)):
+        if name in checked:
+            value = checked[name]
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ServiceError(f"Option '{name}' must be an integer")
+            if value < minimum:
+                raise ServiceError(f"Option '{name}' must be at least {minimum}")
+    if 'connect_timeout' in checked:
+        value = checked['connect_timeout']
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+            raise ServiceError("Option 'connect_timeout' must be a positive number")
+        checked['connect_timeout'] = float(value)
+    for name in ('force', 'resume'):
+        if name in checked and not isinstance(checked[name], bool):
+            raise ServiceError(f"Option '{name}' must be true or false")
+    return checked
+
+class FlashService:
+    """
+    Job queue and worker pool behind the HTTP API.
+    
+    Args:
+        workers: Jobs running at the same time
+        max_queue: Queued jobs accepted before submit() refuses more
+        history: Finished jobs remembered for listing
+        log_dir: Where per-port firmware and font logs go
+        metrics_dir: Export every session's metrics here (optional)
+        baud_cache: Negotiated rates for baud 'auto'
+        firmware_dir: Catalogued firmware directory for 'latest' and
+            'sha256' lookups (optional)
+    """
+    
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=MAX_QUEUE, history=HISTORY, log_dir='.',
+                 metrics_dir=None, baud_cache=BAUD_CACHE, cache_entries=CACHE_ENTRIES, logger=None,
+                 firmware_dir=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.log_dir = log_dir
+        self.metrics_dir = metrics_dir
+        self.baud_cache = baud_cache
+        self.cache = ImageCache(cache_entries)
+        self.firmware_dir = firmware_dir
+        self._catalog_lock = threading.Lock()
+        self.logger = logger or logging.getLogger('flash_service')
+        self.jobs = OrderedDict()
+        self._finished = deque()
+        self._history = history
+        self._queue = deque()
+        self._busy_ports = set()
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._threads = []
+    
+    # --- Lifecycle ---
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"flash-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def stop(self, timeout=None):
+        """Cancel queued jobs, ask running ones to stop and wait for the workers"""
+        with self._cond:
+            self._stopping = True
+            for job in self._queue:
+                job.set_state('cancelled', 'service stopped')
+            self._queue.clear()
+            for job in self.jobs.values():
+                if job.state == 'running':
+                    job.cancel_requested = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+    
+    # --- Catalog ---
+    def resolve_image(self, image=None, sha256=None, hardware=None):
+        """
+        Path of the firmware to flash: 'image' itself, or the catalog's answer
+        when 'image' is 'latest' or a 'sha256' is given.
+        """
+        if sha256 is None and image != 'latest':
+            return image
+        if not self.firmware_dir:
+            raise ServiceError("Catalog lookups need the service to run with --firmware-dir")
+        if hardware not in (None, 1, 2) or isinstance(hardware, bool):
+            raise ServiceError("'hardware' must be 1 or 2")
+        # A catalog connection belongs to one thread; update() only stats unchanged files
+        with self._catalog_lock, FirmwareCatalog(os.path.join(self.firmware_dir, DEFAULT_DB_NAME)) as catalog:
+            catalog.update(self.firmware_dir)
+            if sha256 is not None:
+                found = catalog.by_hash(str(sha256))
+                if not found:
+                    raise ServiceError(f"No catalogued image with SHA-256 {sha256}", 404)
+                return found[0]['path']
+            found = catalog.latest(hardware=hardware)
+        if found is None:
+            raise ServiceError(f"No valid image in {self.firmware_dir}", 404)
+        return found['path']
+    
+    def catalog(self):
+        if not self.firmware_dir:
+            raise ServiceError("The service runs without --firmware-dir", 404)
+        with self._catalog_lock, FirmwareCatalog(os.path.join(self.firmware_dir, DEFAULT_DB_NAME)) as catalog:
+            catalog.update(self.firmware_dir)
+            return catalog.find()
+    
+    # --- API ---
+    def submit(self, kind, port, image, options=None, sha256=None, hardware=None):
+        if kind not in KINDS:
+            raise ServiceError(f"'kind' must be one of {', '.join(KINDS)}")
+        if kind == 'firmware':
+            image = self.resolve_image(image, sha256, hardware)
+        if not port or not image:
+            raise ServiceError("'port' and 'image' are required")
+        options = check_options(kind, options or {})
+        if not os.path.isfile(image):
+            raise ServiceError(f"Image not found: {image}", 404)
+        with self._cond:
+            if self._stopping:
+                raise ServiceError("Service is stopping", 503)
+            if len(self._queue) >= self.max_queue:
+                raise ServiceError("Job queue is full", 503)
+            job = Job(next(self._ids), kind, port, image, options)
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            job.emit(state='queued')
+            self._cond.notify()
+        self.logger.info(f"Job {job.id}: {kind} {image} on {port} queued")
+        return job
+    
+    def get(self, job_id):
+        try:
+            return self.jobs[int(job_id)]
+        except (KeyError, ValueError):
+            raise ServiceError(f"No job {job_id}", 404)
+    
+    def list(self, state=None):
+        return [job for job in list(self.jobs.values()) if state is None or job.state == state]
+    
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        with self._cond:
+            if job.state == 'queued':
+                self._queue.remove(job)
+                job.set_state('cancelled')
+                self._retire(job)
+            elif job.state == 'running':
+                job.cancel_requested = True
+        return job
+    
+    def health(self):
+        with self._cond:
+            running = sum(job.state == 'running' for job in self.jobs.values())
+            return {'workers': self.workers, 'queued': len(self._queue), 'running': running,
+                    'jobs': len(self.jobs), 'cache': {'hits': self.cache.hits, 'misses': self.cache.misses}}
+    
+    # --- Workers ---
+    def _next_job(self):
+        """Block until a queued job's port is free; None when stopping"""
+        with self._cond:
+            while not self._stopping:
+                for job in self._queue:
+                    if job.port not in self._busy_ports:
+                        self._queue.remove(job)
+                        self._busy_ports.add(job.port)
+                        job.set_state('running')
+                        return job
+                self._cond.wait()
+            return None
+    
+    def _retire(self, job):
+        """Keep a finished job for listing, forgetting the oldest beyond the history limit"""
+        self._finished.append(job.id)
+        while len(self._finished) > self._history:
+            self.jobs.pop(self._finished.popleft(), None)
+    
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                ok = self._run(job)
+                if job.cancel_requested:
+                    state, error = 'cancelled', ''
+                else:
+                    state, error = ('ok', '') if ok else ('failed', job.error or 'see log')
+            except Exception as e:
+                state, error = 'failed', str(e)
+            with self._cond:
+                self._busy_ports.discard(job.port)
+                job.set_state(state, error)
+                self._retire(job)
+                self._cond.notify_all()
+            self.logger.info(f"Job {job.id}: {state}{f' ({error})' if error else ''}")
+    
+    def _progress(self, job):
+        last = [-1]
+        
+        def report(done, total):
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.progress = [done, total]
+            percent = done * 100 // total
+            if percent != last[0]:
+                last[0] = percent
+                job.emit(progress=[done, total])
+        return report
+    
+    def _run(self, job):
+        options = job.options
+        baud = options.get('baud', 115200)
+        connect_timeout = options.get('connect_timeout', fw_updater.CONNECT_TIMEOUT if job.kind == 'firmware'
+                                      else font_updater.CONNECT_TIMEOUT)
+        if job.kind == 'firmware':
+            metrics = SessionMetrics('firmware', job.port, job.image)
+            image, (valid, message) = self.cache.get('firmware', job.image)
+            if not valid and not options.get('force'):
+                job.error = f"Firmware validation failed: {message}"
+                return False
+            tag = port_tag(job.port)
+            logger = fw_updater.setup_logging(False, os.path.join(self.log_dir, f"fw_update_{tag}.log"), name=tag)
+            try:
+                return fw_updater.updater(job.port, baud, job.image, window=options.get('window', 1),
+                                          check_port=False, prompt='no', image=image, logger=logger, quiet=True,
+                                          connect_timeout=connect_timeout, baud_cache=self.baud_cache,
+                                          metrics=metrics, metrics_dir=self.metrics_dir,
+                                          resume=options.get('resume', False),
+                                          checkpoint_path=(fw_updater.checkpoint_path_for(job.port, self.log_dir)
+                                                           if options.get('resume') else None),
+                                          progress=self._progress(job))
+            finally:
+                job.metrics = metrics.to_dict()
+        
+        metrics = SessionMetrics('font', job.port, job.image)
+        font_buffer = self.cache.get('font', job.image)
+        tag = port_tag(job.port)
+        logger = font_updater.setup_logging(False, os.path.join(self.log_dir, f"font_update_{tag}.log"), name=tag)
+        try:
+            return font_updater.update_font_data(job.port, baud, font_buffer, check_port=False, assume_yes=True,
+                                                 write_size=options.get('write_size', font_updater.FONT_WRITE_SIZE),
+                                                 connect_timeout=connect_timeout, baud_cache=self.baud_cache,
+                                                 metrics=metrics, metrics_dir=self.metrics_dir,
+                                                 progress=self._progress(job), logger=logger, quiet=True)
+        except font_updater.FontTransferError as e:
+            job.error = str(e)
+            return False
+        finally:
+            job.metrics = metrics.to_dict()
+
+# --- HTTP ---
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP/1.0; the service is reachable as self.server.service"""
+    
+    server_version = 'bf5rh-flash-service/1'
+    
+    def address_string(self):
+        # Unix socket peers have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+    
+    def log_message(self, format, *args):
+        self.server.service.logger.debug(f"{self.address_string()} {format % args}")
+    
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8') + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _route(self, method):
+        service = self.server.service
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        try:
+            if method == 'GET' and parts == ['health']:
+                return self._send_json(200, service.health())
+            if method == 'GET' and parts == ['catalog']:
+                return self._send_json(200, service.catalog())
+            if method == 'GET' and parts == ['cache']:
+                return self._send_json(200, service.cache.describe())
+            if method == 'GET' and parts == ['jobs']:
+                state = parse_qs(url.query).get('state', [None])[0]
+                return self._send_json(200, [job.to_dict() for job in service.list(state)])
+            if method == 'POST' and parts == ['jobs']:
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError as e:
+                    raise ServiceError(f"Invalid JSON: {e}")
+                if not isinstance(body, dict):
+                    raise ServiceError("Expected a JSON object")
+                job = service.submit(body.get('kind'), body.get('port'), body.get('image'), body.get('options'),
+                                     body.get('sha256'), body.get('hardware'))
+                return self._send_json(202, job.to_dict())
+            if len(parts) == 2 and parts[0] == 'jobs':
+                if method == 'GET':
+                    return self._send_json(200, service.get(parts[1]).to_dict())
+                if method == 'DELETE':
+                    return self._send_json(200, service.cancel(parts[1]).to_dict())
+            if method == 'GET' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+                return self._stream_events(service.get(parts[1]))
+            raise ServiceError(f"No route for {method} {url.path}", 404)
+        except ServiceError as e:
+            self._send_json(e.status, {'error': str(e)})
+    
+    def _stream_events(self, job):
+        """Write the job's events as JSON lines, then follow it until it ends"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        sent = 0
+        while True:
+            with job.changed:
+                while sent == len(job.events):
+                    if job.state in FINAL_STATES:
+                        return
+                    job.changed.wait(1.0)
+                pending = job.events[sent:]
+            sent += len(pending)
+            try:
+                self.wfile.write(b''.join(json.dumps(e).encode('utf-8') + b'\n' for e in pending))
+                self.wfile.flush()
+            except OSError:
+                return  # Client went away
+    
+    def do_GET(self):
+        self._route('GET')
+    
+    def do_POST(self):
+        self._route('POST')
+    
+    def do_DELETE(self):
+        self._route('DELETE')
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    
+    def server_bind(self):
+        # A socket file left by an earlier run would make bind() fail
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+        self.server_name, self.server_port = 'localhost', 0
+
+def make_server(service, socket_path=None, listen=None):
+    """HTTP server for 'service' on a Unix socket path or a (host, port) address"""
+    if socket_path:
+        server = UnixHTTPServer(socket_path, ServiceHandler)
+    else:
+        server = ThreadingHTTPServer(listen, ServiceHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+def parse_listen(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve firmware and font flashing jobs over a local HTTP API')
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--socket', help='Unix socket path to listen on')
+    where.add_argument('--listen', type=parse_listen, default=('127.0.0.1', 8765),
+                       help='TCP HOST:PORT to listen on (default: 127.0.0.1:8765)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Jobs running at once (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                        help=f'Queued jobs accepted before submissions are refused (default: {MAX_QUEUE})')
+    parser.add_argument('--history', type=int, default=HISTORY,
+                        help=f'Finished jobs kept for listing (default: {HISTORY})')
+    parser.add_argument('--cache-entries', type=int, default=CACHE_ENTRIES,
+                        help=f'Images and fonts kept in memory (default: {CACHE_ENTRIES})')
+    parser.add_argument('--log-dir', default='.', help='Directory for the service and per-port logs')
+    parser.add_argument('--metrics-dir', help='Export per-session metrics to this directory')
+    parser.add_argument('--firmware-dir', help="Catalog this directory for 'latest' and 'sha256' image lookups")
+    parser.add_argument('--baud-cache', default=BAUD_CACHE, help=f'Negotiated rates per adapter (default: {BAUD_CACHE})')
+    parser.add_argument('--verbose', action='store_true', help='Log every HTTP request')
+    args = parser.parse_args()
+    
+    os.makedirs(args.log_dir, exist_ok=True)
+    logger = fw_updater.setup_logging(args.verbose, os.path.join(args.log_dir, 'flash_service.log'), name='service')
+    service = FlashService(args.workers, args.max_queue, args.history, args.log_dir, args.metrics_dir,
+                           args.baud_cache, args.cache_entries, logger, args.firmware_dir)
+    service.start()
+    server = make_server(service, args.socket, args.listen)
+    where = args.socket or f"http://{args.listen[0]}:{args.listen[1]}"
+    logger.info(f"Flash service on {where} with {args.workers} workers")
+    print(f"Flash service on {where} with {args.workers} workers (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping; running jobs stop after their current block")
+    finally:
+        server.server_close()
+        service.stop()
+        if args.socket:
+            try:
+                os.unlink(args.socket)
+            except OSError:
+                pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Flash station: start a firmware or font job whenever an adapter is plugged in.
+
+The station watches /dev/serial/by-id, where udev names each USB serial
+adapter after its vendor and serial number, with inotify (through ctypes,
+Linux only) or by polling the directory. Every new CH340/CP210x/FTDI/
+Prolific entry gets one job on a worker thread; the image is read and
+validated once at startup and shared by all jobs. Unplugging an adapter
+and plugging it back in (or a new one) starts the next job.
+
+    python flash_station.py --flash firmware/BF_5RH_501_v2_0_9.dat
+    python flash_station.py --font FontTool/bin/Release/net20/font.TXT --workers 8
+
+The watched directory only needs symlinks to serial devices, so a temporary
+directory with links to radio_emulator.py ptys works as a test bench (see
+benchmarks/station_bench.py).
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import font_updater
+import fw_updater
+from flash_metrics import SessionMetrics
+from radio_link import BAUD_CACHE, parse_baud
+from serial_port import port_tag
+
+BY_ID_DIR = '/dev/serial/by-id'
+# udev by-id names of the usual programming cables: CH340/CH341 (1a86),
+# CP210x (Silicon Labs), FTDI and Prolific PL2303 (067b)
+ADAPTER_PATTERN = r'1a86|CH34[01]|Silicon_Labs|CP210|FTDI|Prolific|067b|USB[_-]Serial'
+POLL_INTERVAL = 0.2
+# After inotify fails to start (e.g. max_user_watches is used up), poll for
+# this long before trying again, doubling up to INOTIFY_RETRY_MAX
+INOTIFY_RETRY = 5.0
+INOTIFY_RETRY_MAX = 300.0
+CONNECT_TIMEOUT = 30  # A bench radio may be switched on only after the cable is in
+
+# --- Watchers ---
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+class WatchLost(Exception):
+    """The watched directory went away (udev removes by-id with the last adapter)"""
+
+class InotifyWatcher:
+    """Wake up as soon as an entry of 'directory' is created, renamed or removed"""
+    
+    _libc = None
+    
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1, libc.inotify_add_watch
+            except (OSError, AttributeError):
+                return False
+            cls._libc = libc
+        return True
+    
+    def __init__(self, directory):
+        if not self.available():
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {directory}: {os.strerror(errno)}")
+    
+    def wait(self, timeout):
+        """True if the directory changed within 'timeout' seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        pos = 0
+        while pos + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size + length
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                raise WatchLost()
+        return True
+    
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Fallback for systems without inotify: report a change every 'interval'"""
+    
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+    
+    def wait(self, timeout):
+        time.sleep(max(0.0, min(self.interval, timeout)))
+        return True
+    
+    def close(self):
+        pass
+
+# --- Jobs ---
+class FirmwareJob:
+    """Flash one preloaded firmware image; one fw_update_<port>.log per port"""
+    
+    def __init__(self, flash_path, baudrate=115200, window=1, force=False, connect_timeout=CONNECT_TIMEOUT,
+                 baud_cache=BAUD_CACHE, metrics_dir=None, log_dir='.', verbose=False):
+        self.flash_path = flash_path
+        self.image = fw_updater.validate_firmware_file(flash_path, force, prompt='yes' if force else 'no')
+        self.baudrate = baudrate
+        self.window = window
+        self.force = force
+        self.connect_timeout = connect_timeout
+        self.baud_cache = baud_cache
+        self.metrics_dir = metrics_dir
+        self.log_dir = log_dir
+        self.verbose = verbose
+    
+    def __call__(self, port):
+        tag = port_tag(port)
+        logger = fw_updater.setup_logging(self.verbose, os.path.join(self.log_dir, f"fw_update_{tag}.log"),
+                                          name=tag)
+        return fw_updater.updater(port, self.baudrate, self.flash_path, self.verbose, self.force, self.window,
+                                  check_port=False, prompt='no', image=self.image, logger=logger, quiet=True,
+                                  connect_timeout=self.connect_timeout, baud_cache=self.baud_cache,
+                                  metrics_dir=self.metrics_dir)
+
+class FontJob:
+    """Send one preloaded font image; one font_update_<port>.log per port"""
+    
+    def __init__(self, font_path, baud=115200, connect_timeout=CONNECT_TIMEOUT, baud_cache=BAUD_CACHE,
+                 metrics_dir=None, log_dir='.', verbose=False):
+        self.font_buffer = bytes(font_updater.load_font(font_path))
+        self.font_path = font_path
+        self.baud = baud
+        self.connect_timeout = connect_timeout
+        self.baud_cache = baud_cache
+        self.metrics_dir = metrics_dir
+        self.log_dir = log_dir
+        self.verbose = verbose
+    
+    def __call__(self, port):
+        tag = port_tag(port)
+        logger = font_updater.setup_logging(self.verbose, os.path.join(self.log_dir, f"font_update_{tag}.log"),
+                                            name=tag)
+        metrics = SessionMetrics('font', port, self.font_path)
+        try:
+            return font_updater.update_font_data(port, self.baud, self.font_buffer, self.verbose, check_port=False,
+                                                 assume_yes=True, connect_timeout=self.connect_timeout,
+                                                 baud_cache=self.baud_cache, metrics=metrics,
+                                                 metrics_dir=self.metrics_dir, logger=logger, quiet=True)
+        except font_updater.FontTransferError:
+            return False  # Already in the port's log
+
+# --- Station ---
+class FlashStation:
+    """
+    Run 'job(port)' for every matching adapter that appears in 'directory'.
+    
+    Args:
+        job: Callable taking the device path, returning True on success
+        directory: Directory of adapter symlinks (default: /dev/serial/by-id)
+        pattern: Regex an entry name must match (None: every entry)
+        workers: Jobs running at the same time
+        include_existing: Also start jobs for adapters present at startup
+        use_inotify: False forces polling every 'poll_interval' seconds
+        logger: Where plug events and job results are reported
+    """
+    
+    def __init__(self, job, directory=BY_ID_DIR, pattern=ADAPTER_PATTERN, workers=4, include_existing=False,
+                 use_inotify=True, poll_interval=POLL_INTERVAL, logger=None):
+        self.job = job
+        self.directory = directory
+        self.pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+        self.workers = workers
+        self.include_existing = include_existing
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.logger = logger or fw_updater.setup_logging(False, 'flash_station.log', name='station')
+        self.results = []
+        self.watcher_kind = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._inotify_retry_at = 0.0
+        self._inotify_backoff = INOTIFY_RETRY
+    
+    def scan(self):
+        """Matching entries of the directory: {name: device path}"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return {}
+        found = {}
+        for name in names:
+            if self.pattern is None or self.pattern.search(name):
+                found[name] = os.path.realpath(os.path.join(self.directory, name))
+        return found
+    
+    def _inotify_usable(self):
+        return (self.use_inotify and time.monotonic() >= self._inotify_retry_at
+                and os.path.isdir(self.directory) and InotifyWatcher.available())
+    
+    def _watcher(self):
+        if self._inotify_usable():
+            try:
+                watcher = InotifyWatcher(self.directory)
+                kind = 'inotify'
+                self._inotify_backoff = INOTIFY_RETRY
+            except OSError as e:
+                self.logger.warning(f"{e}; polling instead, retrying inotify in {self._inotify_backoff:.0f}s")
+                self._inotify_retry_at = time.monotonic() + self._inotify_backoff
+                self._inotify_backoff = min(self._inotify_backoff * 2, INOTIFY_RETRY_MAX)
+                watcher, kind = PollingWatcher(self.directory, self.poll_interval), 'polling'
+        else:
+            watcher, kind = PollingWatcher(self.directory, self.poll_interval), 'polling'
+        if kind != self.watcher_kind:
+            self.logger.info(f"Watching {self.directory} ({kind})")
+            self.watcher_kind = kind
+        return watcher
+    
+    def _run_job(self, name, port, plugged):
+        started = time.monotonic()
+        self.logger.info(f"{name}: starting on {port}, {(started - plugged) * 1000:.0f} ms after plug-in")
+        try:
+            ok = bool(self.job(port))
+            error = '' if ok else 'see log'
+        except Exception as e:
+            ok, error = False, str(e)
+        seconds = time.monotonic() - started
+        result = {'name': name, 'port': port, 'ok': ok, 'seconds': seconds,
+                  'start_latency': started - plugged, 'error': error}
+        with self._lock:
+            self.results.append(result)
+            self._pending.discard(name)
+        status = 'OK' if ok else f"FAILED ({error})"
+        self.logger.info(f"{name}: {status} in {seconds:.1f}s")
+        return result
+    
+    def run(self, max_jobs=None):
+        """Watch and dispatch until stop() (or until 'max_jobs' jobs have finished)"""
+        self._stop.clear()
+        known = {} if self.include_existing else self.scan()
+        if known:
+            self.logger.info(f"Ignoring {len(known)} adapter(s) already present: {', '.join(sorted(known))}")
+        submitted = 0
+        watcher = self._watcher()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='station') as pool:
+            try:
+                while not self._stop.is_set():
+                    current = self.scan()
+                    now = time.monotonic()
+                    for name in sorted(current.keys() - known.keys()):
+                        with self._lock:
+                            if name in self._pending:
+                                continue  # Replugged while its last job still runs
+                            self._pending.add(name)
+                        self.logger.info(f"{name}: plugged in ({current[name]})")
+                        pool.submit(self._run_job, name, current[name], now)
+                        submitted += 1
+                    for name in sorted(known.keys() - current.keys()):
+                        self.logger.info(f"{name}: unplugged")
+                    known = current
+                    
+                    if max_jobs is not None and submitted >= max_jobs:
+                        break
+                    try:
+                        watcher.wait(0.5)
+                    except WatchLost:
+                        watcher.close()
+                        watcher = self._watcher()
+                    if self.watcher_kind == 'polling' and self._inotify_usable():
+                        # The directory came (back), or the retry delay after a
+                        # failed start is over: switch to events when possible
+                        watcher.close()
+                        watcher = self._watcher()
+            finally:
+                watcher.close()
+        return self.results
+    
+    def stop(self):
+        self._stop.set()
+
+def format_station_results(results):
+    """One line per job plus totals"""
+    lines = []
+    for r in results:
+        status = 'OK' if r['ok'] else f"FAILED: {r['error']}"
+        lines.append(f"{r['name']:<48} {r['port']:<16} {r['seconds']:7.1f}s  "
+                     f"start +{r['start_latency'] * 1000:.0f} ms  {status}")
+    ok = sum(r['ok'] for r in results)
+    lines.append(f"{len(results)} jobs: {ok} OK, {len(results) - ok} failed")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Flash every radio adapter as it is plugged in')
+    what = parser.add_mutually_exclusive_group(required=True)
+    what.add_argument('--flash', help='Firmware image to flash (radios in update mode)')
+    what.add_argument('--font', help='Font .TXT or .bin to send (radios in normal mode)')
+    parser.add_argument('--baud', type=parse_baud, default=115200,
+                        help="Baudrate, or 'auto' to negotiate per adapter (default: 115200)")
+    parser.add_argument('--baud-cache', default=BAUD_CACHE, help=f'Negotiated rates per adapter (default: {BAUD_CACHE})')
+    parser.add_argument('--dir', default=BY_ID_DIR, help=f'Directory of adapter links to watch (default: {BY_ID_DIR})')
+    parser.add_argument('--match', default=ADAPTER_PATTERN,
+                        help="Regex for adapter names to flash ('' for all; default: CH340/CP210x/FTDI/PL2303)")
+    parser.add_argument('--workers', type=int, default=4, help='Jobs running at once (default: 4)')
+    parser.add_argument('--existing', action='store_true', help='Also flash adapters plugged in before startup')
+    parser.add_argument('--poll', action='store_true', help="Poll the directory instead of using inotify")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f'Seconds between directory scans when polling (default: {POLL_INTERVAL})')
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT,
+                        help=f'Seconds each job waits for its radio to answer (default: {CONNECT_TIMEOUT})')
+    parser.add_argument('--window', type=int, default=1, help='Firmware blocks sent ahead of their ACKs')
+    parser.add_argument('--force', action='store_true', help='Flash even if the firmware header looks wrong')
+    parser.add_argument('--log-dir', default='.', help='Directory for the station and per-port logs')
+    parser.add_argument('--metrics-dir', help='Export per-session metrics to this directory')
+    parser.add_argument('--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+    
+    os.makedirs(args.log_dir, exist_ok=True)
+    logger = fw_updater.setup_logging(args.verbose, os.path.join(args.log_dir, 'flash_station.log'), name='station')
+    try:
+        if args.flash:
+            job = FirmwareJob(args.flash, args.baud, args.window, args.force, args.connect_timeout,
+                              args.baud_cache, args.metrics_dir, args.log_dir, args.verbose)
+        else:
+            job = FontJob(args.font, args.baud, args.connect_timeout, args.baud_cache, args.metrics_dir,
+                          args.log_dir, args.verbose)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot load {args.flash or args.font}: {e}")
+        sys.exit(1)
+    logger.info(f"Loaded {args.flash or args.font}; waiting for adapters (Ctrl+C to stop)")
+    
+    station = FlashStation(job, args.dir, args.match or None, args.workers, args.existing,
+                           use_inotify=not args.poll, poll_interval=args.poll_interval, logger=logger)
+    runner = threading.Thread(target=station.run, name='station-watch', daemon=True)
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(0.5)
+    except KeyboardInterrupt:
+        logger.info("Stopping; waiting for running jobs to finish")
+        station.stop()
+        runner.join()
+    print(format_station_results(station.results))
+    sys.exit(0 if all(r['ok'] for r in station.results) else 1)
+
+if __name__ == '__main__':
+    main()
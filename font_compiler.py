@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Build the 458752-byte radio font image from BDF fonts and bitmap sheets.
+
+The image is a flat array of 16x16 glyphs, 32 bytes each: 16 rows of two
+bytes, most significant bit leftmost. Which character lives in which slot
+comes from a glyph index, read from the /*"X",N*/ comments of the vendor
+font.TXT (GB2312 encoded) or from a JSON file written by --write-index.
+
+Glyphs are handled as (N, 16, 16) NumPy arrays and packed with one
+np.packbits call per source, so a full rebuild takes milliseconds:
+
+    python font_compiler.py --base font.TXT --bdf wqy-16.bdf --txt new.TXT --out new.bin
+    python font_compiler.py --base font.TXT --sheet fixes.png --chars "啊阿" --out new.bin
+    python font_compiler.py --base font.TXT --dump-sheet font.pgm   # edit, then --sheet it back
+"""
+
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Checked in FontCompiler, the rest of the repo runs without it
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:  # Only needed for PNG and other non-netpbm sheets
+    Image = None
+
+from font_updater import FONT_DATA_SIZE, fit_font_buffer, parse_font_text
+
+GLYPH_SIZE = 16
+GLYPH_BYTES = GLYPH_SIZE * GLYPH_SIZE // 8
+GLYPH_SLOTS = FONT_DATA_SIZE // GLYPH_BYTES
+TEXT_ENCODING = 'gb2312'
+SHEET_COLUMNS = 64  # Glyphs per row in --dump-sheet output
+
+# /*"啊",0*/ after the second row of each glyph in font.TXT
+GLYPH_COMMENT_PATTERN = re.compile(rb'/\*"(.*?)",(\d+)\*/')
+
+# --- Glyph index ---
+def index_from_text(text):
+    """Map each character named in a font.TXT to its byte offset in the image"""
+    index = {}
+    for match in GLYPH_COMMENT_PATTERN.finditer(text):
+        try:
+            char = match.group(1).decode(TEXT_ENCODING)
+        except UnicodeDecodeError:
+            continue
+        if len(char) == 1:
+            index[char] = int(match.group(2)) * GLYPH_BYTES
+    return index
+
+def read_glyph_index(path):
+    """Load a glyph index from a font .TXT or a --write-index JSON file"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if path.lower().endswith('.json'):
+        return {char: int(offset) for char, offset in json.loads(raw)['offsets'].items()}
+    return index_from_text(raw)
+
+def read_font_image(path):
+    """Font bytes from a .TXT (0xNN text) or a raw binary image"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if path.lower().endswith('.txt'):
+        raw = parse_font_text(raw)
+    if len(raw) <= FONT_DATA_SIZE:
+        # The vendor font.TXT only covers the glyphs it names; the rest is blank
+        return bytearray(raw) + b'\xFF' * (FONT_DATA_SIZE - len(raw))
+    return fit_font_buffer(raw, path)
+
+# --- Sources ---
+def _properties(lines):
+    """Global BDF keywords up to the first STARTCHAR"""
+    props = {}
+    for line in lines:
+        if line.startswith('STARTCHAR'):
+            break
+        key, _, value = line.partition(' ')
+        props[key] = value.strip().strip('"')
+    return props
+
+def read_bdf(path):
+    """
+    Rasterize every encoded glyph of a BDF font into a 16x16 cell.
+    
+    Glyphs sit on the font's baseline (FONT_ASCENT, else the bounding box);
+    whatever falls outside the cell is clipped. Fonts registered as GB2312
+    are mapped to Unicode.
+    
+    Returns:
+        tuple: (list of characters, uint8 array of shape (N, 16, 16))
+    """
+    with open(path, encoding='latin-1') as f:
+        lines = [line.rstrip('\r\n') for line in f]
+    props = _properties(lines)
+    fbb = [int(v) for v in props.get('FONTBOUNDINGBOX', '16 16 0 0').split()]
+    ascent = int(props.get('FONT_ASCENT', fbb[1] + fbb[3]))
+    x_shift = max(0, -fbb[2])
+    gb2312 = props.get('CHARSET_REGISTRY', '').upper().startswith('GB2312')
+    
+    chars, cells = [], []
+    code = bbx = None
+    bitmap = None
+    for line in lines:
+        if bitmap is not None:
+            if line != 'ENDCHAR':
+                bitmap.append(line.strip())
+                continue
+            char = _bdf_char(code, gb2312)
+            if char is not None and bbx is not None:
+                cells.append(_bdf_cell(bitmap, bbx, ascent, x_shift))
+                chars.append(char)
+            bitmap = None
+        elif line.startswith('ENCODING'):
+            code = int(line.split()[1])
+        elif line.startswith('BBX'):
+            bbx = [int(v) for v in line.split()[1:5]]
+        elif line == 'BITMAP':
+            bitmap = []
+        elif line.startswith('STARTCHAR'):
+            code = bbx = None
+    pixels = np.stack(cells) if cells else np.zeros((0, GLYPH_SIZE, GLYPH_SIZE), np.uint8)
+    return chars, pixels
+
+def _bdf_char(code, gb2312):
+    if code is None or code < 0:
+        return None
+    if not gb2312:
+        return chr(code)
+    try:
+        return bytes([(code >> 8) | 0x80, (code & 0xFF) | 0x80]).decode(TEXT_ENCODING)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def _bdf_cell(rows, bbx, ascent, x_shift):
+    """Place one BDF bitmap (hex rows) in a 16x16 cell"""
+    width, height, x_off, y_off = bbx
+    cell = np.zeros((GLYPH_SIZE, GLYPH_SIZE), np.uint8)
+    if not rows or width <= 0:
+        return cell
+    row_bytes = len(rows[0]) // 2
+    data = np.frombuffer(bytes.fromhex(''.join(rows)), np.uint8).reshape(len(rows), row_bytes)
+    glyph = np.unpackbits(data, axis=1)[:height, :width]
+    top = ascent - (y_off + height)
+    left = x_off + x_shift
+    # Clip the glyph box against the cell
+    y0, x0 = max(top, 0), max(left, 0)
+    y1, x1 = min(top + glyph.shape[0], GLYPH_SIZE), min(left + glyph.shape[1], GLYPH_SIZE)
+    if y0 < y1 and x0 < x1:
+        cell[y0:y1, x0:x1] = glyph[y0 - top:y1 - top, x0 - left:x1 - left]
+    return cell
+
+def _read_netpbm(path):
+    """Gray levels of a binary PBM (P4) or 8-bit PGM (P5) as a 2-D uint8 array"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    fields, pos = [], 0
+    wanted = 3 if raw[:2] == b'P4' else 4
+    while len(fields) < wanted:
+        match = re.compile(rb'\s*(#[^\n]*\n\s*)*(\S+)').match(raw, pos)
+        if not match:
+            raise ValueError(f"{path}: truncated netpbm header")
+        fields.append(match.group(2))
+        pos = match.end()
+    pos += 1  # Single whitespace byte before the raster
+    magic, width, height = fields[0], int(fields[1]), int(fields[2])
+    if magic == b'P4':
+        rows = np.frombuffer(raw, np.uint8, height * ((width + 7) // 8), pos).reshape(height, -1)
+        return np.where(np.unpackbits(rows, axis=1)[:, :width], 0, 255).astype(np.uint8)
+    if magic == b'P5' and int(fields[3]) < 256:
+        return np.frombuffer(raw, np.uint8, width * height, pos).reshape(height, width)
+    raise ValueError(f"{path}: only binary PBM (P4) and 8-bit PGM (P5) are read without Pillow")
+
+def read_sheet(path, threshold=128, invert=False):
+    """
+    Cut a glyph sheet (16x16 cells, row by row) into glyphs.
+    
+    Dark pixels are ink unless 'invert'. PBM/PGM files are read directly;
+    PNG and other formats need Pillow.
+    
+    Returns:
+        uint8 array of shape (N, 16, 16)
+    """
+    if path.lower().endswith(('.pbm', '.pgm')):
+        gray = _read_netpbm(path)
+    elif Image is None:
+        raise RuntimeError(f"Reading {path} needs Pillow (pip install pillow); PBM/PGM sheets work without it")
+    else:
+        with Image.open(path) as img:
+            gray = np.asarray(img.convert('L'))
+    rows, cols = gray.shape[0] // GLYPH_SIZE, gray.shape[1] // GLYPH_SIZE
+    ink = gray[:rows * GLYPH_SIZE, :cols * GLYPH_SIZE] >= threshold if invert else \
+        gray[:rows * GLYPH_SIZE, :cols * GLYPH_SIZE] < threshold
+    cells = ink.reshape(rows, GLYPH_SIZE, cols, GLYPH_SIZE).swapaxes(1, 2)
+    return cells.reshape(-1, GLYPH_SIZE, GLYPH_SIZE).astype(np.uint8)
+
+# --- Compiler ---
+class FontCompiler:
+    """
+    A font image being built: 'buffer' holds FONT_DATA_SIZE bytes (0xFF
+    where nothing is defined) and 'index' maps characters to byte offsets.
+    
+    Args:
+        buffer: Starting image (default: blank)
+        index: Glyph index (default: empty, so only slot numbers work)
+    """
+    
+    def __init__(self, buffer=None, index=None):
+        if np is None:
+            raise RuntimeError("font_compiler needs NumPy (pip install numpy)")
+        self.buffer = bytearray(buffer) if buffer is not None else bytearray(b'\xFF' * FONT_DATA_SIZE)
+        self.index = dict(index or {})
+        self.glyphs = np.frombuffer(self.buffer, np.uint8).reshape(GLYPH_SLOTS, GLYPH_BYTES)
+        self.missing = []
+    
+    def slots(self, chars):
+        """Slot numbers for 'chars' (-1 where the index has no such character)"""
+        return np.array([self.index.get(c, -GLYPH_BYTES) // GLYPH_BYTES for c in chars], dtype=np.int64)
+    
+    def place(self, slots, pixels):
+        """Pack (N, 16, 16) pixel arrays into the given slots; negative slots are skipped"""
+        slots = np.asarray(slots, dtype=np.int64)
+        keep = (slots >= 0) & (slots < GLYPH_SLOTS)
+        packed = np.packbits(np.asarray(pixels, dtype=bool), axis=2).reshape(len(slots), GLYPH_BYTES)
+        self.glyphs[slots[keep]] = packed[keep]
+        return int(keep.sum())
+    
+    def replace(self, chars, pixels, only=None, strict=True):
+        """
+        Replace the glyphs of 'chars' (one per pixel array). With 'strict',
+        characters not in the index are collected in self.missing (a BDF
+        font usually covers far more than the radio has room for); with
+        'only' the rest of 'chars' is ignored.
+        
+        Returns:
+            int: Number of glyphs replaced
+        """
+        if only is not None:
+            wanted = [i for i, c in enumerate(chars) if c in only]
+            chars, pixels = [chars[i] for i in wanted], pixels[wanted]
+        slots = self.slots(chars)
+        if strict:
+            self.missing.extend(c for c, slot in zip(chars, slots) if slot < 0)
+        return self.place(slots, pixels)
+    
+    def pixels(self, slots=None):
+        """Unpack glyphs (all, or the given slots) to (N, 16, 16) uint8 arrays"""
+        glyphs = self.glyphs if slots is None else self.glyphs[np.asarray(slots, dtype=np.int64)]
+        return np.unpackbits(glyphs.reshape(-1, GLYPH_SIZE, GLYPH_BYTES // GLYPH_SIZE), axis=2)
+    
+    def render(self, char):
+        """A glyph as 16 lines of text, for a quick look in the terminal"""
+        slot = self.slots([char])[0]
+        if slot < 0:
+            raise KeyError(f"{char!r} is not in the glyph index")
+        return '\n'.join(''.join('#' if bit else '.' for bit in row) for row in self.pixels([slot])[0])
+    
+    # --- Output ---
+    def write_binary(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.buffer)
+    
+    def write_text(self, path):
+        """
+        Write the vendor .TXT layout: two lines of 16 '0xNN,' per glyph, the
+        second ending in /*"X",N*/. Every slot up to the last named or
+        non-blank glyph is written so the byte order stays intact.
+        """
+        names = {offset // GLYPH_BYTES: char for char, offset in self.index.items()}
+        used = np.nonzero((self.glyphs != 0xFF).any(axis=1))[0]
+        count = max(max(names, default=-1), int(used[-1]) if len(used) else -1) + 1
+        hex_bytes = [f"0x{b:02X}," for b in range(256)]
+        lines = []
+        for slot in range(count):
+            cells = [hex_bytes[b] for b in self.buffer[slot * GLYPH_BYTES:(slot + 1) * GLYPH_BYTES]]
+            lines.append(''.join(cells[:16]))
+            lines.append(f"{''.join(cells[16:])}/*\"{names.get(slot, '')}\",{slot}*/")
+        with open(path, 'w', encoding=TEXT_ENCODING, newline='\n') as f:
+            f.write('\n'.join(lines) + '\n')
+    
+    def write_index(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'glyph_bytes': GLYPH_BYTES, 'offsets': self.index}, f, ensure_ascii=False, indent=0)
+    
+    def write_sheet(self, path, columns=SHEET_COLUMNS):
+        """Write every glyph up to the last indexed one as a black-on-white PGM (or PNG with Pillow)"""
+        count = max(self.index.values(), default=GLYPH_SLOTS * GLYPH_BYTES - GLYPH_BYTES) // GLYPH_BYTES + 1
+        rows = -(-count // columns)
+        # Unused cells look like blank (0xFF) glyphs so the sheet reads back unchanged
+        cells = np.ones((rows * columns, GLYPH_SIZE, GLYPH_SIZE), np.uint8)
+        cells[:count] = self.pixels(range(count))
+        sheet = cells.reshape(rows, columns, GLYPH_SIZE, GLYPH_SIZE).swapaxes(1, 2)
+        gray = np.where(sheet.reshape(rows * GLYPH_SIZE, columns * GLYPH_SIZE), 0, 255).astype(np.uint8)
+        if path.lower().endswith('.pgm'):
+            with open(path, 'wb') as f:
+                f.write(f"P5\n{gray.shape[1]} {gray.shape[0]}\n255\n".encode('ascii'))
+                f.write(gray.tobytes())
+        elif Image is None:
+            raise RuntimeError(f"Writing {path} needs Pillow (pip install pillow); use a .pgm name instead")
+        else:
+            Image.fromarray(gray, 'L').save(path)
+
+def parse_chars(text):
+    """Characters for sheet cells: literal text, with U+XXXX allowed; whitespace separates"""
+    chars = []
+    for token in text.split():
+        if re.fullmatch(r'[Uu]\+[0-9A-Fa-f]{4,6}', token):
+            chars.append(chr(int(token[2:], 16)))
+        else:
+            chars.extend(token)
+    return chars
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the radio font image from BDF fonts and glyph sheets')
+    parser.add_argument('--base', help='Starting font: vendor .TXT or binary image (default: blank)')
+    parser.add_argument('--index', help='Glyph index: a font .TXT or --write-index JSON (default: from --base .TXT)')
+    parser.add_argument('--bdf', action='append', default=[], help='BDF font to take glyphs from (repeatable)')
+    parser.add_argument('--sheet', action='append', default=[],
+                        help='Glyph sheet of 16x16 cells (PBM/PGM, or PNG with Pillow), repeatable')
+    parser.add_argument('--chars', help='Characters of the --sheet cells in order, e.g. "啊阿" or "U+554A U+963F" '
+                                        '(default: the sheet covers slots 0, 1, 2, ...)')
+    parser.add_argument('--chars-file', help='Read --chars from this UTF-8 file')
+    parser.add_argument('--only', help='Replace only these characters from the BDF fonts and sheets')
+    parser.add_argument('--threshold', type=int, default=128, help='Sheet gray level below which a pixel is ink')
+    parser.add_argument('--invert', action='store_true', help='Sheets are light glyphs on a dark background')
+    parser.add_argument('--out', help='Write the binary font image (font_updater.py --font accepts .bin)')
+    parser.add_argument('--txt', help='Write the font in the vendor .TXT format')
+    parser.add_argument('--write-index', metavar='FILE', help='Save the glyph index as JSON')
+    parser.add_argument('--dump-sheet', metavar='FILE', help='Save all glyphs as an editable sheet (.pgm, or .png with Pillow)')
+    parser.add_argument('--show', help='Print these characters as text bitmaps')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    start = time.perf_counter()
+    try:
+        buffer = read_font_image(args.base) if args.base else None
+        index_path = args.index or (args.base if args.base and args.base.lower().endswith('.txt') else None)
+        font = FontCompiler(buffer, read_glyph_index(index_path) if index_path else None)
+        only = set(parse_chars(args.only)) if args.only else None
+        if only:
+            font.missing.extend(c for c in only if c not in font.index)
+        
+        replaced = 0
+        for path in args.bdf:
+            chars, pixels = read_bdf(path)
+            count = font.replace(chars, pixels, only, strict=False)
+            logging.info(f"{path}: {count} of {len(chars)} glyphs placed")
+            replaced += count
+        
+        chars = args.chars
+        if args.chars_file:
+            with open(args.chars_file, encoding='utf-8') as f:
+                chars = f.read()
+        for path in args.sheet:
+            pixels = read_sheet(path, args.threshold, args.invert)
+            if chars is None:
+                count = font.place(range(len(pixels)), pixels)
+            else:
+                names = parse_chars(chars)[:len(pixels)]
+                count = font.replace(names, pixels[:len(names)], only)
+            logging.info(f"{path}: {count} of {len(pixels)} cells placed")
+            replaced += count
+        
+        if font.missing:
+            shown = ''.join(sorted(set(font.missing))[:40])
+            logging.warning(f"{len(set(font.missing))} characters are not in the glyph index and were skipped: {shown}")
+        
+        if args.out:
+            font.write_binary(args.out)
+        if args.txt:
+            font.write_text(args.txt)
+        if args.write_index:
+            font.write_index(args.write_index)
+        if args.dump_sheet:
+            font.write_sheet(args.dump_sheet)
+        for char in parse_chars(args.show) if args.show else []:
+            print(f"{char} (U+{ord(char):04X})\n{font.render(char)}\n")
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        logging.error(str(e))
+        sys.exit(1)
+    logging.info(f"{replaced} glyphs replaced, {len(font.index)} indexed, "
+                 f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -26,323 +26,583 @@
 #For more information, please refer to <http://unlicense.org/>
 
 import argparse
-import serial
+import hashlib
+import mmap
+import struct
 import time
 import re
+import statistics
 import sys
 import os
 import logging
-from contextlib import contextmanager
+
+from flash_metrics import SessionMetrics, format_metrics
+from serial_trace import SerialTrace
+from serial_port import print_ports, safe_serial, serial_errors, verify_serial_port
+from radio_link import (BAUD_CACHE, FALLBACK_BAUD, BaudMemory, ConnectTimeout, connect,
+                        format_baud_report, negotiate_baud, parse_baud, read_until)
 
 # --- Setup Logging ---
-def setup_logging(verbose=False, log_file='font_update.log'):
-    """Configure logging with appropriate level"""
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def setup_logging(verbose=False, log_file='font_update.log', name=None):
+    """
+    Configure logging with appropriate level.
+    
+    Without 'name' this sets up the root logger for a single session. With a
+    name (one session per port) it returns a separate 'font_updater.<name>'
+    logger that writes to its own log file and only echoes warnings to the
+    console.
+    """
     level = logging.DEBUG if verbose else logging.INFO
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(log_file, mode='w')  # Overwrite previous log
-        ]
-    )
-    return logging.getLogger('font_updater')
+    if name is None:
+        logging.basicConfig(
+            level=level,
+            format=LOG_FORMAT,
+            handlers=[
+                logging.StreamHandler(),
+                logging.FileHandler(log_file, mode='w')  # Overwrite previous log
+            ]
+        )
+        return logging.getLogger('font_updater')
+    
+    logger = logging.getLogger(f'font_updater.{name}')
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    
+    file_handler = logging.FileHandler(log_file, mode='w')  # Overwrite previous log
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(file_handler)
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING)
+    console.setFormatter(logging.Formatter(f'%(asctime)s - {name} - %(levelname)s - %(message)s'))
+    logger.addHandler(console)
+    return logger
 
-# --- Helper Functions ---
-@contextmanager
-def safe_serial(port, baudrate, **kwargs):
-    """Context manager for safer serial port handling"""
-    ser = None
-    try:
-        ser = serial.Serial(port, baudrate, **kwargs)
-        yield ser
-    except serial.SerialException as e:
-        raise RuntimeError(f"Serial port error: {e}")
-    finally:
-        if ser and ser.is_open:
-            try:
-                ser.close()
-                logging.debug("Serial port closed")
-            except Exception as e:
-                logging.warning(f"Error closing serial port: {e}")
+# --- Font Data ---
+FONT_DATA_SIZE = 458752  # C# Global.EEROM size
+HEX_BYTE_PATTERN = re.compile(rb'0x([0-9a-fA-F]{2})')
 
-def verify_serial_port(port):
-    """Check if the serial port is likely to be a programming adapter"""
-    try:
-        # List serial ports with descriptions
-        import serial.tools.list_ports
-        ports = list(serial.tools.list_ports.comports())
-        
-        # Find our port in the list
-        port_info = next((p for p in ports if p.device == port), None)
-        if not port_info:
-            logging.warning(f"Port {port} not found in system device list")
-            return False
-            
-        # Check for known programming adapter keywords
-        adapter_keywords = ['CH340', 'CP210', 'FTDI', 'USB Serial', 'USB-Serial']
-        if not any(keyword in port_info.description for keyword in adapter_keywords):
-            logging.warning(f"Port {port} ({port_info.description}) might not be a programming adapter")
-            if input("This doesn't appear to be a programming adapter. Continue? (y/n): ").lower() != 'y':
-                return False
-        
-        return True
-    except Exception as e:
-        logging.warning(f"Failed to verify serial port: {e}")
-        return True  # Continue anyway on error
+# Compiled font cache: header followed by the FONT_DATA_SIZE byte image
+FONT_CACHE_EXT = '.fontbin'
+FONT_BINARY_EXT = '.bin'  # Raw images as written by font_compiler.py --out
+FONT_CACHE_MAGIC = b'BFFONT\x01\x00'
+FONT_CACHE_HEADER = struct.Struct('>8s32sQQI4x')  # magic, source SHA-256, source size, mtime_ns, parsed bytes
+
+def parse_font_text(text):
+    """Extract every 0xNN byte from the raw (undecoded) font text in one pass"""
+    return bytes.fromhex(b''.join(HEX_BYTE_PATTERN.findall(text)).decode('ascii'))
+
+def fit_font_buffer(data, path=None):
+    """Pad or truncate parsed font data to FONT_DATA_SIZE, warning when either happens"""
+    source = f" in {path}" if path else ""
+    if len(data) < FONT_DATA_SIZE:
+        logging.warning(f"Font data{source} is {len(data)} bytes; padding with 0xFF to {FONT_DATA_SIZE}")
+        return bytearray(data) + b'\xFF' * (FONT_DATA_SIZE - len(data))
+    if len(data) > FONT_DATA_SIZE:
+        logging.warning(f"Font data{source} is {len(data)} bytes; truncating to {FONT_DATA_SIZE}")
+    return bytearray(data[:FONT_DATA_SIZE])
 
 def parse_font_file(path):
     """Parse a font text file into a bytes buffer (like C# btnChineseOpen_Click)."""
-    buffer = bytearray()
-    hex_pattern = re.compile(r'0x([0-9a-fA-F]{2})')
-    with open(path, encoding='utf-8', errors='ignore') as f:
-        for line in f:
-            for match in hex_pattern.finditer(line):
-                buffer.append(int(match.group(1), 16))
+    with open(path, 'rb') as f:
+        data = parse_font_text(f.read())
     # Pad to 458752 bytes (C# Global.EEROM size)
-    if len(buffer) < 458752:
-        buffer += b'\xFF' * (458752 - len(buffer))
-    elif len(buffer) > 458752:
-        buffer = buffer[:458752]
+    return fit_font_buffer(data, path)
+
+def font_cache_path(path):
+    """Where the compiled cache for a font text file lives"""
+    return os.path.splitext(path)[0] + FONT_CACHE_EXT
+
+def compile_font_cache(path, cache_path=None):
+    """Parse 'path' and write its compiled cache; returns the font buffer"""
+    cache_path = cache_path or font_cache_path(path)
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        text = f.read()
+    data = parse_font_text(text)
+    buffer = fit_font_buffer(data, path)
+    
+    header = FONT_CACHE_HEADER.pack(FONT_CACHE_MAGIC, hashlib.sha256(text).digest(),
+                                    st.st_size, st.st_mtime_ns, len(data))
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(buffer)
+        os.replace(tmp_path, cache_path)  # Readers keep their old mapping
+        logging.debug(f"Wrote font cache {cache_path}")
+    except OSError as e:
+        logging.debug(f"Could not write font cache {cache_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
     return buffer
 
-def print_progress(percent, msg="", last_percent=[0]):
-    """Display progress with ETA estimation"""
-    # Only update if percentage changed significantly
-    if percent - last_percent[0] >= 1 or percent >= 100:
-        last_percent[0] = percent
-        elapsed = time.time() - print_progress.start_time
-        
-        if percent > 0:
-            eta_seconds = (elapsed / percent) * (100 - percent)
-            eta = f"ETA: {int(eta_seconds/60)}m {int(eta_seconds%60)}s" if percent < 100 else "Complete"
-            print(f"\r{percent:.1f}% {msg} [{eta}]", end='', flush=True)
-        else:
-            print(f"\r{percent:.1f}% {msg}", end='', flush=True)
-
-# Initialize progress tracker
-print_progress.start_time = 0
-
-def update_font_data(port, baud, font_buffer, verbose=False):
-    """Update the radio's font data with improved error handling and reporting"""
-    logger = setup_logging(verbose)
+def _read_font_cache(path, cache_path):
+    """Map a cache file if it matches the source; None if missing or stale"""
+    try:
+        f = open(cache_path, 'rb')
+    except OSError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size != FONT_CACHE_HEADER.size + FONT_DATA_SIZE:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    magic, digest, size, mtime_ns, parsed = FONT_CACHE_HEADER.unpack_from(mm)
+    st = os.stat(path)
+    if magic != FONT_CACHE_MAGIC:
+        mm.close()
+        return None
+    if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+        # Touched or edited: only the content hash can tell
+        with open(path, 'rb') as f:
+            if hashlib.sha256(f.read()).digest() != digest:
+                mm.close()
+                return None
+        # Same content: record the new size/mtime so the next load skips the hash
+        try:
+            with open(cache_path, 'r+b') as f:
+                f.write(FONT_CACHE_HEADER.pack(magic, digest, st.st_size, st.st_mtime_ns, parsed))
+        except OSError:
+            pass
+    
+    if parsed != FONT_DATA_SIZE:
+        action = "padded with 0xFF" if parsed < FONT_DATA_SIZE else "truncated"
+        logging.warning(f"Font data in {path} is {parsed} bytes; {action} to {FONT_DATA_SIZE}")
+    return memoryview(mm)[FONT_CACHE_HEADER.size:]
+
+def load_font(path, use_cache=True):
+    """
+    Return the font buffer for a text file, going through the compiled cache.
+    
+    A cache whose recorded size and mtime match the source is mapped directly;
+    otherwise the source hash decides, and a stale cache is rebuilt. A .bin
+    file is taken as the raw font image.
+    """
+    if path.lower().endswith(FONT_BINARY_EXT):
+        with open(path, 'rb') as f:
+            return fit_font_buffer(f.read(), path)
+    if not use_cache:
+        return parse_font_file(path)
+    cache_path = font_cache_path(path)
+    buffer = _read_font_cache(path, cache_path)
+    if buffer is not None:
+        logging.debug(f"Loaded font from cache {cache_path}")
+        return buffer
+    return compile_font_cache(path, cache_path)
+
+def progress_printer(output=print):
+    """
+    Return print_progress(percent, msg) for one session: it shows progress
+    with an ETA and keeps its own start time, so sessions can run side by side
+    """
+    start_time = time.time()
+    last_percent = 0
+    
+    def print_progress(percent, msg=""):
+        nonlocal last_percent
+        # Only update if percentage changed significantly
+        if percent - last_percent >= 1 or percent >= 100:
+            last_percent = percent
+            elapsed = time.time() - start_time
+            
+            if percent > 0:
+                eta_seconds = (elapsed / percent) * (100 - percent)
+                eta = f"ETA: {int(eta_seconds/60)}m {int(eta_seconds%60)}s" if percent < 100 else "Complete"
+                output(f"\r{percent:.1f}% {msg} [{eta}]", end='', flush=True)
+            else:
+                output(f"\r{percent:.1f}% {msg}", end='', flush=True)
+    return print_progress
+
+def _no_output(*args, **kwargs):
+    """Stand-in for print() when console output is muted"""
+
+# --- Font Transfer Engine ---
+FONT_BLOCK_SIZE = 4096
+FONT_WRITE_SIZE = 1024  # The C# tool writes each block as four 1 KB chunks
+FONT_ACK = 0x41  # 'A'
+FONT_HANDSHAKE = b'\x00' * 12 + b'\xFF' * 4
+CONNECT_TIMEOUT = 30
+FONT_END_BLOCK = b'END' + b'\xFF' * (FONT_BLOCK_SIZE - 3)
+
+class FontTransferError(Exception):
+    """The font update failed; 'exit_code' is what the CLI exits with"""
+    def __init__(self, message, exit_code=3):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+class FontUpdateCancelled(FontTransferError):
+    """The update was declined at the prompt or interrupted"""
+    def __init__(self, message="Update cancelled by user", exit_code=0):
+        super().__init__(message, exit_code)
+
+def wait_for_byte(spt, timeout=5):
+    """
+    Return the next byte from the radio, or b'' once 'timeout' has passed.
+    
+    radio_link.read_until blocks in the driver with the port timeout capped
+    to what is left, so this wakes as soon as the byte lands instead of on a
+    poll tick, and gives up on a port that keeps failing.
+    """
+    return read_until(spt, 1, time.monotonic() + timeout)
+
+def write_view(spt, view):
+    """
+    Write a memoryview without copying it into a bytes object first.
+    
+    pyserial turns every memoryview into bytes, so where the port has a file
+    descriptor the view goes to os.write() directly and pyserial only takes
+    over (under its write timeout) if the driver accepts part of it.
+    """
+    try:
+        fd = spt.fileno()
+    except (AttributeError, OSError, ValueError) + serial_errors():
+        fd = None
+    if fd is None:
+        spt.write(view)
+        return
+    try:
+        written = os.write(fd, view)
+    except BlockingIOError:
+        written = 0
+    if written < len(view):
+        spt.write(view[written:])
+
+def font_blocks(font_buffer, block_size=FONT_BLOCK_SIZE):
+    """
+    Yield (address, block) for the font data as views into 'font_buffer'.
+    
+    Only a short final block is copied, to pad it with 0xFF.
+    """
+    view = memoryview(font_buffer).cast('B')
+    for addr in range(0, len(view), block_size):
+        block = view[addr:addr + block_size]
+        if len(block) < block_size:
+            block = memoryview(bytes(block) + b'\xFF' * (block_size - len(block)))
+        yield addr, block
+
+def send_font_block(spt, block, write_size=FONT_WRITE_SIZE, ack_timeout=5):
+    """
+    Send one block in 'write_size' writes (0 = a single write) and wait for
+    its ACK. Returns the ACK byte (b'' on timeout) and the write-to-ACK time.
+    """
+    step = write_size or len(block)
+    for k in range(0, len(block), step):
+        write_view(spt, block[k:k + step])
+    sent = time.perf_counter()
+    resp = wait_for_byte(spt, ack_timeout)
+    return resp, time.perf_counter() - sent
+
+def send_font_data(spt, font_buffer, write_size=FONT_WRITE_SIZE, ack_timeout=5,
+                   progress=None, logger=None, metrics=None):
+    """
+    Send every font block and the END block, each acknowledged with 'A'.
+    
+    'progress' is called as progress(block, total) after each data block.
+    Returns the per-block ACK latencies in seconds, END block last. Raises
+    FontTransferError when a block is not acknowledged. With 'metrics' the
+    'upload' and 'end' phases and each data block's ACK are recorded.
+    """
+    log = logger or logging
+    metrics = metrics or SessionMetrics('font', getattr(spt, 'port', None) or '')
+    upload_start = time.perf_counter()
+    total = (len(font_buffer) + FONT_BLOCK_SIZE - 1) // FONT_BLOCK_SIZE
+    latencies = []
+    
+    for number, (addr, block) in enumerate(font_blocks(font_buffer), 1):
+        resp, latency = send_font_block(spt, block, write_size, ack_timeout)
+        if not resp:
+            metrics.count('timeouts')
+            raise FontTransferError(f"Timeout waiting for ACK at address {addr}")
+        metrics.observe_ack(latency)
+        if resp[0] != FONT_ACK:
+            metrics.count('nacks')
+            raise FontTransferError(f"ACK not received after data block at address {addr}. Got: {resp.hex()}")
+        latencies.append(latency)
+        log.debug(f"Block at address {addr} acknowledged in {latency * 1000:.2f} ms")
+        if progress:
+            progress(number, total)
+    
+    metrics.add_phase('upload', time.perf_counter() - upload_start)
+    metrics.bytes = len(font_buffer)
+    
+    log.info("All data blocks sent, sending END block")
+    with metrics.phase('end'):
+        resp, latency = send_font_block(spt, memoryview(FONT_END_BLOCK), write_size, ack_timeout)
+    if not resp:
+        raise FontTransferError("Timeout waiting for final ACK", exit_code=4)
+    if resp[0] != FONT_ACK:
+        raise FontTransferError(f"ACK not received after END block. Got: {resp.hex()}", exit_code=4)
+    latencies.append(latency)
+    return latencies
+
+def format_ack_latency(latencies):
+    """One-line summary of per-block ACK latencies"""
+    if not latencies:
+        return "No blocks acknowledged"
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    return (f"ACK latency over {len(ordered)} blocks: "
+            f"median {statistics.median(ordered) * 1000:.2f} ms, "
+            f"p95 {p95 * 1000:.2f} ms, max {ordered[-1] * 1000:.2f} ms, "
+            f"total {sum(ordered):.2f} s")
+
+def update_font_data(port, baud, font_buffer, verbose=False, check_port=True, assume_yes=False,
+                     write_size=FONT_WRITE_SIZE, connect_timeout=CONNECT_TIMEOUT, baud_cache=BAUD_CACHE,
+                     metrics=None, metrics_dir=None, trace_path=None, trace_always=False, progress=None,
+                     logger=None, quiet=False):
+    """
+    Update the radio's font data with improved error handling and reporting.
+    
+    'check_port' and the normal-mode prompt ('assume_yes') can be turned off
+    for unattended runs, e.g. against radio_emulator.py. 'write_size' is how
+    many bytes of each 4 KB block go out per write (0 = the whole block).
+    The handshake frame is repeated for up to 'connect_timeout' seconds.
+    A 'baud' of 'auto' probes for the fastest rate the radio answers at (see
+    radio_link.negotiate_baud) and remembers it in 'baud_cache'.
+    
+    'logger' replaces the global log setup and 'quiet' mutes the console
+    output and progress bar, for sessions running side by side.
+    
+    Phase timings and ACK latencies go into 'metrics' (a
+    flash_metrics.SessionMetrics, created if not given) and are exported to
+    'metrics_dir' when one is set.
+    
+    With 'trace_path' all serial traffic is kept in memory and saved there
+    if the update fails, or always with 'trace_always' (see serial_trace).
+    
+    'progress' replaces the progress bar: it is called as progress(block,
+    total) after every ACKed block. A KeyboardInterrupt raised from it
+    cancels the update like Ctrl+C does.
+    
+    Returns True on success. Failures raise FontTransferError, whose
+    'exit_code' tells them apart; a declined prompt or an interrupt raises
+    FontUpdateCancelled.
+    """
+    logger = logger or setup_logging(verbose)
+    metrics = metrics or SessionMetrics('font', port)
+    trace = None
+    if trace_path:
+        trace = SerialTrace(meta={'tool': 'font', 'port': port, 'baud': baud, 'write_size': write_size})
+    try:
+        _send_font(port, baud, font_buffer, verbose, check_port, assume_yes, write_size,
+                   connect_timeout, baud_cache, metrics, trace, progress, logger, quiet)
+        return True
+    finally:
+        metrics.finish(metrics.ok)
+        if trace is not None and (trace_always or not metrics.ok):
+            try:
+                logger.info(f"Serial trace saved to {trace.dump(trace_path)} ({len(trace)} records)")
+            except OSError as e:
+                logger.warning(f"Could not save serial trace to {trace_path}: {e}")
+        logger.info(format_metrics(metrics))
+        if metrics_dir:
+            try:
+                metrics.export(metrics_dir)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {metrics_dir}: {e}")
+
+def _send_font(port, baud, font_buffer, verbose, check_port, assume_yes, write_size,
+               connect_timeout, baud_cache, metrics, trace, progress, logger, quiet):
+    """The session behind update_font_data(); raises FontTransferError on failure"""
+    console = _no_output if quiet else print
     logger.info(f"Starting font update on {port}")
     
     # Verify serial port
-    if not verify_serial_port(port):
+    if check_port and not verify_serial_port(port, logger=logger):
         logger.error(f"Serial port verification failed for {port}")
-        print(f"Serial port verification failed for {port}")
-        sys.exit(1)
+        raise FontTransferError(f"Serial port verification failed for {port}", exit_code=1)
     
     # Define constants
-    BLOCK_SIZE = 4096
-    CHUNK_SIZE = 1024
-    DATA_SIZE = 458752
     CMD_AUDIO = b'Font'
-    CMD_END = b'END\x00'
-    CMD_ACK = 0x41  # 'A'
 
-    # Initialize progress tracking
-    print_progress.start_time = time.time()
+    # Progress bar unless the caller tracks progress itself
+    print_progress = progress_printer(console)
 
     # Use safer serial connection
+    auto_baud = baud == 'auto'
+    open_start = time.perf_counter()
     with safe_serial(
         port=port,
-        baudrate=baud,
+        logger=logger,
+        trace=trace,
+        baudrate=FALLBACK_BAUD if auto_baud else baud,
         timeout=5,
         write_timeout=1,
         dsrdtr=True,
         rtscts=True
     ) as spt:
+        metrics.add_phase('port_open', time.perf_counter() - open_start)
         try:
-            logger.info(f"Opened port {port} at {baud} baud")
+            logger.info(f"Opened port {port} at {spt.baudrate} baud")
             if verbose:
-                print(f"Opened port {port} at {baud} baud.")
+                console(f"Opened port {port} at {spt.baudrate} baud.")
                 
             # Display radio mode instructions
-            print("\nIMPORTANT:")
-            print("The radio should be turned on normally (not in update mode)\n")
+            console("\nIMPORTANT:")
+            console("The radio should be turned on normally (not in update mode)\n")
             
-            proceed = input("Is the radio powered on in normal mode? (y/n): ").lower()
+            proceed = 'y' if assume_yes else input("Is the radio powered on in normal mode? (y/n): ").lower()
             if proceed != 'y':
                 logger.info("Update cancelled by user - radio not in normal mode")
-                print("Update cancelled")
-                sys.exit(0)
+                raise FontUpdateCancelled("Update cancelled")
 
-            # Handshake
+            # Handshake: probe fast while the radio settles, then back off
             logger.info("Starting handshake sequence")
-            for i in range(25):
-                handshake = bytearray(16)
-                handshake[:12] = b'\x00' * 12
-                handshake[12:16] = b'\xFF' * 4
-                spt.write(handshake)
-                if verbose:
-                    print(f"Sent handshake ({i+1}/25)")
-                time.sleep(0.2)
-                resp = spt.read(1)
-                if len(resp) == 1:
-                    logger.info("Handshake successful")
-                    if verbose:
-                        print("Handshake response received.")
-                    break
-            else:
-                logger.error("Handshake failed - no response from radio")
-                print("Handshake failed. Please check:")
-                print("1. Radio is powered ON in normal mode")
-                print("2. Cable is properly connected")
-                print("3. Verify correct serial port")
-                sys.exit(2)
-
-            time.sleep(0.2)
+            handshake_start = time.perf_counter()
+            try:
+                if auto_baud:
+                    memory = BaudMemory(baud_cache)
+                    baud_key = memory.key(port, 'font')
+                    # Any byte answers the handshake, but only 'A' counts as clean
+                    link, baud, probes = negotiate_baud(
+                        spt, FONT_HANDSHAKE, None, preferred=memory.get(baud_key).get('baud'),
+                        connect_timeout=connect_timeout, clean={bytes([FONT_ACK])}, logger=logger)
+                    memory.record_probes(baud_key, baud, probes)
+                    logger.info(f"Using {baud} baud\n{format_baud_report(probes, memory.get(baud_key))}")
+                else:
+                    link = connect(spt, FONT_HANDSHAKE, timeout=connect_timeout, logger=logger)
+            except ConnectTimeout as e:
+                logger.error(f"Handshake failed - no response from radio ({e})")
+                console("Handshake failed. Please check:")
+                console("1. Radio is powered ON in normal mode")
+                console("2. Cable is properly connected")
+                console("3. Verify correct serial port")
+                raise FontTransferError(f"Handshake failed - no response from radio ({e})", exit_code=2)
+            finally:
+                metrics.add_phase('handshake', time.perf_counter() - handshake_start)
+            metrics.baud = baud if auto_baud else spt.baudrate
+            logger.info("Handshake successful")
+            if verbose:
+                console(f"Handshake response received after {link.probes} probes "
+                        f"({link.seconds * 1000:.0f} ms).")
             spt.reset_input_buffer()
 
             # Send 'Font' command
             logger.info("Sending 'Font' command")
-            spt.write(CMD_AUDIO)
-            spt.write(b'\xFF' * 4)
+            with metrics.phase('font_command'):
+                spt.write(CMD_AUDIO)
+                spt.write(b'\xFF' * 4)
+                # Wait for 1 byte response
+                resp = wait_for_byte(spt, 5)
+            if verbose:
+                console("Sent 'Font' command and 4x 0xFF.")
+            if not resp:
+                logger.error("No response after 'Font' command")
+                raise FontTransferError("No response after 'Font' command. Update failed.")
+            logger.debug("Received response after 'Font' command")
             if verbose:
-                print("Sent 'Font' command and 4x 0xFF.")
-            # Wait for 1 byte response
-            timeout_start = time.time()
-            while True:
-                resp = spt.read(1)
-                if len(resp) == 1:
-                    logger.debug("Received response after 'Font' command")
-                    if verbose:
-                        print("Received response after 'Font' command.")
-                    break
-                if time.time() - timeout_start > 5:
-                    logger.error("No response after 'Font' command")
-                    print("No response after 'Font' command. Update failed.")
-                    sys.exit(3)
-                time.sleep(0.02)
+                console("Received response after 'Font' command.")
             spt.reset_input_buffer()
 
             # Data transfer
             logger.info("Beginning font data transfer")
-            data_addr = 0
-            cur_times = 0
-            total_blocks = (DATA_SIZE + BLOCK_SIZE - 1) // BLOCK_SIZE
-            current_block = 0
+            if progress is None:
+                print_progress(0, "Starting font transfer")
             
-            # Print initial progress
-            print_progress(0, "Starting font transfer")
+            def show_progress(block, total):
+                print_progress(block * 100 / total, f"Writing block {block}/{total}")
             
-            while data_addr < DATA_SIZE:
-                current_block += 1
-                real_len = min(BLOCK_SIZE, DATA_SIZE - data_addr)
-                real_data = font_buffer[cur_times:cur_times+real_len]
-                # Pad to 4096 bytes if needed
-                if len(real_data) < BLOCK_SIZE:
-                    real_data += b'\xFF' * (BLOCK_SIZE - len(real_data))
-                # Write in 1024-byte chunks
-                for k in range(0, BLOCK_SIZE, CHUNK_SIZE):
-                    spt.write(real_data[k:k+CHUNK_SIZE])
-                
-                # Update progress display (always on same line)
-                progress = (current_block * 100) / total_blocks
-                print_progress(progress, f"Writing block {current_block}/{total_blocks}")
-                
-                # Log verbose info to file only, don't print to console during transfers
-                if verbose:
-                    logger.debug(f"Sent data block at address {data_addr}")
-                
-                # Wait for ACK with timeout
-                timeout_start = time.time()
-                while True:
-                    resp = spt.read(1)
-                    if len(resp) == 1:
-                        break
-                    if time.time() - timeout_start > 5:
-                        logger.error(f"Timeout waiting for ACK at address {data_addr}")
-                        print(f"\nTimeout waiting for ACK at address {data_addr}")
-                        sys.exit(3)
-                    time.sleep(0.02)
-                
-                if resp[0] != CMD_ACK:
-                    logger.error(f"ACK not received after data block at address {data_addr}. Got: {resp.hex()}")
-                    print(f"\nACK not received after data block at address {data_addr}. Got: {resp.hex()}")
-                    sys.exit(3)
-                
-                logger.debug(f"Block at address {data_addr} acknowledged")
-                data_addr += real_len
-                cur_times += real_len
+            transfer_start = time.monotonic()
+            try:
+                latencies = send_font_data(spt, font_buffer, write_size=write_size,
+                                           progress=progress or show_progress, logger=logger, metrics=metrics)
+            except FontTransferError as e:
+                logger.error(str(e))
+                console()  # End the progress line
+                raise
 
-            # Mark progress as complete
-            print_progress(100, "Font data transfer complete")
-            print()  # Add newline after progress display
+            if progress is None:
+                print_progress(100, "Font data transfer complete")
+                console()  # Add newline after progress display
+            transfer_seconds = time.monotonic() - transfer_start
+            logger.info(f"Sent {len(font_buffer)} bytes in {transfer_seconds:.2f}s "
+                        f"({len(font_buffer) / transfer_seconds:.0f} bytes/s at {baud} baud)")
+            if auto_baud:
+                memory.record_transfer(baud_key, baud, len(font_buffer), transfer_seconds)
+            if verbose:
+                console("Sent END block.")
             
-            logger.info("All data blocks sent, sending END block")
-
-            # Send END block
-            end_block = bytearray(BLOCK_SIZE)
-            end_block[0:3] = b'END'
-            end_block[3:] = b'\xFF' * (BLOCK_SIZE - 3)
-            for k in range(0, BLOCK_SIZE, CHUNK_SIZE):
-                spt.write(end_block[k:k+CHUNK_SIZE])
+            report = format_ack_latency(latencies)
+            logger.info(report)
             if verbose:
-                print("Sent END block.")
-                
-            # Wait for ACK with timeout
-            logger.debug("Waiting for final ACK")
-            timeout_start = time.time()
-            while True:
-                resp = spt.read(1)
-                if len(resp) == 1:
-                    break
-                if time.time() - timeout_start > 5:
-                    logger.error("Timeout waiting for final ACK")
-                    print("\nTimeout waiting for final ACK")
-                    sys.exit(4)
-                time.sleep(0.02)
-                
-            if resp[0] != CMD_ACK:
-                logger.error(f"ACK not received after END block. Got: {resp.hex()}")
-                print(f"ACK not received after END block. Got: {resp.hex()}")
-                sys.exit(4)
+                console(report)
 
+            metrics.ok = True
             logger.info("Font data update successful")
-            print("\nFont data update successful!")
+            console("\nFont data update successful!")
 
-        except serial.SerialException as e:
+        except FontTransferError:
+            raise
+        except serial_errors() as e:
             logger.exception(f"Serial error: {e}")
-            print(f"\nSerial error: {e}")
-            sys.exit(5)
+            raise FontTransferError(f"Serial error: {e}", exit_code=5) from e
         except KeyboardInterrupt:
             logger.warning("Update cancelled by user")
-            print("\nUpdate cancelled by user")
-            sys.exit(0)
+            raise FontUpdateCancelled() from None
         except Exception as e:
             logger.exception(f"Unexpected error: {e}")
-            print(f"\nUnexpected error: {e}")
-            sys.exit(6)
+            raise FontTransferError(f"Unexpected error: {e}", exit_code=6) from e
 
-def main():
+def main(argv=None, prog=None):
     parser = argparse.ArgumentParser(
+        prog=prog,
         description="Update radio font data via serial port. Radio must be powered ON in normal mode."
     )
     parser.add_argument('--port', required=True, help='Serial port (e.g. COM3 or /dev/ttyUSB0)')
-    parser.add_argument('--font', required=True, help='Font text file')
-    parser.add_argument("--baud", type=int, default=115200, help="Baudrate (default: 115200)")
+    parser.add_argument('--font', required=True, help=f'Font text file, or a {FONT_BINARY_EXT} image from font_compiler.py')
+    parser.add_argument("--baud", type=parse_baud, default=115200,
+                        help="Baudrate, or 'auto' to probe for the fastest rate the radio answers at (default: 115200)")
+    parser.add_argument("--baud-cache", default=BAUD_CACHE,
+                        help=f"Where --baud auto remembers rates per adapter (default: {BAUD_CACHE})")
     parser.add_argument('--verbose', action='store_true', help='Enable verbose output')
     parser.add_argument('--list-ports', action='store_true', help='List available serial ports and exit')
-    args = parser.parse_args()
+    parser.add_argument('--skip-port-check', action='store_true',
+                        help="Don't check that the port is a USB programming adapter")
+    parser.add_argument('--yes', '-y', action='store_true',
+                        help="Don't ask whether the radio is in normal mode")
+    parser.add_argument('--no-font-cache', action='store_true',
+                        help=f"Parse the font text every time instead of using its {FONT_CACHE_EXT} cache")
+    parser.add_argument('--write-size', type=int, default=FONT_WRITE_SIZE,
+                        help=f"Bytes per write within each {FONT_BLOCK_SIZE}-byte block, 0 = one write "
+                             f"per block (default: {FONT_WRITE_SIZE})")
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds to keep sending handshake frames (default: {CONNECT_TIMEOUT})")
+    parser.add_argument('--metrics-dir',
+                        help='Append per-session JSON and write a Prometheus .prom file to this directory')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Record all serial traffic and save it here if the update fails')
+    parser.add_argument('--trace-always', action='store_true', help='Save the --trace file even on success')
+    args = parser.parse_args(argv)
 
     # Add list-ports option like in fw_updater.py
     if args.list_ports:
-        import serial.tools.list_ports
-        ports = list(serial.tools.list_ports.comports())
-        print("Available serial ports:")
-        for port in ports:
-            print(f"  {port.device}: {port.description}")
+        print_ports()
         sys.exit(0)
 
     if not os.path.isfile(args.font):
         print(f"Font file not found: {args.font}")
         sys.exit(1)
 
-    font_buffer = parse_font_file(args.font)
-    update_font_data(args.port, args.baud, font_buffer, args.verbose)
+    if args.write_size < 0:
+        parser.error("--write-size must be 0 or positive")
+
+    font_buffer = load_font(args.font, use_cache=not args.no_font_cache)
+    try:
+        update_font_data(args.port, args.baud, font_buffer, args.verbose,
+                         check_port=not args.skip_port_check, assume_yes=args.yes,
+                         write_size=args.write_size, connect_timeout=args.connect_timeout,
+                         baud_cache=args.baud_cache, metrics_dir=args.metrics_dir,
+                         trace_path=args.trace, trace_always=args.trace_always)
+    except FontTransferError as e:
+        print(f"\n{e}")
+        sys.exit(e.exit_code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Catalog of a firmware directory in SQLite.
+
+'update' reads the header of every .dat/.bin image once and stores the
+vendor, model, versions, hardware type, encryption status, validation
+result and SHA-256 in <directory>/.fw_catalog.db; later runs only re-read
+files whose size or mtime changed. The other commands answer from the
+database without touching the images:
+
+    python fw_catalog.py update
+    python fw_catalog.py list --hardware 2
+    python fw_catalog.py latest --model BF_5RH
+    python fw_catalog.py hash <sha256>
+
+flash_service.py keeps one of these for --firmware-dir and looks job images up in it.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from firmware_image import FirmwareImage
+
+DEFAULT_DB_NAME = '.fw_catalog.db'
+CATALOG_EXTENSIONS = ('.dat', '.bin')
+
+# Build number in vendor file names, e.g. BF_5RH_501_v2_0_9.dat
+BUILD_PATTERN = re.compile(r'[vV](\d+)[._](\d+)[._](\d+)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path        TEXT PRIMARY KEY,
+    mtime_ns    INTEGER NOT NULL,
+    size        INTEGER NOT NULL,
+    sha256      TEXT NOT NULL,
+    vendor      TEXT,
+    model       TEXT,
+    version1    TEXT,
+    version2    TEXT,
+    hardware    INTEGER,
+    size_field  INTEGER,
+    size_ok     INTEGER,
+    status      TEXT,
+    valid       INTEGER,
+    message     TEXT,
+    build       TEXT,
+    build_key   INTEGER,
+    scanned_at  REAL
+);
+CREATE INDEX IF NOT EXISTS images_model ON images (model, hardware, build_key);
+CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256);
+"""
+
+def parse_build(path):
+    """Return (build string, sortable key) from a vendor file name, or (None, None)"""
+    match = BUILD_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None, None
+    major, minor, patch = (int(g) for g in match.groups())
+    return '.'.join(match.groups()), (major << 32) | (minor << 16) | patch
+
+def describe_image(path, image):
+    """Collect the catalog fields for one firmware image (a FirmwareImage)"""
+    fields = image.fields
+    valid, message = image.validate()
+    build, build_key = parse_build(path)
+    return {
+        'vendor': fields.vendor,
+        'model': fields.model,
+        'version1': fields.version,
+        'version2': fields.version2,
+        'hardware': image.hardware,
+        'size_field': fields.data_end if fields.vendor is not None else None,
+        'size_ok': None if image.size_ok is None else int(image.size_ok),
+        'status': image.status,
+        'valid': int(valid),
+        'message': message,
+        'build': build,
+        'build_key': build_key,
+    }
+
+class FirmwareCatalog:
+    """Persistent SQLite index of firmware images and their header metadata"""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.conn.close()
+    
+    def update(self, directory, recursive=False):
+        """
+        Bring the catalog up to date with the images in 'directory'.
+        
+        Files whose size and mtime match their catalog row are not re-read or
+        re-hashed. Rows for files that disappeared from the directory are dropped.
+        
+        Returns:
+            dict: Counts of 'added', 'updated', 'unchanged' and 'removed' images
+        """
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+        directory = os.path.abspath(directory)
+        known = {row['path']: (row['mtime_ns'], row['size'])
+                 for row in self.conn.execute("SELECT path, mtime_ns, size FROM images")}
+        
+        seen = set()
+        with self.conn:
+            for path in self._scan(directory, recursive):
+                st = os.stat(path)
+                seen.add(path)
+                if known.get(path) == (st.st_mtime_ns, st.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                
+                image = FirmwareImage.from_file(path)
+                row = describe_image(path, image)
+                row.update(path=path, mtime_ns=st.st_mtime_ns, size=st.st_size,
+                           sha256=image.sha256, scanned_at=time.time())
+                columns = ', '.join(row)
+                placeholders = ', '.join(f':{k}' for k in row)
+                self.conn.execute(f"INSERT OR REPLACE INTO images ({columns}) VALUES ({placeholders})", row)
+                counts['updated' if path in known else 'added'] += 1
+            
+            prefix = directory.rstrip(os.sep) + os.sep
+            for path in known:
+                if path.startswith(prefix) and path not in seen:
+                    if recursive or os.path.dirname(path) == directory:
+                        self.conn.execute("DELETE FROM images WHERE path = ?", (path,))
+                        counts['removed'] += 1
+        return counts
+    
+    @staticmethod
+    def _scan(directory, recursive):
+        """Yield absolute paths of candidate firmware files"""
+        if recursive:
+            for root, _, names in os.walk(directory):
+                for name in sorted(names):
+                    if name.lower().endswith(CATALOG_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if name.lower().endswith(CATALOG_EXTENSIONS) and os.path.isfile(path):
+                    yield path
+    
+    def find(self, model=None, hardware=None, status=None, valid_only=False):
+        """Return matching images as dicts, newest build first"""
+        clauses, params = [], []
+        if model is not None:
+            clauses.append("model = ?")
+            params.append(model)
+        if hardware is not None:
+            clauses.append("hardware = ?")
+            params.append(hardware)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if valid_only:
+            clauses.append("valid = 1")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT * FROM images {where} ORDER BY build_key DESC, mtime_ns DESC, path"
+        return [dict(row) for row in self.conn.execute(query, params)]
+    
+    def latest(self, model='BF_5RH', hardware=None, status='encrypted'):
+        """Return the newest valid image for a model (and hardware version), or None"""
+        images = self.find(model, hardware, status, valid_only=True)
+        return images[0] if images else None
+    
+    def by_hash(self, sha256):
+        """Return every catalogued copy of an image with the given SHA-256"""
+        rows = self.conn.execute("SELECT * FROM images WHERE sha256 = ? ORDER BY path", (sha256.lower(),))
+        return [dict(row) for row in rows]
+
+def format_catalog(images):
+    """Render catalog rows as a plain-text table"""
+    rows = [("Build", "HW", "Model", "Status", "Valid", "Size", "SHA-256", "Path")]
+    for img in images:
+        rows.append((img['build'] or "-", f"V{img['hardware']}", img['model'] or "-", img['status'],
+                     "yes" if img['valid'] else "no", str(img['size']), img['sha256'][:16],
+                     os.path.relpath(img['path'])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    return '\n'.join("  ".join([c.ljust(w) for c, w in zip(row, widths)] + [row[-1]]) for row in rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Index Baofeng firmware images and look them up')
+    parser.add_argument('--db', help=f'Catalog database (default: <directory>/{DEFAULT_DB_NAME})')
+    parser.add_argument('--dir', default='firmware', help='Firmware directory (default: firmware)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    
+    p_update = sub.add_parser('update', help='Scan the directory and refresh changed entries')
+    p_update.add_argument('--recursive', '-r', action='store_true', help='Scan subdirectories too')
+    
+    p_list = sub.add_parser('list', help='List catalogued images')
+    p_latest = sub.add_parser('latest', help='Print the path of the newest valid image')
+    for p in (p_list, p_latest):
+        p.add_argument('--model', default=None if p is p_list else 'BF_5RH', help='Model string at 0x10')
+        p.add_argument('--hardware', type=int, choices=[1, 2], help='Hardware version (V2 images carry V2.0.0.0 at 0x30)')
+        p.add_argument('--status', choices=['encrypted', 'decrypted', 'unknown'],
+                       default=None if p is p_list else 'encrypted', help='Encryption state')
+    
+    p_hash = sub.add_parser('hash', help='Find images by SHA-256')
+    p_hash.add_argument('sha256')
+    
+    args = parser.parse_args()
+    db_path = args.db or os.path.join(args.dir, DEFAULT_DB_NAME)
+    
+    with FirmwareCatalog(db_path) as catalog:
+        if args.command == 'update':
+            start = time.perf_counter()
+            counts = catalog.update(args.dir, args.recursive)
+            elapsed = time.perf_counter() - start
+            print(", ".join(f"{n} {k}" for k, n in counts.items()) + f" ({elapsed*1000:.1f}ms)")
+        elif args.command == 'list':
+            print(format_catalog(catalog.find(args.model, args.hardware, args.status)))
+        elif args.command == 'latest':
+            image = catalog.latest(args.model, args.hardware, args.status)
+            if image is None:
+                print("No matching image in catalog", file=sys.stderr)
+                sys.exit(1)
+            print(image['path'])
+        elif args.command == 'hash':
+            images = catalog.by_hash(args.sha256)
+            if not images:
+                sys.exit(1)
+            for image in images:
+                print(image['path'])
+
+if __name__ == '__main__':
+    main()
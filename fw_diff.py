@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Block-level diff of firmware images.
+
+Every image is decrypted in memory and cut into 1 KB (the upload block) or
+4 KB regions. Each region of the newer image is classified against the
+older one as:
+
+    same     identical at the same address
+    fill     a single repeated byte (erased flash, padding) that differs
+    moved    found elsewhere in the older image, at any byte offset
+    changed  present in both, different
+    added    past the end of the older image
+    removed  (older image only) past the end of the newer image
+
+Moves are found with a position-independent rolling checksum over every
+window of the older image (two running sums, computed with cumulative sums
+in NumPy when it is installed) and confirmed byte by byte. Aligned regions
+are compared as whole 2-D arrays.
+
+    python fw_diff.py firmware/                     # consecutive builds
+    python fw_diff.py a.dat b.dat --block-size 4096 --json diff.json --html diff.html
+"""
+
+import argparse
+import html
+import json
+import os
+import sys
+import time
+from collections import Counter
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError:  # Pure Python fallback, slower but the same results
+    np = None
+
+from firmware_image import FirmwareImage
+from fw_catalog import parse_build
+from fwtool import expand_batch_inputs
+
+BLOCK_SIZES = (1024, 4096)
+KINDS = ('same', 'fill', 'moved', 'changed', 'added', 'removed')
+FILL_BYTE = 0xFF  # Pad value for a short last block, like erased flash
+MAX_CANDIDATES = 64  # Rolling-hash hits verified per region before giving up
+
+# Cell colours of the HTML map
+KIND_COLOURS = {
+    'same': '#d9d9d9',
+    'fill': '#9ecae1',
+    'moved': '#fdd49e',
+    'changed': '#e34a33',
+    'added': '#31a354',
+    'removed': '#756bb1',
+}
+
+def load_payload(path):
+    """
+    Return (FirmwareImage, decrypted payload) for one file.
+    
+    Images whose encryption status cannot be told are compared as they are.
+    """
+    image = FirmwareImage.from_file(path)
+    try:
+        plain = image.decrypted()
+    except ValueError:
+        plain = image
+    return image, bytes(plain.payload)
+
+def _padded(payload, block_size):
+    short = -len(payload) % block_size
+    return payload + bytes([FILL_BYTE]) * short if short else payload
+
+# --- Rolling checksum ---
+# For a window starting at p: s1 = sum of its bytes, s2 = sum of (i - p) *
+# byte[i]. Both come from prefix sums, so every window costs O(1) and the
+# key does not depend on where the window sits. key = s1 << 32 | s2 (s2 is
+# below 2**32 for windows up to 4 KB).
+
+def _window_keys(buf, size, step):
+    """Checksum keys of the windows at 0, step, 2*step, ... of 'buf'"""
+    if np is not None:
+        data = np.frombuffer(buf, dtype=np.uint8).astype(np.int64)
+        c1 = np.concatenate(([0], np.cumsum(data)))
+        c2 = np.concatenate(([0], np.cumsum(data * np.arange(len(data), dtype=np.int64))))
+        starts = np.arange(0, len(data) - size + 1, step, dtype=np.int64)
+        s1 = c1[starts + size] - c1[starts]
+        s2 = c2[starts + size] - c2[starts] - starts * s1
+        return (s1 << 32) | s2
+    c1 = [0, *accumulate(buf)]
+    c2 = [0, *accumulate(i * b for i, b in enumerate(buf))]
+    keys = []
+    for p in range(0, len(buf) - size + 1, step):
+        s1 = c1[p + size] - c1[p]
+        keys.append((s1 << 32) | (c2[p + size] - c2[p] - p * s1))
+    return keys
+
+def _candidates(old, size, wanted):
+    """Map each key in 'wanted' to the window offsets of 'old' that have it"""
+    found = {}
+    if not wanted:
+        return found
+    keys = _window_keys(old, size, 1)
+    if np is not None:
+        positions = np.nonzero(np.isin(keys, np.fromiter(wanted, dtype=np.int64)))[0]
+        for pos, key in zip(positions.tolist(), keys[positions].tolist()):
+            found.setdefault(key, []).append(pos)
+    else:
+        for pos, key in enumerate(keys):
+            if key in wanted:
+                found.setdefault(key, []).append(pos)
+    return found
+
+def _aligned(old, new, size):
+    """Per aligned block: (equal, differing byte count) over the common length"""
+    count = min(len(old), len(new)) // size
+    if np is not None:
+        a = np.frombuffer(old, dtype=np.uint8, count=count * size).reshape(count, size)
+        b = np.frombuffer(new, dtype=np.uint8, count=count * size).reshape(count, size)
+        diff = (a != b).sum(axis=1)
+        return (diff == 0).tolist(), diff.tolist()
+    equal, diff = [], []
+    for k in range(count):
+        x, y = old[k * size:(k + 1) * size], new[k * size:(k + 1) * size]
+        same = x == y
+        equal.append(same)
+        diff.append(0 if same else sum(p != q for p, q in zip(x, y)))
+    return equal, diff
+
+def diff_payloads(old, new, block_size=1024):
+    """
+    Classify every block_size region of 'new' against 'old'.
+    
+    Returns:
+        list: One (kind, offset, source, differing bytes) tuple per region of
+        'new', followed by 'removed' entries for the tail of 'old'. 'source'
+        is the offset in 'old' for moved regions, else None.
+    """
+    if block_size not in BLOCK_SIZES:
+        raise ValueError(f"Block size must be one of {BLOCK_SIZES}")
+    old, new = _padded(old, block_size), _padded(new, block_size)
+    equal, diff = _aligned(old, new, block_size)
+    old_blocks = len(old) // block_size
+    
+    new_keys = _window_keys(new, block_size, block_size)
+    if np is not None:
+        new_keys = new_keys.tolist()
+    pending = {}
+    for k, key in enumerate(new_keys):
+        block = new[k * block_size:(k + 1) * block_size]
+        if k < len(equal) and equal[k]:
+            continue
+        if block.count(block[0]) == block_size:
+            continue
+        pending[k] = key
+    found = _candidates(old, block_size, set(pending.values()))
+    
+    regions = []
+    for k in range(len(new) // block_size):
+        offset = k * block_size
+        block = new[offset:offset + block_size]
+        if k < len(equal) and equal[k]:
+            regions.append(('same', offset, None, 0))
+            continue
+        if k not in pending:
+            regions.append(('fill', offset, None, diff[k] if k < len(diff) else block_size))
+            continue
+        source = None
+        # Nearest verified hit first: code shifted by an insertion stays close
+        hits = sorted(found.get(pending[k], ()), key=lambda pos: abs(pos - offset))
+        for pos in hits[:MAX_CANDIDATES]:
+            if old[pos:pos + block_size] == block:
+                source = pos
+                break
+        if source is not None:
+            regions.append(('moved', offset, source, 0))
+        elif k < old_blocks:
+            regions.append(('changed', offset, None, diff[k]))
+        else:
+            regions.append(('added', offset, None, block_size))
+    for k in range(len(new) // block_size, old_blocks):
+        regions.append(('removed', k * block_size, None, block_size))
+    return regions
+
+def merge_regions(regions, block_size):
+    """Collapse runs of neighbouring blocks of the same kind (moves must keep their shift)"""
+    merged = []
+    for kind, offset, source, diff in regions:
+        last = merged[-1] if merged else None
+        if (last and last['kind'] == kind and last['end'] == offset and
+                (kind != 'moved' or source - offset == last['src'] - last['start'])):
+            last['end'] = offset + block_size
+            last['diff_bytes'] += diff
+            continue
+        region = {'kind': kind, 'start': offset, 'end': offset + block_size, 'diff_bytes': diff}
+        if kind == 'moved':
+            region['src'] = source
+        merged.append(region)
+    return merged
+
+def compare(paths, block_size=1024, base=None):
+    """
+    Diff a list of images: each against the one before it, or all against
+    'base' (an index into 'paths').
+    
+    Returns:
+        dict: block_size, images (path, sha256, build, data_end, hardware,
+        status) and pairs (base, target, seconds, counts, diff_bytes,
+        regions), ready for json.dump()
+    """
+    loaded = [load_payload(path) for path in paths]
+    report = {'block_size': block_size, 'engine': 'numpy' if np is not None else 'python', 'images': [], 'pairs': []}
+    for path, (image, _) in zip(paths, loaded):
+        report['images'].append({'path': path, 'sha256': image.sha256, 'build': parse_build(path)[0],
+                                 'data_end': image.data_end, 'hardware': image.hardware, 'status': image.status})
+    
+    if base is None:
+        pairs = [(i - 1, i) for i in range(1, len(paths))]
+    else:
+        pairs = [(base, i) for i in range(len(paths)) if i != base]
+    for i, j in pairs:
+        start = time.perf_counter()
+        regions = diff_payloads(loaded[i][1], loaded[j][1], block_size)
+        seconds = time.perf_counter() - start
+        counts = Counter(kind for kind, *_ in regions)
+        report['pairs'].append({
+            'base': i,
+            'target': j,
+            'seconds': round(seconds, 4),
+            'counts': {kind: counts[kind] for kind in KINDS if counts[kind]},
+            'diff_bytes': sum(r[3] for r in regions if r[0] != 'removed'),
+            'regions': merge_regions(regions, block_size),
+        })
+    return report
+
+def _name(report, index):
+    image = report['images'][index]
+    return image['build'] or image['path']
+
+def format_report(report, show_regions=False):
+    """Plain-text summary, one line per pair (plus its regions if asked)"""
+    lines = []
+    size = report['block_size']
+    for pair in report['pairs']:
+        counts = ', '.join(f"{n} {kind}" for kind, n in pair['counts'].items())
+        lines.append(f"{_name(report, pair['base'])} -> {_name(report, pair['target'])}: {counts} "
+                     f"({size // 1024} KB blocks, {pair['diff_bytes']} bytes differ, "
+                     f"{pair['seconds'] * 1000:.1f} ms)")
+        if show_regions:
+            for r in pair['regions']:
+                if r['kind'] == 'same':
+                    continue
+                extra = f" from {r['src']:#08x}" if r['kind'] == 'moved' else ""
+                lines.append(f"    {r['start']:#08x}-{r['end'] - 1:#08x}  {r['kind']}{extra}")
+    return '\n'.join(lines)
+
+def render_html(report):
+    """A self-contained HTML page with one strip of block cells per pair"""
+    size = report['block_size']
+    rows = []
+    for pair in report['pairs']:
+        cells = []
+        for r in pair['regions']:
+            for offset in range(r['start'], r['end'], size):
+                title = f"{offset:#08x} {r['kind']}"
+                if r['kind'] == 'moved':
+                    title += f" from {r['src'] + offset - r['start']:#08x}"
+                cells.append(f'<i style="background:{KIND_COLOURS[r["kind"]]}" title="{title}"></i>')
+        counts = ', '.join(f"{n} {kind}" for kind, n in pair['counts'].items())
+        rows.append(f"<h2>{html.escape(_name(report, pair['base']))} &rarr; "
+                    f"{html.escape(_name(report, pair['target']))}</h2>"
+                    f"<p>{counts}; {pair['diff_bytes']} bytes differ</p><div>{''.join(cells)}</div>")
+    legend = ''.join(f'<i style="background:{colour}"></i> {kind} ' for kind, colour in KIND_COLOURS.items())
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Firmware diff</title><style>"
+            "body{font-family:sans-serif}div{display:flex;flex-wrap:wrap;max-width:1200px}"
+            "i{display:inline-block;width:10px;height:10px;margin:1px}</style></head><body>"
+            f"<h1>Firmware diff ({size // 1024} KB blocks)</h1><p>{legend}</p>{''.join(rows)}</body></html>\n")
+
+def order_by_build(paths):
+    """Sort vendor builds oldest first; keep the given order if any name has no build number"""
+    keys = [parse_build(path)[1] for path in paths]
+    if None in keys:
+        return paths
+    return [path for _, path in sorted(zip(keys, paths))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Baofeng firmware images block by block')
+    parser.add_argument('paths', nargs='+', help='Firmware files, directories or glob patterns')
+    parser.add_argument('--block-size', type=int, choices=BLOCK_SIZES, default=1024,
+                        help='Region size in bytes (default: 1024, the upload block)')
+    parser.add_argument('--base', help='Compare every image against this one (default: each against the previous build)')
+    parser.add_argument('--regions', action='store_true', help='List the differing regions of each pair')
+    parser.add_argument('--json', metavar='FILE', help="Write the full report as JSON ('-' for stdout)")
+    parser.add_argument('--html', metavar='FILE', help='Write a colour map of the report as HTML')
+    args = parser.parse_args()
+    
+    if args.base and not os.path.isfile(args.base):
+        parser.error(f"--base {args.base}: not a firmware file")
+    paths = order_by_build(expand_batch_inputs(args.paths + ([args.base] if args.base else [])))
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing:
+        parser.error(f"no such file: {', '.join(missing)}")
+    base = None
+    if args.base:
+        wanted = os.path.abspath(args.base)
+        base = next((i for i, path in enumerate(paths) if os.path.abspath(path) == wanted), None)
+        if base is None:
+            parser.error(f"--base {args.base} is not among the images to compare")
+    if len(paths) < 2:
+        parser.error("need at least two images to compare")
+    
+    report = compare(paths, args.block_size, base)
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        print(format_report(report, args.regions))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1)
+    if args.html:
+        with open(args.html, 'w', encoding='utf-8') as f:
+            f.write(render_html(report))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Firmware inspector: block map and paged hexdump of one image.
+
+The image is memory-mapped, never read whole, and the payload is decrypted
+on the fly: the block map XORs a NumPy view of it in one step, the hexdump
+only the lines it prints. Addresses are payload (flash) offsets, i.e. file
+offset minus the 0x50-byte header.
+
+For every 4 KB block the map shows the Shannon entropy in bits per byte,
+the most common byte (decrypted) and its share, the share of printable
+ASCII and the number of strings starting there:
+
+    fill   a single repeated byte (erased flash, padding)
+    text   mostly printable strings
+    high   entropy above HIGH_ENTROPY (compressed or random data)
+    data   everything else (code, tables)
+
+    python fw_inspect.py firmware/BF_5RH_501_v2_0_9.dat            # header and map
+    python fw_inspect.py firmware/BF_5RH_501_v2_0_9.dat --hex 0x1000+256
+    python fw_inspect.py firmware/BF_5RH_501_v2_0_9.dat --page 3 --page-lines 32
+    python fw_inspect.py firmware/BF_5RH_501_v2_0_9.dat --strings 8 --json map.json
+
+NumPy is only imported for the map; without it the same map is computed in
+pure Python, more slowly.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import re
+import sys
+from collections import Counter, namedtuple
+
+from firmware_image import HEADER_SIZE, XOR_KEY, FirmwareImage
+from xor_engine import HAVE_NUMPY, load_numpy, xor_table
+
+BLOCK_SIZE = 4096
+BYTES_PER_LINE = 16
+PAGE_LINES = 32
+MIN_STRING = 6  # Shortest printable run counted as a string
+HIGH_ENTROPY = 7.5  # bits per byte
+TEXT_SHARE = 0.5  # Share of a block inside strings to call it text
+KINDS = ('fill', 'text', 'high', 'data')
+
+ASCII_TABLE = bytes(b if 32 <= b <= 126 else ord('.') for b in range(256))
+
+def string_pattern(min_length=MIN_STRING):
+    """Regex for maximal runs of printable ASCII at least 'min_length' long"""
+    return re.compile(rb'[\x20-\x7e]{%d,}' % min_length)
+
+BlockInfo = namedtuple('BlockInfo', 'addr size entropy fill_byte fill_share ascii_share strings kind')
+
+def hex_lines(data, start=0, end=None, start_addr=0, bytes_per_line=BYTES_PER_LINE):
+    """
+    Yield hexdump lines for data[start:end], one at a time.
+    
+    Lines are addressed from 'start_addr' + offset and have the
+    fw_updater.hex_dump layout. Only the lines consumed are rendered.
+    """
+    end = len(data) if end is None else min(end, len(data))
+    view = memoryview(data)
+    width = bytes_per_line * 3
+    for pos in range(start, end, bytes_per_line):
+        chunk = bytes(view[pos:min(pos + bytes_per_line, end)])
+        yield (f"{start_addr + pos:08X}: {chunk.hex(' ').upper().ljust(width)}  "
+               f"{chunk.translate(ASCII_TABLE).decode('ascii')}")
+
+def parse_range(value):
+    """'START', 'START:END' or 'START+LENGTH', each decimal or 0x hex"""
+    try:
+        if '+' in value:
+            start, length = value.split('+', 1)
+            start = int(start, 0)
+            return start, start + int(length, 0)
+        if ':' in value:
+            start, end = value.split(':', 1)
+            return int(start or '0', 0), int(end, 0) if end else None
+        return int(value, 0), None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range '{value}' (use START, START:END or START+LENGTH)")
+
+class Inspector:
+    """
+    One memory-mapped firmware image.
+    
+    Args:
+        path: .dat or .bin file
+        decrypt: Show the payload decrypted when the marker says it is
+            encrypted (default); False shows the bytes as stored
+    """
+    
+    def __init__(self, path, decrypt=True):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.image = FirmwareImage(self._mm, path)
+        self.decrypt = decrypt and self.image.status == 'encrypted'
+    
+    def close(self):
+        self.image = None  # Drop the memoryview so the map can close
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # A caller still holds a view; the map goes with the last one
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    @property
+    def payload_size(self):
+        """Payload bytes present in the file"""
+        return max(0, len(self._mm) - HEADER_SIZE)
+    
+    def read(self, start, end):
+        """Payload bytes start..end, decrypted if needed; only this range is touched"""
+        end = min(end, self.payload_size)
+        data = self._mm[HEADER_SIZE + start:HEADER_SIZE + end] if start < end else b''
+        return data.translate(xor_table(XOR_KEY)) if self.decrypt else data
+    
+    def hex_lines(self, start=0, end=None, bytes_per_line=BYTES_PER_LINE):
+        """Hexdump lines of the payload range start..end"""
+        end = self.payload_size if end is None else min(end, self.payload_size)
+        # Whole lines only, so the addresses stay aligned
+        start -= start % bytes_per_line
+        return hex_lines(self.read(start, end), start_addr=start, bytes_per_line=bytes_per_line)
+    
+    def page(self, number, lines=PAGE_LINES, bytes_per_line=BYTES_PER_LINE):
+        """Hexdump lines of page 'number' (from 0)"""
+        start = number * lines * bytes_per_line
+        return self.hex_lines(start, start + lines * bytes_per_line, bytes_per_line)
+    
+    def pages(self, lines=PAGE_LINES, bytes_per_line=BYTES_PER_LINE):
+        return -(-self.payload_size // (lines * bytes_per_line))
+    
+    def strings(self, min_length=MIN_STRING):
+        """(addr, text) for every printable ASCII run of at least 'min_length' bytes"""
+        return [(m.start(), m.group().decode('ascii'))
+                for m in string_pattern(min_length).finditer(self.read(0, self.payload_size))]
+    
+    def block_map(self, block_size=BLOCK_SIZE, min_string=MIN_STRING, use_numpy=True):
+        """BlockInfo for every block_size block of the payload"""
+        if not self.payload_size:
+            return []
+        if use_numpy and HAVE_NUMPY:
+            rows = _block_stats_numpy(self._mm, HEADER_SIZE, self.decrypt, block_size, min_string)
+        else:
+            rows = _block_stats_python(self.read(0, self.payload_size), block_size, min_string)
+        
+        blocks = []
+        for k, (size, entropy, fill_byte, fill_count, printable, strings, covered) in enumerate(rows):
+            if fill_count == size:
+                kind = 'fill'
+            elif covered >= TEXT_SHARE * size:
+                kind = 'text'
+            elif entropy > HIGH_ENTROPY:
+                kind = 'high'
+            else:
+                kind = 'data'
+            blocks.append(BlockInfo(k * block_size, size, round(entropy, 3), fill_byte,
+                                    round(fill_count / size, 4), round(printable / size, 4), strings, kind))
+        return blocks
+
+# Both return one row per block: (size, entropy, most common byte, its
+# count, printable bytes, strings starting in the block, bytes inside strings)
+
+def _block_stats_numpy(mm, offset, decrypt, block_size, min_string):
+    np = load_numpy()
+    data = np.frombuffer(mm, dtype=np.uint8, offset=offset)
+    data = data ^ np.uint8(XOR_KEY) if decrypt else data.copy()  # Never hold on to the map's buffer
+    n = -(-len(data) // block_size)
+    firsts = np.arange(0, len(data), block_size)
+    
+    # One histogram row per block: bin block * 256 + byte value
+    bins = np.repeat(np.arange(0, n * 256, 256, dtype=np.int32), block_size)[:len(data)]
+    bins += data
+    hist = np.bincount(bins, minlength=n * 256).reshape(n, 256)
+    sizes = hist.sum(axis=1)
+    p = hist / sizes[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.where(hist > 0, p * np.log2(p), 0.0).sum(axis=1)
+    fill_bytes = hist.argmax(axis=1)
+    fill_counts = hist[np.arange(n), fill_bytes]
+    printable_counts = hist[:, 32:127].sum(axis=1)
+    
+    # Strings: runs of printable bytes at least min_string long
+    printable = ((data >= 32) & (data <= 126)).view(np.int8)
+    edges = np.diff(printable, prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_string
+    starts, ends = starts[keep], ends[keep]
+    strings = np.bincount(starts // block_size, minlength=n)
+    # String bytes before each block boundary: whole runs that end by it,
+    # plus the part of the run it cuts through
+    bounds = np.append(firsts, len(data))
+    done = np.searchsorted(ends, bounds, side='right')
+    before = np.concatenate(([0], np.cumsum(ends - starts)))[done]
+    cut = done < len(starts)
+    before[cut] += np.clip(bounds[cut] - starts[done[cut]], 0, None)
+    covered = np.diff(before)
+    return list(zip(sizes.tolist(), entropy.tolist(), fill_bytes.tolist(), fill_counts.tolist(),
+                    printable_counts.tolist(), strings.tolist(), covered.tolist()))
+
+def _block_stats_python(payload, block_size, min_string):
+    n = -(-len(payload) // block_size)
+    strings, covered = [0] * n, [0] * n
+    for m in string_pattern(min_string).finditer(payload):
+        strings[m.start() // block_size] += 1
+        pos, end = m.span()
+        while pos < end:
+            k = pos // block_size
+            stop = min(end, (k + 1) * block_size)
+            covered[k] += stop - pos
+            pos = stop
+    
+    rows = []
+    for k, pos in enumerate(range(0, len(payload), block_size)):
+        block = payload[pos:pos + block_size]
+        size = len(block)
+        hist = [block.count(b) for b in range(256)]
+        entropy = -sum(c / size * math.log2(c / size) for c in hist if c)
+        fill_count = max(hist)
+        rows.append((size, entropy, hist.index(fill_count), fill_count, sum(hist[32:127]),
+                     strings[k], covered[k]))
+    return rows
+
+def format_header(inspector):
+    image = inspector.image
+    fields = image.fields
+    ok, message = image.validate()
+    lines = [
+        f"{inspector.path}: {len(image)} bytes, {image.status}"
+        f"{' (shown decrypted)' if inspector.decrypt else ''}",
+        f"  vendor {fields.vendor!r}, model {fields.model!r}, version {fields.version!r}"
+        f"{f', {fields.version2!r}' if fields.version2 else ''}, V{image.hardware} hardware",
+        f"  size field {fields.data_end:#x}, payload {inspector.payload_size:#x}: {message}",
+    ]
+    return '\n'.join(lines)
+
+def format_map(blocks):
+    lines = [f"{'addr':>8} {'entropy':>7} {'fill':>10} {'ascii':>6} {'strings':>7}  kind"]
+    for b in blocks:
+        lines.append(f"{b.addr:08X} {b.entropy:7.3f} {b.fill_byte:02X} {b.fill_share:6.1%} "
+                     f"{b.ascii_share:6.1%} {b.strings:7}  {b.kind}")
+    totals = Counter(b.kind for b in blocks)
+    lines.append(f"{len(blocks)} blocks: " + ', '.join(f"{totals[kind]} {kind}" for kind in KINDS if totals[kind]))
+    return '\n'.join(lines)
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Inspect a firmware image: block map, strings and hexdump')
+    parser.add_argument('image', help='Firmware file (.dat or .bin)')
+    parser.add_argument('--map', action='store_true', help='Show the block map (default unless a hexdump is asked for)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help=f'Map block size (default: {BLOCK_SIZE})')
+    parser.add_argument('--hex', type=parse_range, metavar='RANGE',
+                        help='Hexdump payload addresses START, START:END or START+LENGTH (0x hex allowed)')
+    parser.add_argument('--page', type=int, help='Hexdump page N (from 0)')
+    parser.add_argument('--page-lines', type=int, default=PAGE_LINES, help=f'Lines per page (default: {PAGE_LINES})')
+    parser.add_argument('--strings', type=int, nargs='?', const=MIN_STRING, metavar='MIN',
+                        help=f'List printable strings of at least MIN bytes (default: {MIN_STRING})')
+    parser.add_argument('--raw', action='store_true', help="Show the payload as stored, don't decrypt it")
+    parser.add_argument('--json', metavar='FILE', help="Write the header and block map as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if args.block_size <= 0 or args.page_lines <= 0:
+        parser.error("--block-size and --page-lines must be positive")
+    
+    try:
+        inspector = Inspector(args.image, decrypt=not args.raw)
+    except (OSError, ValueError) as e:
+        print(f"Error: cannot open {args.image}: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    with inspector:
+        out = sys.stdout
+        pages = inspector.pages(args.page_lines)
+        if args.page is not None and not 0 <= args.page < pages:
+            parser.error(f"--page must be between 0 and {pages - 1}")
+        show_map = args.map or (args.hex is None and args.page is None and args.strings is None)
+        if args.json != '-':
+            print(format_header(inspector), file=out)
+        
+        if show_map or args.json:
+            blocks = inspector.block_map(args.block_size)
+            if show_map and args.json != '-':
+                print(format_map(blocks), file=out)
+            if args.json:
+                image = inspector.image
+                report = {'path': args.image, 'size': len(image), 'status': image.status,
+                          'decrypted': inspector.decrypt, 'fields': image.fields._asdict(),
+                          'block_size': args.block_size, 'blocks': [b._asdict() for b in blocks]}
+                if args.json == '-':
+                    json.dump(report, out, indent=2)
+                    out.write('\n')
+                else:
+                    with open(args.json, 'w') as f:
+                        json.dump(report, f, indent=2)
+        
+        if args.strings is not None:
+            for addr, text in inspector.strings(args.strings):
+                print(f"{addr:08X}: {text}", file=out)
+        
+        if args.hex is not None:
+            start, end = args.hex
+            lines = inspector.hex_lines(start, end if end is not None else start + args.page_lines * BYTES_PER_LINE)
+            out.writelines(line + '\n' for line in lines)
+        if args.page is not None:
+            print(f"-- page {args.page}/{pages - 1} --", file=out)
+            out.writelines(line + '\n' for line in inspector.page(args.page, args.page_lines))
+
+if __name__ == '__main__':
+    main()
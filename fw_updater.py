@@ -25,13 +25,21 @@
 #
 #For more information, please refer to <http://unlicense.org/>
 
-import serial
+import json
 import time
-import struct
 import sys
 import os
 import logging
-from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from radio_link import (BAUD_CACHE, FALLBACK_BAUD, BaudMemory, ConnectTimeout, connect,
+                        format_baud_report, negotiate_baud, parse_baud, read_until)
+from radio_protocol import plan_frames
+from firmware_image import HEADER_SIZE, FirmwareImage
+from flash_metrics import SessionMetrics, format_metrics
+from serial_trace import SerialTrace, trace_path_for
+from serial_port import confirm, port_tag, print_ports, safe_serial, serial_errors, verify_serial_port
 
 # --- Protocol Constants (unchanged) ---
 CMD_INFO = b"INFORMATION"
@@ -42,6 +50,8 @@ CMD_NEW_HARDWARE = b"V2_00_00"
 CMD_PRG = b"PROGRAM1"
 CMD_ACK = b"ACK"
 CMD_NACK = b"NACK"
+HANDSHAKE_RESPONSES = {CMD_NEW_HARDWARE[0]: CMD_NEW_HARDWARE, CMD_UPDATE[0]: CMD_UPDATE}
+CONNECT_TIMEOUT = 10
 
 CMD_FLASH = [
     bytes([70, 45, 80, 82, 79, 71, 255, 255]),   # F-PROG
@@ -54,99 +64,89 @@ CMD_FLASH = [
 ]
 
 # Constants
-EXPECTED_FLASH_SIZE = 524288
-MAX_READ_ATTEMPTS = 3
 BLOCK_SIZE = 1024  # Standard block size for writing
 
-HEADER_SIZE = 0x50  # 80 bytes
-HEADER_SIGNATURE_1 = b'BaoFeng'
-HEADER_SIGNATURE_2 = b'BF_5RH'
-HEADER_VERSION_1 = b'V1.0.0.0'
-HEADER_VERSION_2 = b'V2.0.0.0'
-HEADER_VERSION_PREFIX = b'V'
+# Answers for the y/n prompts: ask on the console, or always 'yes' / 'no'
+PROMPT_POLICIES = ('ask', 'yes', 'no')
 
 # --- Setup Logging ---
-def setup_logging(verbose=False, log_file='fw_update.log'):
-    """Configure logging with appropriate level"""
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def setup_logging(verbose=False, log_file='fw_update.log', name=None):
+    """
+    Configure logging with appropriate level.
+    
+    Without 'name' this sets up the root logger for a single session. With a
+    name (fleet mode) it returns a separate 'fw_updater.<name>' logger that
+    writes to its own log file and only echoes warnings to the console.
+    """
     level = logging.DEBUG if verbose else logging.INFO
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(log_file, mode='w')  # Overwrite previous log
-        ]
-    )
-    return logging.getLogger('fw_updater')
+    if name is None:
+        logging.basicConfig(
+            level=level,
+            format=LOG_FORMAT,
+            handlers=[
+                logging.StreamHandler(),
+                logging.FileHandler(log_file, mode='w')  # Overwrite previous log
+            ]
+        )
+        return logging.getLogger('fw_updater')
+    
+    logger = logging.getLogger(f'fw_updater.{name}')
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    
+    file_handler = logging.FileHandler(log_file, mode='w')  # Overwrite previous log
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(file_handler)
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING)
+    console.setFormatter(logging.Formatter(f'%(asctime)s - {name} - %(levelname)s - %(message)s'))
+    logger.addHandler(console)
+    return logger
 
 # --- Helper Functions ---
-@contextmanager
-def safe_serial(port, baudrate, **kwargs):
-    """Context manager for safer serial port handling"""
-    ser = None
+def read_exact(ser, length, timeout=5, description="data", logger=None):
+    """Read exactly 'length' bytes from serial, waking as soon as data arrives"""
+    log = logger or logging
     try:
-        ser = serial.Serial(port, baudrate, **kwargs)
-        yield ser
-    except serial.SerialException as e:
-        raise RuntimeError(f"Serial port error: {e}")
-    finally:
-        if ser and ser.is_open:
-            try:
-                ser.close()
-                logging.debug("Serial port closed")
-            except Exception as e:
-                logging.warning(f"Error closing serial port: {e}")
-
-def read_exact(ser, length, timeout=5, description="data"):
-    """Read exactly 'length' bytes from serial with improved error handling"""
-    buf = b''
-    start = time.time()
-    attempts = 0
-    
-    while len(buf) < length:
-        if ser.in_waiting:
-            new_data = ser.read(min(ser.in_waiting, length - len(buf)))
-            if new_data:
-                buf += new_data
-                attempts = 0  # Reset attempt counter on successful read
-            else:
-                attempts += 1
-                if attempts >= MAX_READ_ATTEMPTS:
-                    raise TimeoutError(f"Failed to read {description} after multiple attempts")
-        
-        elapsed = time.time() - start
-        if elapsed > timeout:
-            if buf:
-                logging.error(f"Timeout reading {description}: Got {len(buf)}/{length} bytes")
-            raise TimeoutError(f"Timeout waiting for {description} ({len(buf)}/{length} bytes received)")
-        
-        # Adaptive sleep - shorter when data is available or almost complete
-        remaining_pct = (length - len(buf)) / length
-        time.sleep(min(0.01, remaining_pct * 0.05))
-    
+        buf = read_until(ser, length, time.monotonic() + timeout)
+    except serial_errors() as e:
+        raise TimeoutError(f"Failed to read {description} after multiple attempts") from e
+    if len(buf) < length:
+        if buf:
+            log.error(f"Timeout reading {description}: Got {len(buf)}/{length} bytes")
+        raise TimeoutError(f"Timeout waiting for {description} ({len(buf)}/{length} bytes received)")
     return buf
 
-def write_and_wait_ack(ser, data, ack=CMD_ACK, timeout=5, description="command", retry_count=1):
+def write_and_wait_ack(ser, data, ack=CMD_ACK, timeout=5, description="command", retry_count=1, logger=None,
+                       metrics=None):
     """Send data and wait for acknowledgement with improved error handling"""
+    log = logger or logging
     for attempt in range(retry_count + 1):
+        if attempt and metrics:
+            metrics.count('retries')
         try:
             ser.write(data)
-            logging.debug(f"Sent {len(data)} bytes for {description}")
-            resp = read_exact(ser, len(ack), timeout, f"ACK for {description}")
+            log.debug(f"Sent {len(data)} bytes for {description}")
+            resp = read_exact(ser, len(ack), timeout, f"ACK for {description}", logger=logger)
             if resp != ack:
-                logging.warning(f"Attempt {attempt+1}/{retry_count+1}: Expected {ack!r}, got {resp!r}")
+                log.warning(f"Attempt {attempt+1}/{retry_count+1}: Expected {ack!r}, got {resp!r}")
                 if attempt < retry_count:
                     time.sleep(0.5)  # Wait before retry
                     continue
-                logging.error(f"Failed to get proper ACK after {retry_count+1} attempts")
+                log.error(f"Failed to get proper ACK after {retry_count+1} attempts")
                 return False
             return True
         except Exception as e:
             if attempt < retry_count:
-                logging.warning(f"Attempt {attempt+1}/{retry_count+1} failed: {e}, retrying...")
+                log.warning(f"Attempt {attempt+1}/{retry_count+1} failed: {e}, retrying...")
                 time.sleep(0.5)  # Wait before retry
             else:
-                logging.error(f"Error in write_and_wait_ack for {description}: {e}")
+                log.error(f"Error in write_and_wait_ack for {description}: {e}")
                 return False
     return False
 
@@ -167,202 +167,367 @@ def print_progress(percent, msg="", last_percent=[0]):
 # Initialize progress tracker
 print_progress.start_time = 0
 
-def verify_serial_port(port):
-    """Check if the serial port is likely to be a programming adapter"""
-    try:
-        # List serial ports with descriptions
-        import serial.tools.list_ports
-        ports = list(serial.tools.list_ports.comports())
-        
-        # Find our port in the list
-        port_info = next((p for p in ports if p.device == port), None)
-        if not port_info:
-            logging.warning(f"Port {port} not found in system device list")
-            return False
-            
-        # Check for known programming adapter keywords
-        adapter_keywords = ['CH340', 'CP210', 'FTDI', 'USB Serial', 'USB-Serial']
-        if not any(keyword in port_info.description for keyword in adapter_keywords):
-            logging.warning(f"Port {port} ({port_info.description}) might not be a programming adapter")
-            if input("This doesn't appear to be a programming adapter. Continue? (y/n): ").lower() != 'y':
-                return False
-        
-        return True
-    except Exception as e:
-        logging.warning(f"Failed to verify serial port: {e}")
-        return True  # Continue anyway on error
-
-def validate_firmware_header(header):
-    """Validate the firmware header structure with exact specification"""
-    if len(header) < HEADER_SIZE:
-        return False, f"Header too short: {len(header)} bytes (expected {HEADER_SIZE})"
-    
-    # Check for BaoFeng signature (offset 0)
-    if not header.startswith(HEADER_SIGNATURE_1):
-        # Allow for variations in capitalization
-        if not header.upper().startswith(HEADER_SIGNATURE_1.upper()):
-            return False, f"Invalid header: Missing '{HEADER_SIGNATURE_1.decode()}' signature"
-    
-    # Check for BF_5RH signature (offset 16)
-    if header[16:16+len(HEADER_SIGNATURE_2)] != HEADER_SIGNATURE_2:
-        # Try with more flexibility (allow for FF padding between characters)
-        sig_bytes = HEADER_SIGNATURE_2.replace(b'_', b'')
-        matches = all(header[16+i] == sig_bytes[i] or header[16+i] == 0xFF for i in range(len(sig_bytes)))
-        if not matches:
-            return False, f"Invalid header: Missing '{HEADER_SIGNATURE_2.decode()}' signature"
-    
-    # Check for version string (offset 32)
-    if header[32:32+1] != HEADER_VERSION_PREFIX:
-        return False, "Invalid header: Missing version information"
-    
-    # Extract file size (offset 0x40, 32-bit big-endian)
-    try:
-        file_size = (header[0x40] << 24) | (header[0x41] << 16) | (header[0x42] << 8) | header[0x43]
-        if file_size <= 0 or file_size > EXPECTED_FLASH_SIZE:
-            return False, f"Invalid file size in header: {file_size} bytes"
-        logging.info(f"Header indicates firmware size: {file_size} bytes")
-    except IndexError:
-        return False, "Header too short to extract file size"
-        
-    return True, "Header validation passed"
+def _no_output(*args, **kwargs):
+    """Stand-in for print() when console output is muted"""
 
-def validate_firmware_file(filepath, force=False):
-    """Validate the firmware file before flashing"""
+def validate_firmware_file(filepath, force=False, prompt='ask', logger=None):
+    """
+    Read and validate the firmware file before flashing.
+    
+    Returns:
+        FirmwareImage: The image, read once, for updater(image=...)
+    """
+    log = logger or logging
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Firmware file not found: {filepath}")
     
-    size = os.path.getsize(filepath)
+    image = FirmwareImage.from_file(filepath)
+    size = len(image)
     if size == 0:
         raise ValueError("Firmware file is empty")
     
-    # More comprehensive header check
-    with open(filepath, "rb") as f:
-        header = f.read(HEADER_SIZE)  # Read the full header
-        
-        valid, message = validate_firmware_header(header)
-        if not valid:
-            logging.warning(f"Firmware validation warning: {message}")
-            if not force:
+    # Same checks as fwtool (see firmware_image.validate_header)
+    valid, message = image.validate()
+    if not valid:
+        log.warning(f"Firmware validation warning: {message}")
+        if not force:
+            if prompt == 'ask':
                 print("\nWARNING: The firmware file may not be compatible with your radio.")
                 print(f"Reason: {message}")
                 print("This could potentially brick your device if continued.")
-                confirm = input("Continue anyway? (y/n): ").lower()
-                if confirm != 'y':
-                    raise ValueError("Firmware validation failed, update aborted by user")
-            logging.warning("Proceeding with firmware update despite validation warnings")
-        else:
-            logging.info("Firmware header validation passed")
+            if not confirm("Continue anyway? (y/n): ", prompt):
+                raise ValueError("Firmware validation failed, update aborted by user")
+        log.warning("Proceeding with firmware update despite validation warnings")
+    else:
+        log.info(f"Firmware header validation passed ({image.model}, hardware V{image.hardware}, "
+                 f"{image.data_end} bytes, {image.status})")
     
     # Check file size is reasonable
     if size < HEADER_SIZE + 1024:
-        logging.warning(f"Firmware file suspiciously small: {size} bytes")
+        log.warning(f"Firmware file suspiciously small: {size} bytes")
         if not force:
-            confirm = input("WARNING: Firmware file is unusually small. Continue? (y/n): ").lower()
-            if confirm != 'y':
+            if not confirm("WARNING: Firmware file is unusually small. Continue? (y/n): ", prompt):
                 raise ValueError("Firmware size validation failed, update aborted by user")
     
-    logging.info(f"Firmware file size validation passed: {filepath} ({size} bytes)")
-    return True
+    log.info(f"Firmware file size validation passed: {filepath} ({size} bytes)")
+    return image
+
+def write_frame(ser, frame):
+    """
+    Send one block frame (address header + payload) in a single write.
+    
+    Where the port exposes a file descriptor the two parts are gathered with
+    os.writev(), so the payload goes out straight from the image buffer.
+    Other ports get one write of the concatenated 1 KB frame.
+    """
+    fd = None
+    if hasattr(os, 'writev'):
+        try:
+            fd = ser.fileno()
+        except (AttributeError, OSError, ValueError) + serial_errors():
+            fd = None
+    if fd is None:
+        ser.write(frame.header + frame.payload)
+        return
+    
+    try:
+        written = os.writev(fd, (frame.header, frame.payload))
+    except BlockingIOError:
+        written = 0
+    header_len = len(frame.header)
+    if written < header_len:
+        ser.write(frame.header[written:] + frame.payload)
+    elif written < header_len + len(frame.payload):
+        # Partial write: let pyserial finish the rest under its write timeout
+        ser.write(frame.payload[written - header_len:])
 
 def hex_dump(data, start_addr=0, bytes_per_line=16):
-    """Create a hexdump of binary data for logging purposes"""
-    result = []
-    for i in range(0, len(data), bytes_per_line):
-        chunk = data[i:i+bytes_per_line]
-        hex_values = ' '.join(f'{b:02X}' for b in chunk)
-        ascii_values = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in chunk)
-        result.append(f"{start_addr+i:08X}: {hex_values.ljust(bytes_per_line*3)}  {ascii_values}")
-    return '\n'.join(result)
+    """Create a hexdump of binary data for logging purposes (see fw_inspect.py for whole images)"""
+    from fw_inspect import hex_lines
+    return '\n'.join(hex_lines(data, start_addr=start_addr, bytes_per_line=bytes_per_line))
 
-# --- Main Updater Logic ---
-def updater(port, baudrate, flash_path, verbose=False, force=False):
-    """Update radio firmware with improved error handling and reporting"""
-    logger = setup_logging(verbose)
-    logger.info(f"Starting firmware update from {flash_path} on {port}")
+# --- Resumable Uploads ---
+CHECKPOINT_EVERY = 32  # ACKed blocks between checkpoint saves during an upload
+
+class ResumeRejected(Exception):
+    """The radio would not continue a resumed upload; it needs a full reflash"""
+
+def checkpoint_path_for(port, log_dir='.'):
+    """Default checkpoint file for a port, next to its log in 'log_dir'"""
+    return os.path.join(log_dir, f"fw_resume_{port_tag(port)}.json")
+
+class FlashCheckpoint:
+    """
+    How far an upload got: the image it belongs to, the address below which
+    every block has been ACKed, and the payload checksum up to that address.
     
-    # Verify serial port
-    if not verify_serial_port(port):
-        logger.error(f"Serial port verification failed for {port}")
-        return False
+    It is saved as JSON every CHECKPOINT_EVERY blocks and when a session
+    fails, and removed when one succeeds. Only a gap-free run of ACKs from
+    the start of the session moves it forward. With a 'path' of None it is
+    only tracked in memory and nothing is written or removed.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.image_hash = None
+        self.data_end = 0
+        self.next_addr = 0
+        self.check_sum = 0
+        self.frozen = False
+        self._payload = None
+        self._summed = 0
+        self._unsaved = 0
     
-    # Validate firmware file
+    def start(self, image, plan, next_addr=0):
+        """Track an upload of 'image' (a FirmwareImage) that begins at 'next_addr'"""
+        self.image_hash = image.sha256
+        self.data_end = plan.data_end
+        self._payload = image.view[HEADER_SIZE:HEADER_SIZE + plan.data_end]
+        self.next_addr = self._summed = next_addr
+        self.check_sum = sum(self._payload[:next_addr])
+        self.frozen = False
+        self._unsaved = 0
+        if next_addr == 0:
+            # A fresh upload erases the flash an older checkpoint describes
+            self.clear()
+    
+    def acked(self, frame):
+        """Record the ACK of one block frame"""
+        if self.frozen or frame.addr != self.next_addr:
+            self.frozen = True
+            return
+        self.next_addr = frame.addr + len(frame.payload)
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self.save()
+    
+    def save(self):
+        """Write the checkpoint if any block has been ACKed"""
+        if self.path is None or self.image_hash is None or self.next_addr == 0:
+            return
+        self.check_sum += sum(self._payload[self._summed:self.next_addr])
+        self._summed = self.next_addr
+        state = {
+            'image_sha256': self.image_hash,
+            'data_end': self.data_end,
+            'next_addr': self.next_addr,
+            'check_sum': self.check_sum,
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.path)
+        self._unsaved = 0
+    
+    def clear(self):
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def resume_point(path, image, plan, logger=None):
+    """
+    Address to continue an upload of 'image' from, according to the
+    checkpoint at 'path'; 0 if there is nothing (valid) to resume.
+    """
+    log = logger or logging
     try:
-        validate_firmware_file(flash_path, force)
-    except Exception as e:
-        logger.error(f"Firmware validation failed: {e}")
-        return False
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        log.info(f"No checkpoint at {path}; flashing the whole image")
+        return 0
+    except (OSError, ValueError) as e:
+        log.warning(f"Unreadable checkpoint {path} ({e}); flashing the whole image")
+        return 0
     
-    # Load FLASH data with proper size validation
+    next_addr = state.get('next_addr', 0)
+    block_addrs = {frame.addr for frame in plan.blocks}
+    if state.get('image_sha256') != image.sha256:
+        reason = "it was written for a different image"
+    elif state.get('data_end') != plan.data_end:
+        reason = "the image size differs"
+    elif next_addr != plan.data_end and next_addr not in block_addrs:
+        reason = f"{next_addr:#x} is not a block boundary"
+    elif state.get('check_sum') != sum(image.view[HEADER_SIZE:HEADER_SIZE + next_addr]):
+        reason = "its checksum does not match the image"
+    else:
+        log.info(f"Resuming from checkpoint {path} at {next_addr:#x} of {plan.data_end:#x}")
+        return next_addr
+    log.warning(f"Ignoring checkpoint {path}: {reason}; flashing the whole image")
+    return 0
+
+# --- Main Updater Logic ---
+def updater(port, baudrate, flash_path, verbose=False, force=False, window=1, check_port=True,
+            prompt='ask', image=None, logger=None, quiet=False, connect_timeout=CONNECT_TIMEOUT,
+            baud_cache=BAUD_CACHE, metrics=None, metrics_dir=None, trace_path=None, trace_always=False,
+            resume=False, checkpoint_path=None, progress=None):
+    """
+    Update radio firmware with improved error handling and reporting.
+    
+    'window' is the number of blocks sent ahead of their ACKs. The default of 1
+    is strict stop-and-wait; larger windows fall back to 1 on the first NACK
+    or timeout. 'check_port' can be turned off for ports that are not USB
+    adapters, such as the pty of radio_emulator.py.
+    
+    For unattended sessions, 'prompt' answers the y/n questions (see
+    PROMPT_POLICIES), 'image' passes a FirmwareImage (or raw bytes) the
+    caller has already read and validated, 'logger' replaces the global log setup and 'quiet'
+    mutes the console output and progress bar. DOWNLOAD is repeated for up to
+    'connect_timeout' seconds while the radio boots into update mode.
+    
+    A 'baudrate' of 'auto' probes radio_link.CANDIDATE_BAUDS during the
+    handshake, remembers the rate per adapter and model in 'baud_cache' and
+    falls back to 115200.
+    
+    Phase timings, ACK latencies and retries go into 'metrics' (a
+    flash_metrics.SessionMetrics, created if not given) and are exported to
+    'metrics_dir' when one is set.
+    
+    With 'trace_path' all serial traffic is kept in memory and saved there
+    if the session fails, or always with 'trace_always' (see serial_trace).
+    
+    With 'resume' or a 'checkpoint_path', upload progress is checkpointed
+    to 'checkpoint_path' (default: checkpoint_path_for(port)); otherwise no
+    checkpoint file is written. With 'resume' a matching checkpoint skips
+    F-ERASE and the blocks already ACKed; if the radio rejects the resumed
+    session the image is flashed again from scratch.
+    
+    'progress' replaces the progress bar: it is called as progress(done,
+    total) after every block. A KeyboardInterrupt raised from it cancels
+    the session like Ctrl+C does.
+    """
+    logger = logger or setup_logging(verbose)
+    if resume or checkpoint_path:
+        checkpoint = FlashCheckpoint(checkpoint_path or checkpoint_path_for(port))
+    else:
+        checkpoint = FlashCheckpoint(None)
+    metrics = metrics or SessionMetrics('firmware', port, flash_path)
+    trace = None
+    if trace_path:
+        trace = SerialTrace(meta={'tool': 'firmware', 'port': port, 'baud': baudrate, 'image': flash_path,
+                                  'window': window})
+    ok = False
     try:
-        with open(flash_path, "rb") as f:
-            FLASH = bytearray(f.read())
-    except Exception as e:
-        logger.error(f"Failed to read firmware file: {e}")
+        if image is not None:
+            image = FirmwareImage.coerce(image, flash_path)
+        else:
+            # Read and validate the firmware file, once for both attempts below
+            try:
+                image = validate_firmware_file(flash_path, force, prompt, logger)
+            except Exception as e:
+                logger.error(f"Firmware validation failed: {e}")
+                return False
+        try:
+            ok = _run_update(port, baudrate, flash_path, verbose, force, window, check_port, prompt,
+                             image, logger, quiet, connect_timeout, baud_cache, metrics, trace,
+                             checkpoint, resume, progress)
+        except ResumeRejected as e:
+            logger.warning(f"Cannot resume: {e}. Falling back to a full reflash")
+            metrics.count('resume_fallbacks')
+            ok = _run_update(port, baudrate, flash_path, verbose, force, window, False, prompt,
+                             image, logger, quiet, connect_timeout, baud_cache, metrics, trace,
+                             checkpoint, False, progress)
+        return ok
+    finally:
+        if ok:
+            checkpoint.clear()
+        else:
+            try:
+                checkpoint.save()
+            except OSError as e:
+                logger.warning(f"Could not save checkpoint {checkpoint.path}: {e}")
+        if trace is not None and (trace_always or not ok):
+            try:
+                logger.info(f"Serial trace saved to {trace.dump(trace_path)} ({len(trace)} records)")
+            except OSError as e:
+                logger.warning(f"Could not save serial trace to {trace_path}: {e}")
+        metrics.finish(ok)
+        logger.info(format_metrics(metrics))
+        if metrics_dir:
+            try:
+                metrics.export(metrics_dir)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {metrics_dir}: {e}")
+
+def _run_update(port, baudrate, flash_path, verbose, force, window, check_port, prompt,
+                image, logger, quiet, connect_timeout, baud_cache, metrics, trace, checkpoint, resume,
+                progress=None):
+    """The session behind updater(); returns True on success"""
+    logger.info(f"Starting firmware update from {flash_path} on {port}")
+    console = _no_output if quiet else print
+    
+    # Verify serial port
+    if check_port and not verify_serial_port(port, prompt, logger):
+        logger.error(f"Serial port verification failed for {port}")
         return False
     
     # Print first 128 bytes for debugging
     if verbose:
         logger.debug("Firmware header dump:")
-        logger.debug(hex_dump(FLASH[:128]))
+        logger.debug(hex_dump(image.view[:128]))
     
-    original_size = len(FLASH)
-    if len(FLASH) < EXPECTED_FLASH_SIZE:
-        logger.info(f"Padding firmware data from {len(FLASH)} to {EXPECTED_FLASH_SIZE} bytes")
-        FLASH += b'\xFF' * (EXPECTED_FLASH_SIZE - len(FLASH))
+    # Step 1: Verify firmware and prepare. The image is parsed once; block
+    # frames are views into it and the END checksum is precomputed.
+    try:
+        plan = plan_frames(image.data)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    logger.info(f"Firmware size from header: {plan.data_end} bytes")
+    maxPos = len(plan.blocks)
+    
+    resume_addr = resume_point(checkpoint.path, image, plan, logger) if resume else 0
+    start_block = next((i for i, frame in enumerate(plan.blocks) if frame.addr >= resume_addr), maxPos)
+    checkpoint.start(image, plan, resume_addr)
     
     # Initialize progress tracking
     print_progress.start_time = time.time()
     
-    # Create backup filename for potential use
-    backup_path = f"{flash_path}.bak"
-    
     # Use context manager for safer serial handling
-    with safe_serial(port, baudrate, timeout=0.1, write_timeout=2) as ser:
+    auto_baud = baudrate == 'auto'
+    metrics.bytes = plan.data_end - resume_addr
+    open_start = time.perf_counter()
+    with safe_serial(port, FALLBACK_BAUD if auto_baud else baudrate, logger=logger, trace=trace,
+                     timeout=0.1, write_timeout=2) as ser:
+        metrics.add_phase('port_open', time.perf_counter() - open_start)
         try:
-            # Step 1: Verify firmware and prepare
-            try:
-                dataEndAddr = (FLASH[0x40] << 24) | (FLASH[0x41] << 16) | (FLASH[0x42] << 8) | FLASH[0x43]
-                
-                if dataEndAddr <= 0 or dataEndAddr > EXPECTED_FLASH_SIZE:
-                    logger.error(f"Invalid data end address in header: {dataEndAddr:#x}")
-                    return False
-                    
-                logger.info(f"Firmware size from header: {dataEndAddr} bytes")
-            except IndexError:
-                logger.error("Failed to extract data end address from header")
-                return False
-            
-            # Calculate data blocks for progress tracking
-            dataStartAddr = 0
-            maxPos = 0
-            dataAddr = dataStartAddr
-            while dataAddr < dataEndAddr:
-                remainder = dataAddr % BLOCK_SIZE
-                realLen = (BLOCK_SIZE - remainder) if (dataAddr + BLOCK_SIZE <= dataEndAddr) else (dataEndAddr - dataAddr)
-                maxPos += 1
-                dataAddr += realLen
-
             # Step 2: Open port and handshake
             logger.info("Initiating handshake with radio")
-            ser.reset_input_buffer()
             ser.reset_output_buffer()
-            ser.write(CMD_DOWNLOAD)
-            
+            handshake_start = time.perf_counter()
             try:
-                rxBuf = read_exact(ser, 8, timeout=10, description="handshake response")
-            except TimeoutError:
-                logger.error("No response from radio. Is the radio in update mode?")
-                print("\nERROR: No response from radio. Please check:")
-                print("1. Radio is in update mode (hold SK1+PTT+SK2 while powering on)")
-                print("2. Cable is properly connected")
-                print("3. Correct serial port is selected")
+                # Probe quickly while the radio boots into update mode and
+                # read the reply as soon as its first byte shows up
+                if auto_baud:
+                    memory = BaudMemory(baud_cache)
+                    model = f"{image.model}-hw{image.hardware}"
+                    baud_key = memory.key(port, model)
+                    link, baudrate, probes = negotiate_baud(
+                        ser, CMD_DOWNLOAD, HANDSHAKE_RESPONSES, preferred=memory.get(baud_key).get('baud'),
+                        connect_timeout=connect_timeout, logger=logger)
+                    memory.record_probes(baud_key, baudrate, probes)
+                    logger.info(f"Using {baudrate} baud\n{format_baud_report(probes, memory.get(baud_key))}")
+                else:
+                    link = connect(ser, CMD_DOWNLOAD, HANDSHAKE_RESPONSES,
+                                   timeout=connect_timeout, logger=logger)
+            except ConnectTimeout as e:
+                logger.error(f"No response from radio. Is the radio in update mode? ({e})")
+                console("\nERROR: No response from radio. Please check:")
+                console("1. Radio is in update mode (hold SK1+PTT+SK2 while powering on)")
+                console("2. Cable is properly connected")
+                console("3. Correct serial port is selected")
                 return False
-                
-            data = bytearray(8)
-            data[:8] = FLASH[0x30:0x30+8]
+            finally:
+                metrics.add_phase('handshake', time.perf_counter() - handshake_start)
+            metrics.baud = baudrate
+            rxBuf = link.response
             
             # Determine radio type
-            if data[1] == ord('2'):
+            if image.new_hardware:
                 # New hardware
                 if rxBuf[:len(CMD_NEW_HARDWARE)] != CMD_NEW_HARDWARE:
                     logger.error(f"Handshake failed (new hardware): expected {CMD_NEW_HARDWARE!r}, got {rxBuf[:len(CMD_NEW_HARDWARE)]!r}")
@@ -377,120 +542,122 @@ def updater(port, baudrate, flash_path, verbose=False, force=False):
 
             # Step 3: ACK
             logger.info("Sending initial ACK")
-            ser.reset_input_buffer()
-            ser.write(CMD_ACK[:1])
-            try:
-                response = read_exact(ser, 1, description="ACK response")
-                if response != CMD_ACK[:1]:
-                    logger.error(f"ACK failed: expected {CMD_ACK[:1]!r}, got {response!r}")
+            with metrics.phase('initial_ack'):
+                ser.reset_input_buffer()
+                ser.write(CMD_ACK[:1])
+                try:
+                    response = read_exact(ser, 1, description="ACK response", logger=logger)
+                    if response != CMD_ACK[:1]:
+                        logger.error(f"ACK failed: expected {CMD_ACK[:1]!r}, got {response!r}")
+                        return False
+                except TimeoutError:
+                    logger.error("Timeout waiting for ACK response")
                     return False
-            except TimeoutError:
-                logger.error("Timeout waiting for ACK response")
-                return False
 
-            # Step 4: Send FLASH ERASE command
-            logger.info("Erasing flash memory - DO NOT INTERRUPT OR POWER OFF")
-            data = bytearray(16)
-            data[:8] = CMD_FLASH[1]
-            data[8:16] = bytes([40, 6, 136, 25, 19, 3, 24, 32])
-            
-            # Use retry for critical commands
-            if not write_and_wait_ack(ser, data, CMD_ACK[:1], description="FLASH ERASE command", retry_count=2):
-                logger.error("Flash erase failed")
-                return False
+            # Step 4: Send FLASH ERASE command (not when resuming: it would
+            # wipe the blocks the checkpoint says are already written)
+            if resume_addr:
+                logger.info(f"Resuming at {resume_addr:#x}, skipping flash erase")
+            else:
+                logger.info("Erasing flash memory - DO NOT INTERRUPT OR POWER OFF")
+                data = bytearray(16)
+                data[:8] = CMD_FLASH[1]
+                data[8:16] = bytes([40, 6, 136, 25, 19, 3, 24, 32])
+                
+                # Use retry for critical commands
+                with metrics.phase('erase'):
+                    erased = write_and_wait_ack(ser, data, CMD_ACK[:1], description="FLASH ERASE command",
+                                                retry_count=2, logger=logger, metrics=metrics)
+                if not erased:
+                    logger.error("Flash erase failed")
+                    return False
 
             # Step 5: Send PROGRAM1 command
             logger.info("Sending PROGRAM command")
             data = bytearray(8)
             data[:8] = CMD_PRG
             
-            if not write_and_wait_ack(ser, data, CMD_ACK[:1], description="PROGRAM1 command", retry_count=1):
+            with metrics.phase('program'):
+                # A refusal while resuming means "erase first", so don't retry it
+                programmed = write_and_wait_ack(ser, data, CMD_ACK[:1], description="PROGRAM1 command",
+                                                retry_count=0 if resume_addr else 1, logger=logger,
+                                                metrics=metrics)
+            if not programmed:
+                if resume_addr:
+                    raise ResumeRejected("the radio refused PROGRAM1 without an erase")
                 logger.error("Program command failed")
                 return False
 
             # Step 6: Send firmware data in blocks
             logger.info("Beginning firmware upload")
-            check_sum = 0
-            curTimes = 80  # Starting offset in firmware file
-            dataAddr = dataStartAddr
-            pos = 0
+            upload_start = time.perf_counter()
+            nextBlock = start_block
+            pos = start_block
             
             # Backup storage for failed blocks to retry
             failed_blocks = []
             
-            while dataAddr < dataEndAddr:
-                remainder = dataAddr % BLOCK_SIZE
-                realLen = (BLOCK_SIZE - remainder) if (dataAddr + BLOCK_SIZE <= dataEndAddr) else (dataEndAddr - dataAddr)
-                
-                # Check for data overrun
-                if curTimes + realLen > len(FLASH):
-                    logger.error(f"Data overrun: curTimes={curTimes}, realLen={realLen}, FLASH size={len(FLASH)}")
-                    return False
-                
-                # Prepare block header
-                realData = bytearray(realLen + 5)
-                realData[0] = (dataAddr >> 24) & 0xFF
-                realData[1] = (dataAddr >> 16) & 0xFF
-                realData[2] = (dataAddr >> 8) & 0xFF
-                realData[3] = dataAddr & 0xFF
-                realData[4] = 0
-                
-                # Get block data
-                data = FLASH[curTimes:curTimes+realLen]
-                realData[5:] = data
-                check_sum += sum(data)
-                curTimes += realLen
-                
-                # Write block header
-                ser.write(realData[:5])
-                # Write block data
-                ser.write(realData[5:])
+            # Blocks sent but not yet acknowledged, oldest first. The radio
+            # ACKs in order, so each ACK belongs to the head of this queue.
+            in_flight = deque()
+            sent_at = deque()  # When each in-flight block was written
+            if window > 1:
+                logger.info(f"Using a send window of {window} blocks")
+            
+            while nextBlock < maxPos or in_flight:
+                # Keep up to 'window' blocks on the wire
+                while nextBlock < maxPos and len(in_flight) < window:
+                    frame = plan.blocks[nextBlock]
+                    write_frame(ser, frame)
+                    sent_at.append(time.perf_counter())
+                    in_flight.append(frame)
+                    nextBlock += 1
                 
+                frame = in_flight.popleft()
+                frame_sent = sent_at.popleft()
+                acked = False
                 try:
-                    response = read_exact(ser, 1, timeout=5, description=f"block at {dataAddr:#x}")
+                    response = read_exact(ser, 1, timeout=5, description=f"block at {frame.addr:#x}", logger=logger)
+                    metrics.observe_ack(time.perf_counter() - frame_sent)
                     if response != CMD_ACK[:1]:
-                        logger.error(f"Block write failed at {dataAddr:#x}: expected {CMD_ACK[:1]!r}, got {response!r}")
-                        # Record failed block for potential retry
-                        failed_blocks.append((dataAddr, realLen, curTimes - realLen))
-                        if len(failed_blocks) > 5:
-                            logger.error("Too many block write failures, aborting")
-                            return False
+                        logger.error(f"Block write failed at {frame.addr:#x}: expected {CMD_ACK[:1]!r}, got {response!r}")
+                        metrics.count('nacks')
+                    else:
+                        acked = True
+                        checkpoint.acked(frame)
                 except TimeoutError:
-                    logger.error(f"Timeout waiting for ACK after block write at {dataAddr:#x}")
+                    logger.error(f"Timeout waiting for ACK after block write at {frame.addr:#x}")
+                    metrics.count('timeouts')
+                
+                if not acked:
                     # Record failed block for potential retry
-                    failed_blocks.append((dataAddr, realLen, curTimes - realLen))
+                    failed_blocks.append(frame)
+                    metrics.count('failed_blocks')
                     if len(failed_blocks) > 5:
-                        logger.error("Too many block timeouts, aborting")
+                        logger.error("Too many block write failures, aborting")
                         return False
+                    if window > 1:
+                        # Blocks already in flight are still drained one ACK at a time
+                        logger.warning(f"Falling back to stop-and-wait after failure at {frame.addr:#x}")
+                        window = 1
                     
                 pos += 1
-                print_progress(pos * 100 / maxPos, f"Writing block at {dataAddr:#x}")
-                dataAddr += realLen
+                if progress is not None:
+                    progress(pos, maxPos)
+                elif not quiet:
+                    print_progress(pos * 100 / maxPos, f"Writing block at {frame.addr:#x}")
 
             # Retry failed blocks if any
             if failed_blocks:
                 logger.warning(f"Retrying {len(failed_blocks)} failed blocks")
-                for addr, length, time_pos in failed_blocks:
+                for frame in failed_blocks:
+                    addr = frame.addr
                     logger.info(f"Retrying block at {addr:#x}")
-                    
-                    # Prepare block header for retry
-                    retryData = bytearray(length + 5)
-                    retryData[0] = (addr >> 24) & 0xFF
-                    retryData[1] = (addr >> 16) & 0xFF
-                    retryData[2] = (addr >> 8) & 0xFF
-                    retryData[3] = addr & 0xFF
-                    retryData[4] = 0
-                    
-                    # Get retry block data
-                    retry_data = FLASH[time_pos:time_pos+length]
-                    retryData[5:] = retry_data
-                    
-                    # Write retry block
-                    ser.write(retryData[:5])
-                    ser.write(retryData[5:])
+                    metrics.count('retries')
+                    write_frame(ser, frame)
                     
                     try:
-                        retry_resp = read_exact(ser, 1, timeout=5, description=f"retry block at {addr:#x}")
+                        retry_resp = read_exact(ser, 1, timeout=5, description=f"retry block at {addr:#x}", logger=logger)
                         if retry_resp != CMD_ACK[:1]:
                             logger.error(f"Retry failed for block at {addr:#x}")
                             return False
@@ -499,61 +666,180 @@ def updater(port, baudrate, flash_path, verbose=False, force=False):
                         logger.error(f"Timeout on retry for block at {addr:#x}")
                         return False
 
+            upload_seconds = time.perf_counter() - upload_start
+            metrics.add_phase('upload', upload_seconds)
+
             # Step 7: Send END and checksum
             logger.info("Sending END command and checksum")
-            data = bytearray(9)
-            data[0:3] = b'END'
-            data[3:5] = b'\xFF\xFF'
-            data[5] = (check_sum >> 24) & 0xFF
-            data[6] = (check_sum >> 16) & 0xFF
-            data[7] = (check_sum >> 8) & 0xFF
-            data[8] = check_sum & 0xFF
+            data = plan.end_frame
             
             # Use retry for critical END command
-            if not write_and_wait_ack(ser, data, CMD_ACK[:1], timeout=15, description="END command", retry_count=2):
+            with metrics.phase('end'):
+                ended = write_and_wait_ack(ser, data, CMD_ACK[:1], timeout=15, description="END command",
+                                           retry_count=2, logger=logger, metrics=metrics)
+            if not ended:
+                if resume_addr:
+                    raise ResumeRejected("the radio rejected the checksum of the resumed image")
                 logger.error("END/Checksum verification failed")
                 return False
 
+            logger.info(f"Uploaded {metrics.bytes} bytes in {upload_seconds:.2f}s "
+                        f"({metrics.bytes / upload_seconds:.0f} bytes/s at {baudrate} baud)")
+            if auto_baud:
+                memory.record_transfer(baud_key, baudrate, metrics.bytes, upload_seconds)
             logger.info("Firmware update completed successfully!")
-            print("\nFirmware update successful! You can safely disconnect the radio.")
+            console("\nFirmware update successful! You can safely disconnect the radio.")
             return True
             
         except KeyboardInterrupt:
             logger.warning("Update cancelled by user")
-            print("\nOperation cancelled - radio may be in an inconsistent state")
+            console("\nOperation cancelled - radio may be in an inconsistent state")
             return False
+        except ResumeRejected:
+            raise
         except Exception as e:
             logger.exception(f"Unexpected error during update: {e}")
-            print(f"\nError: {e}")
+            console(f"\nError: {e}")
             return False
 
+# --- Fleet Mode ---
+def fleet_update(ports, baudrate, flash_path, verbose=False, force=False, window=1, check_port=True,
+                 prompt='no', log_dir='.', max_workers=None, connect_timeout=CONNECT_TIMEOUT,
+                 baud_cache=BAUD_CACHE, metrics_dir=None, trace_path=None, trace_always=False,
+                 resume=False):
+    """
+    Flash the same image to several radios at once, one thread per port.
+    
+    The image is read and validated once up front. Each port gets its own
+    logger and fw_update_<port>.log in 'log_dir'; the y/n prompts are
+    answered by the 'prompt' policy since nobody sits at each session.
+    With 'metrics_dir' every port's session metrics are exported there, and
+    with 'trace_path' each port's serial trace goes to trace_path_for().
+    'resume' continues each port from its own checkpoint_path_for(port,
+    log_dir), next to the port's log.
+    
+    Returns:
+        list: One result dict per port (port, ok, seconds, bytes, log_file, error)
+    """
+    logger = setup_logging(verbose, os.path.join(log_dir, 'fw_update_fleet.log'), name='fleet')
+    image = validate_firmware_file(flash_path, force, prompt, logger)
+    logger.info(f"Loaded {flash_path} ({len(image)} bytes) for {len(ports)} ports")
+    
+    def flash_one(port):
+        tag = port_tag(port)
+        log_file = os.path.join(log_dir, f"fw_update_{tag}.log")
+        port_logger = setup_logging(verbose, log_file, name=tag)
+        result = {'port': port, 'ok': False, 'seconds': 0.0, 'bytes': len(image) - HEADER_SIZE,
+                  'log_file': log_file, 'error': ''}
+        start = time.perf_counter()
+        try:
+            result['ok'] = updater(port, baudrate, flash_path, verbose, force, window, check_port,
+                                   prompt=prompt, image=image, logger=port_logger, quiet=True,
+                                   connect_timeout=connect_timeout, baud_cache=baud_cache,
+                                   metrics_dir=metrics_dir,
+                                   trace_path=trace_path and trace_path_for(trace_path, tag),
+                                   trace_always=trace_always, resume=resume,
+                                   checkpoint_path=checkpoint_path_for(port, log_dir) if resume else None)
+            if not result['ok']:
+                result['error'] = "see log"
+        except Exception as e:
+            port_logger.error(f"Session failed: {e}")
+            result['error'] = str(e)
+        finally:
+            result['seconds'] = time.perf_counter() - start
+            for handler in list(port_logger.handlers):
+                port_logger.removeHandler(handler)
+                handler.close()
+        return result
+    
+    with ThreadPoolExecutor(max_workers=max_workers or len(ports)) as pool:
+        results = list(pool.map(flash_one, ports))
+    logger.info(f"{sum(r['ok'] for r in results)}/{len(results)} radios flashed")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    return results
+
+def format_fleet_results(results):
+    """Render fleet results as a plain-text table with an aggregate line"""
+    lines = [f"{'port':<24} {'result':<7} {'time':>8} {'bytes/s':>9}  log / error"]
+    for r in results:
+        rate = r['bytes'] / r['seconds'] if r['ok'] and r['seconds'] else 0
+        detail = r['log_file'] if r['ok'] else f"{r['error']} ({r['log_file']})"
+        lines.append(f"{r['port']:<24} {'OK' if r['ok'] else 'FAILED':<7} {r['seconds']:7.2f}s {rate:9.0f}  {detail}")
+    ok = [r for r in results if r['ok']]
+    wall = max((r['seconds'] for r in results), default=0)
+    total = sum(r['bytes'] for r in ok)
+    lines.append(f"{len(ok)}/{len(results)} radios flashed, {total} bytes in {wall:.2f}s "
+                 f"({total / wall if wall else 0:.0f} bytes/s aggregate)")
+    return '\n'.join(lines)
+
 # --- Entry Point ---
-if __name__ == "__main__":
+def main(argv=None, prog=None):
     import argparse
-    parser = argparse.ArgumentParser(description="Baofeng Radio Firmware Updater")
-    parser.add_argument("--port", required=True, help="Serial port (e.g. COM3 or /dev/ttyUSB0)")
-    parser.add_argument("--baud", type=int, default=115200, help="Baudrate (default: 115200)")
+    parser = argparse.ArgumentParser(prog=prog, description="Baofeng Radio Firmware Updater")
+    parser.add_argument("--port", required=True, nargs="+",
+                        help="Serial port (e.g. COM3 or /dev/ttyUSB0); several ports flash concurrently")
+    parser.add_argument("--baud", type=parse_baud, default=115200,
+                        help="Baudrate, or 'auto' to probe for the fastest rate the radio answers at (default: 115200)")
+    parser.add_argument("--baud-cache", default=BAUD_CACHE,
+                        help=f"Where --baud auto remembers rates per adapter and model (default: {BAUD_CACHE})")
     parser.add_argument("--flash", required=True, help="Path to firmware file")
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose logging")
     parser.add_argument("--force", "-f", action="store_true", help="Skip firmware validation checks")
     parser.add_argument("--list-ports", action="store_true", help="List available serial ports and exit")
-    args = parser.parse_args()
+    parser.add_argument("--skip-port-check", action="store_true",
+                        help="Don't check that the port is a USB programming adapter")
+    parser.add_argument("--window", type=int, default=1,
+                        help="Blocks sent ahead of their ACKs (default: 1, stop-and-wait)")
+    parser.add_argument("--prompt", choices=PROMPT_POLICIES,
+                        help="Answer y/n questions: ask, or always yes/no (default: ask, 'no' with several ports)")
+    parser.add_argument("--log-dir", default=".", help="Directory for per-port logs with several ports")
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds to keep probing for the radio (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--metrics-dir",
+                        help="Append per-session JSON and write Prometheus .prom files to this directory")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Record all serial traffic and save it here if the update fails "
+                             "(with several ports: FILE_<port>.ext)")
+    parser.add_argument("--trace-always", action="store_true", help="Save the --trace file even on success")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted upload from its checkpoint instead of starting over")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="Save upload progress here when a session fails, for --resume "
+                             "(single port; default with --resume: fw_resume_<port>.json)")
+    args = parser.parse_args(argv)
+    if args.window < 1:
+        parser.error("--window must be at least 1")
     
     try:
         # Special handling for --list-ports
         if args.list_ports:
-            import serial.tools.list_ports
-            ports = list(serial.tools.list_ports.comports())
-            print("Available serial ports:")
-            for port in ports:
-                print(f"  {port.device}: {port.description}")
+            print_ports()
             sys.exit(0)
             
-        success = updater(args.port, args.baud, args.flash, args.verbose, args.force)
+        if len(args.port) > 1:
+            os.makedirs(args.log_dir, exist_ok=True)
+            results = fleet_update(args.port, args.baud, args.flash, args.verbose, args.force, args.window,
+                                   not args.skip_port_check, args.prompt or 'no', args.log_dir,
+                                   connect_timeout=args.connect_timeout, baud_cache=args.baud_cache,
+                                   metrics_dir=args.metrics_dir, trace_path=args.trace,
+                                   trace_always=args.trace_always, resume=args.resume)
+            print(format_fleet_results(results))
+            sys.exit(0 if all(r['ok'] for r in results) else 1)
+        
+        success = updater(args.port[0], args.baud, args.flash, args.verbose, args.force, args.window,
+                          check_port=not args.skip_port_check, prompt=args.prompt or 'ask',
+                          connect_timeout=args.connect_timeout, baud_cache=args.baud_cache,
+                          metrics_dir=args.metrics_dir, trace_path=args.trace,
+                          trace_always=args.trace_always, resume=args.resume, checkpoint_path=args.checkpoint)
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
         sys.exit(1)
     except Exception as e:
         print(f"\nCritical error: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -27,72 +27,46 @@
 
 
 import argparse
+import glob
+import mmap
 import os
 import struct
+import sys
+import time
 
-# Constants for Baofeng firmware
-XOR_KEY = 200
-OFFSET = 80
+from firmware_image import OFFSET, XOR_KEY, FirmwareImage, check_encryption_status, validate_header
+from xor_engine import XOR_CHUNK_SIZE, XOR_ENGINES, default_xor_engine, xor_payload
 
-def check_encryption_status(data):
-    """
-    Check if the firmware is encrypted or decrypted by examining byte 0x53.
-    
-    Returns:
-        tuple: (status, message) where status is 'encrypted', 'decrypted', or 'unknown'
-    """
-    if len(data) <= 0x53:
-        return "unknown", "File too small to determine encryption status"
-    
-    marker_byte = data[0x53]
-    if marker_byte == 0x20:
-        return "decrypted", "File appears to be decrypted (marker byte 0x53 = 0x20)"
-    elif marker_byte == 0xE8:  # 0x20 XOR 0xC8 (200)
-        return "encrypted", "File appears to be encrypted (marker byte 0x53 = 0xE8)"
-    else:
-        return "unknown", f"Unknown encryption status (marker byte 0x53 = 0x{marker_byte:02X})"
+# The names fw_catalog and older scripts import from here
+validate_firmware_header = validate_header
 
-def validate_firmware_header(data):
-    """
-    Validate Baofeng firmware header structure.
-    
-    Header should have:
-    - 0x00: "BaoFeng" (0xFF padded)
-    - 0x10: "BF_5RH" (0xFF padded)
-    - 0x20: "V1.0.0.0" (0xFF padded)
-    - 0x30: May be "V2.0.0.0" (0xFF padded)
-    - 0x40: Size of file minus the 0x50 header
-    
-    Returns:
-        tuple: (is_valid, message)
-    """
-    # Check minimum length
-    if len(data) < 0x50:  # Need at least the full header
-        return False, "File too small to possibly be valid firmware"
-    
-    # Check "BaoFeng" signature at 0x0
-    if not (data[0:7] == b'BaoFeng' and all(b == 0xFF for b in data[7:16])):
-        return False, "Invalid header: Missing 'BaoFeng' signature"
-    
-    # Check "BF_5RH" at 0x10
-    if not (data[16:22] == b'BF_5RH' and all(b == 0xFF for b in data[22:32])):
-        return False, "Invalid header: Missing 'BF_5RH' model signature"
-    
-    # Check "V1.0.0.0" at 0x20
-    if not (data[32:40] == b'V1.0.0.0' and all(b == 0xFF for b in data[40:48])):
-        return False, "Invalid header: Missing version signature"
-    
-    # Check size field at 0x40
-    size_field = struct.unpack('>I', data[64:68])[0]  # Big-endian 32-bit int
-    actual_size = len(data) - OFFSET
-    
-    # Validate size field
-    if size_field != actual_size:
-        return False, f"Size mismatch: Header claims {size_field} bytes, actual data size is {actual_size} bytes"
-    
-    return True, "Valid Baofeng firmware header"
+def detect_mode(input_file):
+    """Return 'decrypt' for .dat, 'encrypt' for .bin, or None if unknown"""
+    ext = os.path.splitext(input_file)[1].lower()
+    return {'.dat': 'decrypt', '.bin': 'encrypt'}.get(ext)
+
+def default_output_file(input_file, mode, output_dir=None):
+    """Swap the .dat/.bin extension, optionally moving the file to 'output_dir'"""
+    base = os.path.splitext(input_file)[0]
+    if output_dir is not None:
+        base = os.path.join(output_dir, os.path.basename(base))
+    return f"{base}.bin" if mode == 'decrypt' else f"{base}.dat"
+
+def mode_conflict(mode, status):
+    """Return an error message if 'mode' cannot be applied to a file in 'status'"""
+    # Check if we're trying to encrypt an already encrypted file
+    # or decrypt an already decrypted file
+    if mode == 'encrypt' and status == 'encrypted':
+        return "Cannot encrypt - file is already encrypted"
+    elif mode == 'decrypt' and status == 'decrypted':
+        return "Cannot decrypt - file is already decrypted"
+    return None
 
-def process_file(input_file, output_file=None, mode=None):
+def size_field_matches(data):
+    """Compare the size field at 0x40 with the payload length (None if no header)"""
+    return FirmwareImage(data).size_ok
+
+def process_file(input_file, output_file=None, mode=None, engine=None):
     """
     Encrypt or decrypt a firmware file using XOR.
     
@@ -100,30 +74,26 @@ def process_file(input_file, output_file=None, mode=None):
         input_file: Path to input file
         output_file: Path to output file (optional)
         mode: 'encrypt' or 'decrypt' (optional, detected from file extension if None)
+        engine: XOR engine name (optional, see XOR_ENGINES)
     """
     # Determine mode if not specified
     if mode is None:
-        if input_file.lower().endswith('.dat'):
-            mode = 'decrypt'
-        elif input_file.lower().endswith('.bin'):
-            mode = 'encrypt'
-        else:
+        mode = detect_mode(input_file)
+        if mode is None:
             print(f"Error: Cannot determine mode from file extension '{os.path.splitext(input_file)[1]}'")
             print("Please specify mode or use .bin/.dat extension")
             return
     
     # Determine output file if not specified
     if output_file is None:
-        base = os.path.splitext(input_file)[0]
-        output_file = f"{base}.bin" if mode == 'decrypt' else f"{base}.dat"
+        output_file = default_output_file(input_file, mode)
     
     try:
         # Read input file
-        with open(input_file, 'rb') as f_in:
-            data = bytearray(f_in.read())
+        image = FirmwareImage.from_file(input_file, writable=True)
         
         # Validate header before processing
-        is_valid, message = validate_firmware_header(data)
+        is_valid, message = image.validate()
         if not is_valid:
             print(f"Warning: {message}")
             response = input("Continue anyway? (y/n): ")
@@ -132,41 +102,361 @@ def process_file(input_file, output_file=None, mode=None):
                 return
 
         # Check encryption status before processing
-        status, message = check_encryption_status(data)
-        print(f"File status: {message}")
+        print(f"File status: {image.status_message()}")
         
-        # Check if we're trying to encrypt an already encrypted file
-        # or decrypt an already decrypted file
-        if mode == 'encrypt' and status == 'encrypted':
-            print("Error: Cannot encrypt - file is already encrypted")
-            return
-        elif mode == 'decrypt' and status == 'decrypted':
-            print("Error: Cannot decrypt - file is already decrypted")
+        error = mode_conflict(mode, image.status)
+        if error:
+            print(f"Error: {error}")
             return
                         
-        # XOR each byte starting from offset
-        for i in range(OFFSET, len(data)):
-            data[i] ^= XOR_KEY
+        # XOR every byte starting from offset
+        image.xor(engine, in_place=True)
         
         # Write modified data to output file
         with open(output_file, 'wb') as f_out:
-            f_out.write(data)
+            f_out.write(image.data)
             
         print(f"Success: {mode.capitalize()}ed firmware from '{input_file}' to '{output_file}'")
-        print(f"Processed {len(data)-OFFSET} bytes starting at offset {OFFSET}")
+        print(f"Processed {len(image)-OFFSET} bytes starting at offset {OFFSET}")
         
     except Exception as e:
         print(f"Error: {str(e)}")
 
-def main():
-    parser = argparse.ArgumentParser(description='Encrypt or decrypt Baofeng firmware files')
-    parser.add_argument('input_file', help='Input firmware file (.bin or .dat)')
+# --- Streaming and in-place modes ---
+# Header plus the 0x53 marker byte, the only part inspected before streaming
+STREAM_HEAD_SIZE = 0x54
+
+def _read_fully(f, size):
+    """Read up to 'size' bytes, retrying short reads from pipes"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = f.read(size - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return buf
+
+def _resolve_mode(mode, status):
+    """Pick the opposite of the detected encryption status when no mode is given"""
+    if mode is None:
+        mode = {'encrypted': 'decrypt', 'decrypted': 'encrypt'}.get(status)
+    return mode
+
+def process_stream(f_in, f_out, mode=None, on_invalid='skip', engine=None,
+                   chunk_size=XOR_CHUNK_SIZE, total_size=None, log=sys.stderr):
+    """
+    Encrypt or decrypt a firmware stream chunk by chunk.
+    
+    Only the first STREAM_HEAD_SIZE bytes are inspected before the payload
+    streams through. When the total size is unknown (pipes) the size field is
+    checked once the stream ends.
+    
+    Args:
+        f_in: Binary file object to read from (e.g. sys.stdin.buffer)
+        f_out: Binary file object to write to (e.g. sys.stdout.buffer)
+        mode: 'encrypt' or 'decrypt' (optional, from the marker byte if None)
+        on_invalid: 'skip' (abort) or 'continue' when the header is invalid
+        engine: XOR engine name (optional, see XOR_ENGINES)
+        chunk_size: Bytes read and XORed per step
+        total_size: Size of the input if known (enables the up-front size check)
+        log: Text stream for status messages, kept off f_out
+    
+    Returns:
+        bool: True if the stream was converted
+    """
+    head = _read_fully(f_in, STREAM_HEAD_SIZE)
+    
+    size_field = struct.unpack('>I', head[64:68])[0] if len(head) >= 0x44 else None
+    if total_size is None and size_field is not None:
+        # Defer the size comparison until the whole stream has been seen
+        is_valid, message = validate_header(head, size_field + OFFSET)
+    else:
+        is_valid, message = validate_header(head, total_size)
+    if not is_valid:
+        print(f"Warning: {message}", file=log)
+        if on_invalid == 'skip':
+            print("Operation cancelled.", file=log)
+            return False
+    
+    status, message = check_encryption_status(head)
+    print(f"File status: {message}", file=log)
+    mode = _resolve_mode(mode, status)
+    if mode is None:
+        print("Error: Cannot determine mode from stream, please specify --mode", file=log)
+        return False
+    error = mode_conflict(mode, status)
+    if error:
+        print(f"Error: {error}", file=log)
+        return False
+    
+    xor_payload(head, OFFSET, key=XOR_KEY, engine=engine)
+    f_out.write(head)
+    processed = max(len(head) - OFFSET, 0)
+    
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while True:
+        n = f_in.readinto(buf)
+        if not n:
+            break
+        xor_payload(buf, 0, n, key=XOR_KEY, engine=engine)
+        f_out.write(view[:n])
+        processed += n
+    view.release()
+    f_out.flush()
+    
+    if total_size is None and size_field is not None and size_field != processed:
+        # Too late to hold the output back, but still fail the pipeline
+        print(f"Warning: Size mismatch: Header claims {size_field} bytes, "
+              f"actual data size is {processed} bytes", file=log)
+        if on_invalid == 'skip':
+            return False
+    
+    print(f"Success: {mode.capitalize()}ed {processed} bytes starting at offset {OFFSET}", file=log)
+    return True
+
+def process_in_place(path, mode=None, on_invalid='skip', engine=None):
+    """
+    Encrypt or decrypt a firmware file in place through a memory map.
+    
+    The payload is XORed directly in the mapped pages, so no second copy of
+    the image is allocated.
+    
+    Returns:
+        bool: True if the file was converted
+    """
+    with open(path, 'r+b') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < STREAM_HEAD_SIZE:
+            print("Error: File too small to possibly be valid firmware")
+            return False
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) as mm:
+            head = mm[:STREAM_HEAD_SIZE]
+            is_valid, message = validate_header(head, size)
+            if not is_valid:
+                print(f"Warning: {message}")
+                if on_invalid == 'skip':
+                    print("Operation cancelled.")
+                    return False
+            
+            status, message = check_encryption_status(head)
+            print(f"File status: {message}")
+            mode = _resolve_mode(mode or detect_mode(path), status)
+            if mode is None:
+                print("Error: Cannot determine mode, please specify --mode")
+                return False
+            error = mode_conflict(mode, status)
+            if error:
+                print(f"Error: {error}")
+                return False
+            
+            xor_payload(mm, OFFSET, key=XOR_KEY, engine=engine)
+            mm.flush()
+    
+    print(f"Success: {mode.capitalize()}ed firmware '{path}' in place")
+    print(f"Processed {size-OFFSET} bytes starting at offset {OFFSET}")
+    return True
+
+def _open_stream_input(path):
+    """Return (file, size) for a path or '-' (stdin, size unknown)"""
+    if path in (None, '-'):
+        return sys.stdin.buffer, None
+    f = open(path, 'rb')
+    return f, os.fstat(f.fileno()).st_size
+
+# --- Batch mode ---
+BATCH_EXTENSIONS = ('.dat', '.bin')
+INVALID_POLICIES = ('skip', 'continue')
+
+def expand_batch_inputs(patterns, mode=None):
+    """
+    Expand directories and glob patterns into a sorted list of firmware files.
+    
+    Directories contribute their .dat files when decrypting, .bin files when
+    encrypting, and both when the mode comes from each file's extension.
+    """
+    if mode == 'decrypt':
+        extensions = ('.dat',)
+    elif mode == 'encrypt':
+        extensions = ('.bin',)
+    else:
+        extensions = BATCH_EXTENSIONS
+    
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    full = os.path.join(path, name)
+                    if os.path.isfile(full) and name.lower().endswith(extensions):
+                        files.append(full)
+            else:
+                files.append(path)
+    
+    # Keep the first occurrence of files named more than once
+    unique, seen = [], set()
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def convert_one(input_file, output_file=None, mode=None, on_invalid='skip', engine=None, output_dir=None):
+    """
+    Non-interactive conversion of one file, used by the batch workers.
+    
+    Returns:
+        dict: file, output, mode, status, marker, size_ok, seconds and message
+    """
+    start = time.perf_counter()
+    result = {'file': input_file, 'output': None, 'mode': mode, 'status': 'error',
+              'marker': None, 'size_ok': None, 'seconds': 0.0, 'message': ''}
+    try:
+        mode = mode or detect_mode(input_file)
+        result['mode'] = mode
+        if mode is None:
+            result['message'] = "Cannot determine mode from file extension"
+            return result
+        
+        image = FirmwareImage.from_file(input_file, writable=True)
+        
+        result['marker'] = image.data[0x53] if len(image) > 0x53 else None
+        result['size_ok'] = image.size_ok
+        
+        is_valid, message = image.validate()
+        if not is_valid and on_invalid == 'skip':
+            result['status'] = 'skipped'
+            result['message'] = message
+            return result
+        
+        error = mode_conflict(mode, image.status)
+        if error:
+            result['message'] = error
+            return result
+        
+        image.xor(engine, in_place=True)
+        
+        output_file = output_file or default_output_file(input_file, mode, output_dir)
+        with open(output_file, 'wb') as f_out:
+            f_out.write(image.data)
+        
+        result['output'] = output_file
+        result['status'] = 'ok' if is_valid else 'warning'
+        result['message'] = message
+        return result
+    except Exception as e:
+        result['message'] = str(e)
+        return result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+def process_batch(patterns, mode=None, output_dir=None, on_invalid='skip', jobs=None, engine=None):
+    """
+    Convert every firmware file matched by 'patterns' across a process pool.
+    
+    Args:
+        patterns: Files, directories or glob patterns
+        mode: 'encrypt' or 'decrypt' (optional, per file extension if None)
+        output_dir: Directory for outputs (optional, next to inputs if None)
+        on_invalid: 'skip' files with a bad header or 'continue' converting them
+        jobs: Worker processes (default: one per CPU)
+        engine: XOR engine name (optional, see XOR_ENGINES)
+    
+    Returns:
+        list: One result dict per file, in input order
+    """
+    if on_invalid not in INVALID_POLICIES:
+        raise ValueError(f"Unknown invalid-header policy '{on_invalid}'")
+    files = expand_batch_inputs(patterns, mode)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    jobs = jobs or os.cpu_count() or 1
+    args = [(f, None, mode, on_invalid, engine, output_dir) for f in files]
+    if jobs == 1 or len(files) <= 1:
+        return [convert_one(*a) for a in args]
+    
+    from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing; only batches need it
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+        return list(pool.map(convert_one, *zip(*args)))
+
+def format_batch_summary(results):
+    """Render batch results as a plain-text table"""
+    rows = [("File", "Mode", "Status", "Marker", "Size", "Time", "Message")]
+    for r in results:
+        marker = f"0x{r['marker']:02X}" if r['marker'] is not None else "-"
+        size_ok = {True: "match", False: "MISMATCH", None: "-"}[r['size_ok']]
+        rows.append((r['file'], r['mode'] or "-", r['status'], marker, size_ok,
+                     f"{r['seconds']*1000:.1f}ms", r['message']))
+    
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append("  ".join(cells + [row[-1]]).rstrip())
+    
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    lines.append(f"{len(results)} files: " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+    return '\n'.join(lines)
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Encrypt or decrypt Baofeng firmware files')
+    parser.add_argument('input_file', nargs='?', help='Input firmware file (.bin or .dat)')
     parser.add_argument('output_file', nargs='?', help='Output file (optional)')
     parser.add_argument('--mode', choices=['encrypt', 'decrypt'], 
                         help='Force encryption or decryption mode (default: based on file extension)')
+    parser.add_argument('--engine', choices=sorted(XOR_ENGINES),
+                        help=f'XOR engine to use (default: {default_xor_engine()})')
+    parser.add_argument('--batch', nargs='+', metavar='PATH',
+                        help='Convert every file in these directories or glob patterns without prompting')
+    parser.add_argument('--output-dir', help='Batch mode: write outputs here (default: next to inputs)')
+    parser.add_argument('--jobs', '-j', type=int, help='Batch mode: worker processes (default: CPU count)')
+    parser.add_argument('--stream', action='store_true',
+                        help="Convert in chunks; use '-' (or omit) for stdin/stdout pipelines")
+    parser.add_argument('--in-place', action='store_true',
+                        help='Convert input_file in place through a memory map')
+    parser.add_argument('--chunk-size', type=int, default=XOR_CHUNK_SIZE,
+                        help=f'Stream mode: bytes per chunk (default: {XOR_CHUNK_SIZE})')
+    parser.add_argument('--on-invalid', choices=INVALID_POLICIES, default='skip',
+                        help='Batch, stream and in-place modes: what to do with files whose '
+                             'header fails validation (default: skip)')
+    
+    args = parser.parse_args(argv)
+    if args.stream:
+        f_in, total_size = _open_stream_input(args.input_file)
+        try:
+            if args.output_file in (None, '-'):
+                ok = process_stream(f_in, sys.stdout.buffer, args.mode, args.on_invalid, args.engine,
+                                    args.chunk_size, total_size)
+            else:
+                with open(args.output_file, 'wb') as f_out:
+                    ok = process_stream(f_in, f_out, args.mode, args.on_invalid, args.engine,
+                                        args.chunk_size, total_size)
+        finally:
+            if f_in is not sys.stdin.buffer:
+                f_in.close()
+        sys.exit(0 if ok else 1)
+    
+    if args.in_place:
+        if not args.input_file or args.output_file:
+            parser.error("--in-place takes exactly one input_file")
+        sys.exit(0 if process_in_place(args.input_file, args.mode, args.on_invalid, args.engine) else 1)
+    
+    if args.batch:
+        if args.input_file:
+            parser.error("input_file cannot be combined with --batch")
+        results = process_batch(args.batch, args.mode, args.output_dir, args.on_invalid, args.jobs, args.engine)
+        print(format_batch_summary(results))
+        sys.exit(0 if all(r['status'] in ('ok', 'warning') for r in results) else 1)
     
-    args = parser.parse_args()
-    process_file(args.input_file, args.output_file, args.mode)
+    if not args.input_file:
+        parser.error("input_file is required unless --batch is given")
+    process_file(args.input_file, args.output_file, args.mode, args.engine)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
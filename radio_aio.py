@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+asyncio driver for the radio_protocol state machines.
+
+All ports are served from one event loop thread: each port's file
+descriptor is registered with the loop, so a session only wakes up when its
+radio sends something or its protocol timer expires.
+
+    python radio_aio.py firmware --flash firmware/BF_5RH_501_v2_0_9.dat --port /dev/ttyUSB0 /dev/ttyUSB1
+    python radio_aio.py font --font font.TXT --port /dev/ttyUSB0
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import serial
+
+from radio_protocol import FirmwareProtocol, FontProtocol
+
+EXECUTOR_READ_TIMEOUT = 0.05  # Seconds a fallback read blocks in the executor
+
+class SerialStream:
+    """
+    Non-blocking byte stream over an open pyserial port.
+    
+    On POSIX the port's file descriptor is watched by the event loop. Ports
+    without one (e.g. Windows) fall back to short blocking reads and
+    blocking writes in the loop's default executor; the port's timeouts are
+    switched to suit.
+    """
+    
+    def __init__(self, ser, loop):
+        self.ser = ser
+        self.loop = loop
+        try:
+            self.fd = ser.fileno()
+            os.set_blocking(self.fd, False)
+        except (AttributeError, OSError, ValueError):
+            self.fd = None
+            # timeout=0 would make every executor read return at once and
+            # spin; write_timeout=0 would drop what the driver cannot take
+            ser.timeout = EXECUTOR_READ_TIMEOUT
+            ser.write_timeout = None
+    
+    async def _wait_fd(self, add, remove):
+        future = self.loop.create_future()
+        add(self.fd, future.set_result, None)
+        try:
+            await future
+        finally:
+            remove(self.fd)
+    
+    async def read(self):
+        """Return the next chunk of received bytes (at least one)"""
+        if self.fd is None:
+            while True:
+                data = await self.loop.run_in_executor(None, self.ser.read, max(1, self.ser.in_waiting))
+                if data:
+                    return data
+        woken = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                data = None
+            if data:
+                return data
+            # A tty with VMIN=0 reads b'' when idle; only after the loop
+            # reported it readable does that mean the device went away
+            if data == b'' and woken:
+                raise ConnectionError("Serial port closed")
+            await self._wait_fd(self.loop.add_reader, self.loop.remove_reader)
+            woken = True
+    
+    async def write(self, data):
+        """Write all of 'data', waiting for the port to drain as needed"""
+        if self.fd is None:
+            await self.loop.run_in_executor(None, self._write_blocking, data)
+            return
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                written = 0
+            view = view[written:]
+            if view:
+                await self._wait_fd(self.loop.add_writer, self.loop.remove_writer)
+
+    def _write_blocking(self, data):
+        view = memoryview(data)
+        while view:
+            written = self.ser.write(view)
+            view = view[written or 0:]
+        self.ser.flush()
+
+async def run_protocol(protocol, stream, on_event=None):
+    """
+    Drive one protocol machine over a stream until it finishes.
+    
+    Returns:
+        bool: True if the protocol completed successfully
+    """
+    loop = asyncio.get_running_loop()
+    protocol.start(loop.time())
+    reader = None
+    try:
+        while True:
+            out = protocol.data_to_send()
+            if out:
+                await stream.write(out)
+            if on_event:
+                for event in protocol.events():
+                    on_event(event)
+            if protocol.finished:
+                return protocol.succeeded
+            
+            if reader is None:
+                reader = asyncio.ensure_future(stream.read())
+            timeout = None if protocol.deadline is None else max(0.0, protocol.deadline - loop.time())
+            done, _ = await asyncio.wait({reader}, timeout=timeout)
+            if done:
+                data = reader.result()
+                reader = None
+                protocol.receive_data(data, loop.time())
+            else:
+                protocol.handle_timeout(loop.time())
+    finally:
+        if reader is not None:
+            reader.cancel()
+
+async def flash_port(protocol, port, baudrate, on_event=None, **serial_kwargs):
+    """Open 'port', run 'protocol' over it and return a result dict"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    result = {'port': port, 'ok': False, 'seconds': 0.0, 'error': None}
+    try:
+        with serial.Serial(port, baudrate, timeout=0, write_timeout=0, **serial_kwargs) as ser:
+            ser.reset_input_buffer()
+            ser.reset_output_buffer()
+            stream = SerialStream(ser, loop)
+            result['ok'] = await run_protocol(protocol, stream, on_event)
+            result['error'] = protocol.error
+    except (serial.SerialException, OSError) as e:
+        result['error'] = f"Serial port error: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+async def flash_many(make_protocol, ports, baudrate, **serial_kwargs):
+    """Run one protocol per port concurrently on the current event loop"""
+    def printer(port):
+        def on_event(event):
+            if event[0] in ('connected', 'failed', 'complete'):
+                print(f"{port}: {' '.join(str(e) for e in event)}", flush=True)
+        return on_event
+    
+    tasks = [flash_port(make_protocol(), port, baudrate, printer(port), **serial_kwargs) for port in ports]
+    return await asyncio.gather(*tasks)
+
+def main():
+    parser = argparse.ArgumentParser(description='Flash firmware or fonts to many radios from one event loop')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_fw = sub.add_parser('firmware', help='Upload a firmware image (radios in update mode)')
+    p_fw.add_argument('--flash', required=True, help='Path to firmware file')
+    p_fw.add_argument('--window', type=int, default=1, help='Blocks sent ahead of their ACKs (default: 1)')
+    p_font = sub.add_parser('font', help='Upload font data (radios in normal mode)')
+    p_font.add_argument('--font', required=True, help='Font text file')
+    for p in (p_fw, p_font):
+        p.add_argument('--port', required=True, nargs='+', help='Serial ports')
+        p.add_argument('--baud', type=int, default=115200, help='Baudrate (default: 115200)')
+    args = parser.parse_args()
+    
+    if args.command == 'firmware':
+        import fw_updater
+        image = fw_updater.validate_firmware_file(args.flash, prompt='no').data
+        make_protocol = lambda: FirmwareProtocol(image, window=args.window)
+        serial_kwargs = {}
+    else:
+        import font_updater
+        font_buffer = bytes(font_updater.parse_font_file(args.font))
+        make_protocol = lambda: FontProtocol(font_buffer)
+        serial_kwargs = {'dsrdtr': True, 'rtscts': True}
+    
+    results = asyncio.run(flash_many(make_protocol, args.port, args.baud, **serial_kwargs))
+    for r in results:
+        status = 'OK' if r['ok'] else f"FAILED: {r['error']}"
+        print(f"{r['port']:<24} {r['seconds']:7.2f}s  {status}")
+    sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+if __name__ == '__main__':
+    main()
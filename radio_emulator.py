@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+Software radio for exercising the updaters without hardware.
+
+The emulator sits on the master side of a pseudo-terminal and speaks the
+protocols implemented by fw_updater.py (DOWNLOAD handshake, F-ERASE, PROGRAM1,
+addressed 1 KB blocks, END + checksum) and font_updater.py (handshake frames,
+'Font' command, 4 KB blocks acknowledged with 'A'). The slave side is a normal
+serial device path that the updaters open with pyserial. ReplayRadio answers
+like the radio in a trace saved with the updaters' --trace option.
+
+    python radio_emulator.py --mode firmware --hardware 2
+    python fw_updater.py --port /dev/pts/N --flash firmware/BF_5RH_501_v2_0_9.dat --skip-port-check
+    python radio_emulator.py --replay failed.bftrace --speed 10
+"""
+
+import argparse
+import os
+import select
+import sys
+import termios
+import threading
+import time
+import tty
+
+from serial_trace import READ, WRITE, load_trace
+
+EXPECTED_FLASH_SIZE = 524288
+FW_BLOCK_SIZE = 1024
+FONT_BLOCK_SIZE = 4096
+FONT_DATA_SIZE = 458752
+
+# termios speed constant -> bit/s, for reading the rate the host set on the pty
+TERMIOS_RATES = {getattr(termios, f"B{rate}"): rate
+                 for rate in (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600)
+                 if hasattr(termios, f"B{rate}")}
+
+ACK = b'A'
+NACK = b'N'
+
+class EmulatorStopped(Exception):
+    """Raised inside the emulator thread when it is asked to stop"""
+
+class RadioEmulator:
+    """
+    Fake radio served on a pty.
+    
+    Args:
+        mode: 'firmware' (bootloader) or 'font' (normal mode)
+        hardware: 2 answers DOWNLOAD with V2_00_00, 1 with #UPDATE?
+        data_end: Firmware size from the image header (0x40). Lets the radio
+            size the final short block; without it a short block is detected
+            when the line goes idle for 'idle_timeout'.
+        ack_latency: Seconds between a complete frame and its reply
+        baud: Line rate to pace replies at (None: no pacing, 'host': the
+            rate the host has set on the port)
+        erase_time: Seconds F-ERASE takes before it is acknowledged
+        idle_timeout: Gap that ends a short firmware block when data_end is unknown
+        boot_time: Seconds after start() during which everything the host
+            sends is lost, as while the radio is still powering up
+        rates: Line rates the radio understands (None: any). Bytes sent at
+            other rates are lost, as they would be to framing errors.
+        glitch_after: NACK every firmware block after this many in the first
+            host session, as a cable fault would, to exercise --resume
+    """
+    
+    def __init__(self, mode='firmware', hardware=2, data_end=None, ack_latency=0.0,
+                 baud=None, erase_time=0.0, idle_timeout=0.05, boot_time=0.0, rates=None,
+                 glitch_after=None):
+        if mode not in ('firmware', 'font'):
+            raise ValueError(f"Unknown emulator mode '{mode}'")
+        self.mode = mode
+        self.hardware = hardware
+        self.data_end = data_end
+        self.ack_latency = ack_latency
+        self.baud = baud
+        self.erase_time = erase_time
+        self.idle_timeout = idle_timeout
+        self.boot_time = boot_time
+        self.rates = set(rates) if rates else None
+        self.glitch_after = glitch_after
+        self._booted_at = 0.0
+        
+        self.master_fd = None
+        self.slave_fd = None
+        self.port = None
+        self._buf = bytearray()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset_stats()
+    
+    def reset_stats(self):
+        """Clear everything recorded about the last session"""
+        self.flash = bytearray(b'\xFF' * EXPECTED_FLASH_SIZE)
+        self.blocks = 0
+        self.bytes_received = 0
+        self.first_rx = None  # time.monotonic() of the first byte from the host
+        self.check_sum = 0
+        self._written = {}
+        self.erased = False
+        self.sessions = 0
+        self.glitches = 0
+        self.checksum_ok = None
+        self.completed = False
+        self.error = None
+        self.log = []
+    
+    # --- Lifecycle ---
+    def start(self):
+        """Create the pty, start serving and return the device path"""
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self._stop.clear()
+        self._booted_at = time.monotonic() + self.boot_time
+        self._thread = threading.Thread(target=self._run, name=f"radio-{self.mode}", daemon=True)
+        self._thread.start()
+        return self.port
+    
+    def stop(self):
+        """Stop serving and close the pty"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master_fd = self.slave_fd = None
+    
+    def wait(self, timeout=None):
+        """Wait for the session to finish; True if it ran to completion"""
+        if self._thread:
+            self._thread.join(timeout)
+        return self.completed
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.stop()
+    
+    # --- Wire helpers ---
+    def host_rate(self):
+        """Line rate the host has set on the pty, in bit/s (None if unknown)"""
+        try:
+            return TERMIOS_RATES.get(termios.tcgetattr(self.master_fd)[5])
+        except (termios.error, TypeError):
+            return None
+    
+    def _fill(self, timeout=None):
+        """Read whatever the host has sent; False if nothing arrived in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stop.is_set():
+            wait = 0.05 if deadline is None else min(0.05, deadline - time.monotonic())
+            if wait <= 0:
+                return False
+            ready, _, _ = select.select([self.master_fd], [], [], wait)
+            if ready:
+                try:
+                    chunk = os.read(self.master_fd, 65536)
+                except OSError:
+                    raise EmulatorStopped()
+                self.bytes_received += len(chunk)
+                if self.first_rx is None:
+                    self.first_rx = time.monotonic()
+                if time.monotonic() < self._booted_at:
+                    continue
+                if self.rates and self.host_rate() not in self.rates:
+                    continue
+                self._buf += chunk
+                return True
+        raise EmulatorStopped()
+    
+    def _need(self, n):
+        """Block until 'n' bytes are buffered and return them"""
+        while len(self._buf) < n:
+            self._fill()
+        return self._take(n)
+    
+    def _take(self, n):
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+    
+    def _peek(self):
+        while not self._buf:
+            self._fill()
+        return self._buf[0]
+    
+    def _reply(self, data, frame_len=0, delay=0.0):
+        """Send 'data' once the frame has had time to cross the line"""
+        ready = time.monotonic() + delay + self.ack_latency
+        baud = self.host_rate() if self.baud == 'host' else self.baud
+        if baud:
+            ready += (frame_len + len(data)) * 10 / baud
+        remaining = ready - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        os.write(self.master_fd, data)
+    
+    def _expect(self, expected, name):
+        data = self._need(len(expected))
+        if data != expected:
+            raise ValueError(f"Expected {name} {expected!r}, got {data!r}")
+        self.log.append(name)
+        return data
+    
+    # --- Protocols ---
+    def _run(self):
+        try:
+            if self.mode == 'firmware':
+                self._serve_firmware()
+            else:
+                self._serve_font()
+        except EmulatorStopped:
+            pass
+        except Exception as e:
+            self.error = str(e)
+    
+    def _serve_firmware(self):
+        # The bootloader stays up between host sessions: after a failed or
+        # abandoned session it waits for the next DOWNLOAD with flash, erase
+        # state and checksum intact, which is what lets a host resume.
+        while True:
+            if self._firmware_session():
+                return
+    
+    def _firmware_session(self):
+        """Serve one host session; True once END is acknowledged"""
+        # DOWNLOAD, repeated while the host probes for the bootloader.
+        # Anything else before it (the tail of an abandoned session) is dropped.
+        while not self._buf.startswith(b'DOWNLOAD'):
+            if len(self._buf) >= 8:
+                del self._buf[0]
+            else:
+                self._fill()
+        self._expect(b'DOWNLOAD', 'DOWNLOAD')
+        while self._buf.startswith(b'DOWNLOAD'):
+            self._take(8)
+        self.sessions += 1
+        reply = b'V2_00_00' if self.hardware == 2 else b'#UPDATE?'
+        self._reply(reply, 8)
+        # Probes that crossed the reply on the line are answered again
+        while self._peek() == ord('D'):
+            self._expect(b'DOWNLOAD', 'DOWNLOAD')
+            self._reply(reply, 8)
+        
+        self._expect(b'A', 'ACK')
+        self._reply(ACK, 1)
+        
+        if self._peek() == ord('F'):
+            erase = self._need(16)
+            if not erase.startswith(b'F-ERASE'):
+                raise ValueError(f"Expected F-ERASE, got {erase!r}")
+            self.log.append('F-ERASE')
+            self.flash[:] = b'\xFF' * EXPECTED_FLASH_SIZE
+            self.check_sum = 0
+            self._written = {}
+            self.erased = True
+            self._reply(ACK, 16, self.erase_time)
+        
+        self._expect(b'PROGRAM1', 'PROGRAM1')
+        if not self.erased:
+            # Nothing erased since power-on: programming can't continue
+            self._reply(NACK, 8)
+            return False
+        self._reply(ACK, 8)
+        
+        session_blocks = 0
+        while True:
+            header = self._need(5)
+            if header == b'DOWNL':
+                # The host gave up on this session and is starting another
+                self._buf[:0] = header
+                return False
+            if header[:3] == b'END':
+                check_sum = int.from_bytes(self._need(4), 'big')
+                self.checksum_ok = check_sum == (self.check_sum & 0xFFFFFFFF)
+                self.log.append('END')
+                self._reply(ACK if self.checksum_ok else NACK, 9)
+                self.completed = self.checksum_ok
+                return self.checksum_ok
+            
+            addr = int.from_bytes(header[:4], 'big')
+            length = FW_BLOCK_SIZE - addr % FW_BLOCK_SIZE
+            if self.data_end is not None:
+                length = min(length, self.data_end - addr)
+                block = self._need(length)
+            else:
+                # Final short block: take what arrives before the line goes idle
+                while len(self._buf) < length and self._fill(self.idle_timeout):
+                    pass
+                block = self._take(min(length, len(self._buf)))
+            if addr + len(block) > EXPECTED_FLASH_SIZE:
+                raise ValueError(f"Block at {addr:#x} overruns flash")
+            
+            if self.glitch_after is not None and self.sessions == 1 and session_blocks >= self.glitch_after:
+                # Simulated line fault: every later block of the first session is lost
+                self.glitches += 1
+                self._reply(NACK, 5 + len(block))
+                continue
+            
+            self.flash[addr:addr+len(block)] = block
+            # A block sent again (e.g. on resume) replaces its earlier contribution
+            block_sum = sum(block)
+            self.check_sum += block_sum - self._written.get(addr, 0)
+            self._written[addr] = block_sum
+            self.blocks += 1
+            session_blocks += 1
+            self._reply(ACK, 5 + len(block))
+    
+    def _serve_font(self):
+        # Handshake frames (12x 0x00 + 4x 0xFF) until the 'Font' command
+        while self._peek() != ord('F'):
+            self._need(16)
+            self.log.append('handshake')
+            self._reply(ACK, 16)
+        self._expect(b'Font\xFF\xFF\xFF\xFF', 'Font')
+        self._reply(ACK, 8)
+        
+        addr = 0
+        while True:
+            block = self._need(FONT_BLOCK_SIZE)
+            if block[:3] == b'END' and addr >= FONT_DATA_SIZE:
+                self.log.append('END')
+                self._reply(ACK, FONT_BLOCK_SIZE)
+                self.completed = True
+                return
+            if addr + FONT_BLOCK_SIZE <= len(self.flash):
+                self.flash[addr:addr+FONT_BLOCK_SIZE] = block
+            addr += FONT_BLOCK_SIZE
+            self.blocks += 1
+            self._reply(ACK, FONT_BLOCK_SIZE)
+
+class ReplayRadio(RadioEmulator):
+    """
+    Fake radio that answers like the radio in a recorded trace.
+    
+    Before each group of radio bytes the replay waits until the host has
+    sent at least as many bytes as the recorded host did, ending with the
+    last host write that preceded them in the trace. It then sends each read
+    after its original delay from that write divided by 'speed' (0: no
+    delays). Extra probes and other host-side differences are tolerated;
+    'divergences' counts exchanges where the host sent a different number
+    of bytes than in the recording.
+    """
+    
+    def __init__(self, path, speed=1.0, **kwargs):
+        super().__init__('firmware', **kwargs)
+        self.meta, self.records = load_trace(path)
+        self.speed = speed
+        self.divergences = 0
+        self.exchanges = 0
+    
+    def _exchanges(self):
+        """Yield (host bytes, last host write, its time, [(ns, reply), ...])"""
+        sent = bytearray()
+        last_write, last_ns = b'', 0
+        replies = []
+        for kind, ns, data in self.records:
+            if kind == WRITE:
+                if replies:
+                    yield bytes(sent), last_write, last_ns, replies
+                    sent, replies = bytearray(), []
+                sent += data
+                last_write, last_ns = data, ns
+            elif kind == READ and data:
+                replies.append((ns, data))
+        if replies or sent:
+            yield bytes(sent), last_write, last_ns, replies
+    
+    def _run(self):
+        try:
+            for sent, last_write, last_ns, replies in self._exchanges():
+                while len(self._buf) < len(sent) or not self._buf.endswith(last_write):
+                    self._fill()
+                anchor = time.monotonic()
+                self.exchanges += 1
+                if len(self._buf) != len(sent):
+                    self.divergences += 1
+                    self.log.append(f"exchange {self.exchanges}: host sent {len(self._buf)} bytes, "
+                                    f"recorded {len(sent)}")
+                self._buf.clear()
+                for ns, data in replies:
+                    if self.speed:
+                        remaining = anchor + (ns - last_ns) / 1e9 / self.speed - time.monotonic()
+                        if remaining > 0:
+                            time.sleep(remaining)
+                    os.write(self.master_fd, data)
+            self.completed = True
+        except EmulatorStopped:
+            pass
+        except Exception as e:
+            self.error = str(e)
+
+def emulator_for_image(path, **kwargs):
+    """Build a firmware-mode emulator that matches the hardware type of an image"""
+    with open(path, 'rb') as f:
+        header = f.read(0x50)
+    hardware = 2 if header[0x31] == ord('2') else 1
+    data_end = int.from_bytes(header[0x40:0x44], 'big')
+    return RadioEmulator('firmware', hardware=hardware, data_end=data_end, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Baofeng radio on a pseudo-terminal')
+    parser.add_argument('--mode', choices=['firmware', 'font'], default='firmware', help='Protocol to speak')
+    parser.add_argument('--hardware', type=int, choices=[1, 2], default=2, help='Firmware handshake variant')
+    parser.add_argument('--image', help='Firmware image to take the hardware type and size from')
+    parser.add_argument('--ack-latency-ms', type=float, default=0.0, help='Delay before each reply')
+    parser.add_argument('--baud', type=lambda v: v if v == 'host' else int(v),
+                        help="Pace replies as if the line ran at this rate ('host': the rate the host set)")
+    parser.add_argument('--rates', type=lambda v: [int(r) for r in v.split(',')],
+                        help='Comma-separated line rates the radio understands (default: any)')
+    parser.add_argument('--erase-time', type=float, default=0.0, help='Seconds F-ERASE takes')
+    parser.add_argument('--boot-time', type=float, default=0.0, help='Seconds before the radio listens')
+    parser.add_argument('--glitch-after', type=int,
+                        help='NACK every firmware block after this many in the first session')
+    parser.add_argument('--replay', metavar='TRACE', help='Answer like the radio in a saved serial trace')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='With --replay: 10 = ten times faster than recorded, 0 = no delays')
+    args = parser.parse_args()
+    
+    options = dict(ack_latency=args.ack_latency_ms / 1000, baud=args.baud, erase_time=args.erase_time,
+                   boot_time=args.boot_time, rates=args.rates, glitch_after=args.glitch_after)
+    if args.replay:
+        radio = ReplayRadio(args.replay, speed=args.speed)
+    elif args.image:
+        radio = emulator_for_image(args.image, **options)
+    else:
+        radio = RadioEmulator(args.mode, hardware=args.hardware, **options)
+    
+    with radio:
+        what = f"replay of {args.replay}" if args.replay else radio.mode
+        print(f"Emulated radio ({what}) on {radio.port}", flush=True)
+        try:
+            while not radio.wait(0.5):
+                if radio.error or not radio._thread.is_alive():
+                    break
+        except KeyboardInterrupt:
+            pass
+    if args.replay:
+        for line in radio.log:
+            print(line)
+        print(f"{radio.exchanges} exchanges replayed, {radio.divergences} diverged from the recording")
+    if radio.error:
+        print(f"Session failed: {radio.error}")
+        sys.exit(1)
+    print(f"Session {'completed' if radio.completed else 'stopped'}: {radio.blocks} blocks, "
+          f"{radio.bytes_received} bytes received")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Fast connect for the firmware and font updaters.
+
+A session opens by repeating a probe until the radio answers: DOWNLOAD for
+the bootloader (answered with V2_00_00 or #UPDATE?) and the 16-byte
+handshake frame in normal mode (answered with a single byte). connect()
+probes quickly while the radio is still booting, backs off once it has
+stayed quiet for a while, and returns as soon as the first byte of a known
+reply arrives, together with the number of probes and the time to connect.
+
+    result = connect(ser, b"DOWNLOAD", {ord('V'): b"V2_00_00", ord('#'): b"#UPDATE?"})
+    print(f"{result.response!r} after {result.probes} probes in {result.seconds:.3f}s")
+
+negotiate_baud() runs the same handshake at a list of candidate line rates,
+highest first, and settles on the first one that gets a clean reply, falling
+back to 115200. BaudMemory keeps the outcome per adapter and radio model in
+a JSON file so the next session starts at the rate that worked.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from serial_port import serial_errors
+
+FAST_INTERVAL = 0.05  # Wait after each probe while the radio may be booting
+FAST_PERIOD = 2.0  # How long to probe at FAST_INTERVAL before backing off
+MAX_INTERVAL = 1.0
+BACKOFF = 1.5
+MIN_QUIET = 0.02  # Shortest idle gap that ends the post-connect drain
+MAX_DRAIN = 1.0
+READ_ERROR_LIMIT = 5  # Spurious-wakeup errors in a row before a read gives up
+READ_ERROR_BACKOFF = 0.01  # Seconds, times the errors so far
+
+# 'latency' runs from the last probe to the end of the reply
+ConnectResult = namedtuple('ConnectResult', 'response probes seconds latency')
+
+class ConnectTimeout(TimeoutError):
+    """The radio never answered; carries the probe count and elapsed time"""
+    def __init__(self, message, probes, seconds):
+        super().__init__(message)
+        self.probes = probes
+        self.seconds = seconds
+
+def probe_intervals(fast_interval=FAST_INTERVAL, fast_period=FAST_PERIOD,
+                    max_interval=MAX_INTERVAL, backoff=BACKOFF):
+    """Yield how long to wait after each probe: fast at first, then growing by 'backoff'"""
+    elapsed = 0.0
+    interval = fast_interval
+    while True:
+        yield interval
+        elapsed += interval
+        if elapsed >= fast_period:
+            interval = min(interval * backoff, max_interval)
+
+def read_until(ser, length, deadline):
+    """
+    Read up to 'length' bytes, returning early only at 'deadline'.
+    
+    Each read blocks in the driver with the port timeout capped to the time
+    left, so it wakes on the first byte rather than on a poll tick. This is
+    the one timeout-capped reader the updaters share. pyserial errors (its
+    "readiness to read but returned no data" wakeups on a flaky adapter)
+    are retried after a growing back-off, up to READ_ERROR_LIMIT in a row,
+    and the last one is raised after that (an unplugged adapter keeps
+    reporting it). Other errors are raised at once.
+    """
+    buf = bytearray()
+    port_timeout = ser.timeout
+    errors = 0
+    try:
+        while len(buf) < length:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if ser.timeout is None or ser.timeout > remaining:
+                ser.timeout = remaining
+            try:
+                buf += ser.read(length - len(buf))
+            except serial_errors():
+                errors += 1
+                if errors >= READ_ERROR_LIMIT:
+                    raise
+                time.sleep(min(READ_ERROR_BACKOFF * errors, remaining))
+                continue
+            errors = 0
+    finally:
+        if ser.timeout != port_timeout:
+            ser.timeout = port_timeout
+    return bytes(buf)
+
+def drain(ser, quiet=MIN_QUIET, limit=MAX_DRAIN):
+    """Discard input until the line has been idle for 'quiet' seconds; returns the byte count"""
+    stop = time.monotonic() + limit
+    dropped = 0
+    while time.monotonic() < stop:
+        data = read_until(ser, 4096, min(time.monotonic() + quiet, stop))
+        if not data:
+            break
+        dropped += len(data)
+    return dropped
+
+def connect(ser, probe, responses=None, timeout=10, intervals=None, logger=None):
+    """
+    Send 'probe' until the radio answers and return a ConnectResult.
+    
+    Args:
+        ser: Open serial port
+        probe: Bytes to send on each attempt
+        responses: Maps the first byte of each accepted reply to the full
+            reply; the rest of it is read as soon as that byte arrives.
+            None accepts any single byte.
+        timeout: Seconds to keep probing
+        intervals: Iterable of waits after each probe (default: probe_intervals())
+    
+    Bytes that start no known reply are skipped. Replies to probes still in
+    flight are drained once connected, so the caller starts on a quiet line.
+    Raises ConnectTimeout if nothing answers within 'timeout'.
+    """
+    log = logger or logging
+    start = time.monotonic()
+    deadline = start + timeout
+    probes = 0
+    ser.reset_input_buffer()
+    
+    for interval in (intervals or probe_intervals()):
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        ser.write(probe)
+        sent_at = time.monotonic()
+        probes += 1
+        wait_until = min(now + interval, deadline)
+        
+        while True:
+            first = read_until(ser, 1, wait_until)
+            if not first:
+                break
+            if responses is None:
+                response = first
+                break
+            expected = responses.get(first[0])
+            if expected is None:
+                log.debug(f"Ignoring unexpected byte {first.hex()} while connecting")
+                continue
+            # The rest of the reply follows at line rate; allow at least a second
+            rest = read_until(ser, len(expected) - 1, max(deadline, time.monotonic() + 1.0))
+            response = first + rest
+            break
+        if not first:
+            continue
+        
+        replied_at = time.monotonic()
+        seconds = replied_at - start
+        # Replies to later probes follow the first one about 'interval' apart
+        dropped = drain(ser, max(MIN_QUIET, 2 * interval))
+        if dropped:
+            log.debug(f"Drained {dropped} bytes of replies to earlier probes")
+        log.info(f"Connected after {probes} probe{'s' if probes != 1 else ''} in {seconds * 1000:.0f} ms")
+        return ConnectResult(response, probes, seconds, replied_at - sent_at)
+    
+    seconds = time.monotonic() - start
+    raise ConnectTimeout(f"No response after {probes} probes in {seconds:.1f}s", probes, seconds)
+
+# --- Baud-rate negotiation ---
+CANDIDATE_BAUDS = (921600, 460800, 230400, 115200)
+FALLBACK_BAUD = 115200
+PROBE_TIMEOUT = 0.5  # Per candidate rate; the fallback gets the full connect timeout
+BAUD_CACHE = os.path.join(os.path.expanduser('~'), '.bf5rh_baud.json')
+
+# One line of the negotiation report; 'bytes_per_second' is probe + reply over the round trip
+BaudProbe = namedtuple('BaudProbe', 'baud ok latency bytes_per_second')
+
+def parse_baud(value):
+    """argparse type for --baud: a rate in bit/s or 'auto'"""
+    if str(value).lower() == 'auto':
+        return 'auto'
+    try:
+        rate = int(value)
+    except ValueError:
+        raise ValueError(f"invalid baud rate '{value}' (use a number or 'auto')")
+    if rate <= 0:
+        raise ValueError(f"invalid baud rate '{value}'")
+    return rate
+
+def adapter_id(port):
+    """Stable name for the USB adapter behind 'port' (VID:PID:serial), else the port path"""
+    try:
+        from serial_port import list_ports
+        for info in list_ports():
+            if info.device == port and info.vid is not None:
+                return f"{info.vid:04x}:{info.pid:04x}:{info.serial_number or '-'}"
+    except Exception:
+        pass
+    return port
+
+class BaudMemory:
+    """
+    Negotiated line rates per adapter and radio model, kept in a JSON file.
+    
+    Each entry holds the chosen rate, the probe results per rate and the
+    throughput of the last transfer at each rate. Writes merge with what is
+    on disk so concurrent sessions (fleet mode) don't drop each other's keys.
+    """
+    
+    _lock = threading.Lock()
+    
+    def __init__(self, path=BAUD_CACHE):
+        self.path = path
+    
+    @staticmethod
+    def key(port, model):
+        return f"{adapter_id(port)}/{model}"
+    
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def get(self, key):
+        """The entry for 'key', or an empty dict"""
+        return self._load().get(key, {})
+    
+    def update(self, key, **fields):
+        """Merge 'fields' into the entry for 'key' and save; 'rates' is merged per rate"""
+        with self._lock:
+            data = self._load()
+            entry = data.setdefault(key, {})
+            rates = fields.pop('rates', None)
+            if rates:
+                merged = entry.setdefault('rates', {})
+                for rate, info in rates.items():
+                    merged.setdefault(str(rate), {}).update(info)
+            entry.update(fields)
+            entry['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+    
+    def record_probes(self, key, baud, probes):
+        """Store the negotiated rate and the probe result for each rate tried"""
+        self.update(key, baud=baud, rates={
+            p.baud: {'ok': p.ok, 'handshake_bytes_per_second':
+                     round(p.bytes_per_second, 1) if p.bytes_per_second else None}
+            for p in probes
+        })
+    
+    def record_transfer(self, key, baud, nbytes, seconds):
+        """Store the effective throughput of a completed transfer at 'baud'"""
+        if seconds > 0:
+            self.update(key, rates={baud: {'transfer_bytes_per_second': round(nbytes / seconds, 1)}})
+
+def negotiate_baud(ser, probe, responses, rates=CANDIDATE_BAUDS, preferred=None,
+                   fallback=FALLBACK_BAUD, probe_timeout=PROBE_TIMEOUT, connect_timeout=10,
+                   clean=None, logger=None):
+    """
+    Connect at the highest line rate that gets a clean reply.
+    
+    'preferred' (e.g. the remembered rate) is tried first, then 'rates' from
+    the highest down, each for 'probe_timeout' seconds. 'responses' is passed
+    to connect(); a reply is clean when it is exactly one of 'clean' (default:
+    the values of 'responses'). If no rate gets one, the port goes
+    back to 'fallback' and connect() runs for the full 'connect_timeout' as a
+    normal session would, with its reply left to the caller to check. When
+    'preferred' is the fallback itself (the radio answered at no higher
+    rate last time), the higher rates are skipped and that connect is the
+    only one.
+    
+    Returns:
+        tuple: (ConnectResult, baud, list of BaudProbe)
+    """
+    log = logger or logging
+    if preferred == fallback:
+        order = []
+    else:
+        order = [preferred] if preferred else []
+        order += [rate for rate in sorted(rates, reverse=True) if rate not in order and rate != fallback]
+    clean_replies = set(clean if clean is not None else responses.values())
+    probes = []
+    
+    for rate in order:
+        try:
+            ser.baudrate = rate
+        except (ValueError, OSError) as e:
+            log.info(f"Port cannot run at {rate} baud: {e}")
+            probes.append(BaudProbe(rate, False, None, None))
+            continue
+        try:
+            result = connect(ser, probe, responses, timeout=probe_timeout, logger=log)
+        except ConnectTimeout:
+            log.info(f"No reply at {rate} baud")
+            probes.append(BaudProbe(rate, False, None, None))
+            continue
+        ok = result.response in clean_replies
+        bps = (len(probe) + len(result.response)) / result.latency if result.latency > 0 else None
+        probes.append(BaudProbe(rate, ok, result.latency, bps))
+        if ok:
+            log.info(f"Clean reply at {rate} baud")
+            return result, rate, probes
+        log.info(f"Garbled reply at {rate} baud: {result.response!r}")
+        drain(ser)
+    
+    ser.baudrate = fallback
+    log.info(f"Falling back to {fallback} baud")
+    result = connect(ser, probe, responses, timeout=connect_timeout, logger=log)
+    ok = result.response in clean_replies
+    bps = (len(probe) + len(result.response)) / result.latency if result.latency > 0 else None
+    probes.append(BaudProbe(fallback, ok, result.latency, bps))
+    return result, fallback, probes
+
+def format_baud_report(probes, entry=None):
+    """Table of the rates tried; 'entry' adds last transfer throughput from BaudMemory"""
+    rates = (entry or {}).get('rates', {})
+    lines = [f"{'baud':>8} {'reply':>6} {'rtt':>9} {'handshake B/s':>14} {'transfer B/s':>13}"]
+    for p in probes:
+        rtt = f"{p.latency * 1000:7.2f}ms" if p.latency is not None else '-'
+        hs = f"{p.bytes_per_second:.0f}" if p.bytes_per_second else '-'
+        transfer = rates.get(str(p.baud), {}).get('transfer_bytes_per_second')
+        lines.append(f"{p.baud:>8} {'clean' if p.ok else 'none' if p.latency is None else 'bad':>6} "
+                     f"{rtt:>9} {hs:>14} {transfer if transfer is not None else '-':>13}")
+    return '\n'.join(lines)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+I/O-free state machines for the firmware and font update protocols.
+
+The machines never touch a port or a clock. A driver feeds them received
+bytes with receive_data(), sends whatever data_to_send() returns, and calls
+handle_timeout() once the monotonic time passes 'deadline'. Progress and
+results come out of events(). radio_aio.py drives them from asyncio; tests
+and benchmarks can drive them from plain Python.
+
+    proto = FirmwareProtocol(image)
+    proto.start(now)
+    while not proto.finished:
+        port.write(proto.data_to_send())
+        data = port.read_until(proto.deadline)
+        if data:
+            proto.receive_data(data, now)
+        else:
+            proto.handle_timeout(now)
+"""
+
+from collections import deque, namedtuple
+
+# --- Firmware protocol constants (see fw_updater.py) ---
+CMD_DOWNLOAD = b"DOWNLOAD"
+CMD_UPDATE = b"#UPDATE?"
+CMD_NEW_HARDWARE = b"V2_00_00"
+CMD_PRG = b"PROGRAM1"
+CMD_ERASE = bytes([70, 45, 69, 82, 65, 83, 69, 255]) + bytes([40, 6, 136, 25, 19, 3, 24, 32])
+ACK = b"A"
+
+HEADER_SIZE = 0x50
+FW_BLOCK_SIZE = 1024
+EXPECTED_FLASH_SIZE = 524288
+MAX_FAILED_BLOCKS = 5
+RETRY_DELAY = 0.5
+
+# --- Font protocol constants (see font_updater.py) ---
+FONT_BLOCK_SIZE = 4096
+FONT_DATA_SIZE = 458752
+FONT_HANDSHAKE = b'\x00' * 12 + b'\xFF' * 4
+CMD_FONT = b'Font' + b'\xFF' * 4
+FONT_END_BLOCK = b'END' + b'\xFF' * (FONT_BLOCK_SIZE - 3)
+
+class ProtocolMachine:
+    """
+    Plumbing shared by the protocol machines.
+    
+    Subclasses call _expect() to wait for a fixed-size reply and implement
+    _on_response() and _on_timeout() for the current state.
+    """
+    
+    def __init__(self):
+        self.state = 'idle'
+        self.error = None
+        self.deadline = None
+        self._out = bytearray()
+        self._rx = bytearray()
+        self._want = 0
+        self._events = []
+    
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+    
+    @property
+    def succeeded(self):
+        return self.state == 'done'
+    
+    def data_to_send(self):
+        """Return and clear the bytes waiting to go out"""
+        out = bytes(self._out)
+        self._out.clear()
+        return out
+    
+    def events(self):
+        """Return and clear the events raised since the last call"""
+        events, self._events = self._events, []
+        return events
+    
+    def receive_data(self, data, now):
+        """Feed bytes read from the port"""
+        if self.finished:
+            return
+        self._rx += data
+        while self._want and len(self._rx) >= self._want and not self.finished:
+            reply = bytes(self._rx[:self._want])
+            del self._rx[:self._want]
+            self._want = 0
+            self.deadline = None
+            self._on_response(reply, now)
+    
+    def handle_timeout(self, now):
+        """Call once 'now' has reached 'deadline'"""
+        if self.finished or self.deadline is None or now < self.deadline:
+            return
+        self.deadline = None
+        self._want = 0
+        self._on_timeout(now)
+    
+    # --- Helpers for subclasses ---
+    def _send(self, data):
+        self._out += data
+    
+    def _expect(self, length, timeout, now):
+        self._want = length
+        self.deadline = now + timeout
+        if len(self._rx) >= length:
+            self.receive_data(b'', now)
+    
+    def _wait(self, delay, now):
+        """Arm a timer without expecting a reply"""
+        self._want = 0
+        self.deadline = now + delay
+    
+    def _discard_input(self):
+        """Equivalent of reset_input_buffer() for already received bytes"""
+        self._rx.clear()
+    
+    def _set_state(self, state):
+        self.state = state
+        self._events.append(('state', state))
+    
+    def _fail(self, reason):
+        self.error = reason
+        self.deadline = None
+        self._want = 0
+        self._set_state('failed')
+        self._events.append(('failed', reason))
+    
+    def _finish(self):
+        self.deadline = None
+        self._set_state('done')
+        self._events.append(('complete',))
+    
+    def _on_response(self, reply, now):
+        raise NotImplementedError
+    
+    def _on_timeout(self, now):
+        raise NotImplementedError
+
+class BlockFrame(namedtuple('BlockFrame', 'addr header payload')):
+    """One upload block: 5-byte address header and a memoryview of the image"""
+    __slots__ = ()
+
+class FramePlan(namedtuple('FramePlan', 'blocks data_end check_sum end_frame')):
+    """Everything needed to upload an image, computed once up front"""
+    __slots__ = ()
+
+def payload_checksum(payload):
+    """32-bit sum of the payload bytes, as carried by the END frame"""
+    return sum(payload) & 0xFFFFFFFF
+
+def plan_frames(image, block_size=FW_BLOCK_SIZE):
+    """
+    Parse a firmware image once and describe every upload frame.
+    
+    Block payloads are memoryviews into 'image', so nothing is copied unless
+    the header claims more data than the file holds (the missing tail is then
+    sent as erased flash, 0xFF, like the old 512 KB padding did).
+    
+    Returns:
+        FramePlan: blocks (tuple of BlockFrame), data_end, check_sum and the
+        9-byte END frame carrying the checksum
+    """
+    if len(image) < HEADER_SIZE:
+        raise ValueError(f"Image too short: {len(image)} bytes (expected at least {HEADER_SIZE})")
+    data_end = int.from_bytes(image[0x40:0x44], 'big')
+    if data_end <= 0 or data_end > EXPECTED_FLASH_SIZE:
+        raise ValueError(f"Invalid data end address in header: {data_end:#x}")
+    
+    payload = memoryview(image)[HEADER_SIZE:HEADER_SIZE + data_end]
+    if len(payload) < data_end:
+        payload = memoryview(bytes(payload) + b'\xFF' * (data_end - len(payload)))
+    
+    blocks = []
+    addr = 0
+    while addr < data_end:
+        length = min(block_size - addr % block_size, data_end - addr)
+        header = addr.to_bytes(4, 'big') + b'\x00'
+        blocks.append(BlockFrame(addr, header, payload[addr:addr + length]))
+        addr += length
+    
+    check_sum = payload_checksum(payload)
+    end_frame = b'END\xFF\xFF' + check_sum.to_bytes(4, 'big')
+    return FramePlan(tuple(blocks), data_end, check_sum, end_frame)
+
+class FirmwareProtocol(ProtocolMachine):
+    """
+    Bootloader upload: DOWNLOAD, ACK, F-ERASE, PROGRAM1, blocks, END + checksum.
+    
+    Events:
+        ('state', name), ('connected', reply), ('progress', acked, total),
+        ('block_failed', address), ('complete',), ('failed', reason)
+    """
+    
+    def __init__(self, image, window=1, handshake_timeout=10, ack_timeout=5, end_timeout=15):
+        super().__init__()
+        self.image = image
+        self.window = max(1, window)
+        self.handshake_timeout = handshake_timeout
+        self.ack_timeout = ack_timeout
+        self.end_timeout = end_timeout
+        self.plan = plan_frames(image)
+        self.blocks = self.plan.blocks
+        self.new_hardware = len(image) > 0x31 and image[0x31] == ord('2')
+        
+        self._next = 0
+        self._in_flight = deque()
+        self._failed = []
+        self._acked = 0
+        self._command = None
+        self._retry_pending = False
+    
+    def start(self, now):
+        self._discard_input()
+        self._set_state('handshake')
+        self._send(CMD_DOWNLOAD)
+        self._expect(8, self.handshake_timeout, now)
+    
+    # --- Commands acknowledged with 'A', retried after RETRY_DELAY ---
+    def _send_command(self, state, frame, retries, timeout, now):
+        self._set_state(state)
+        self._command = [frame, retries, timeout]
+        self._send(frame)
+        self._expect(1, timeout, now)
+    
+    def _command_failed(self, reason, now):
+        if self._command[1] <= 0:
+            self._fail(f"{self.state}: {reason}")
+            return
+        self._command[1] -= 1
+        self._retry_pending = True
+        self._wait(RETRY_DELAY, now)
+    
+    # --- Upload ---
+    def _pump(self, now):
+        """Fill the send window, then wait for the oldest ACK or move on"""
+        while self._next < len(self.blocks) and len(self._in_flight) < self.window:
+            frame = self.blocks[self._next]
+            self._send(frame.header)
+            self._send(frame.payload)
+            self._in_flight.append(self._next)
+            self._next += 1
+        
+        if self._in_flight:
+            self._expect(1, self.ack_timeout, now)
+        elif self._failed:
+            self._set_state('retry')
+            self._send_retry(now)
+        else:
+            self._send_command('end', self.plan.end_frame, 2, self.end_timeout, now)
+    
+    def _block_done(self, ok, now):
+        index = self._in_flight.popleft()
+        if not ok:
+            self._failed.append(index)
+            self._events.append(('block_failed', self.blocks[index].addr))
+            if len(self._failed) > MAX_FAILED_BLOCKS:
+                self._fail("Too many block write failures")
+                return
+            self.window = 1
+        self._acked += 1
+        self._events.append(('progress', self._acked, len(self.blocks)))
+        self._pump(now)
+    
+    def _send_retry(self, now):
+        frame = self.blocks[self._failed[0]]
+        self._send(frame.header)
+        self._send(frame.payload)
+        self._expect(1, self.ack_timeout, now)
+    
+    # --- Dispatch ---
+    def _on_response(self, reply, now):
+        state = self.state
+        if state == 'handshake':
+            expected = CMD_NEW_HARDWARE if self.new_hardware else CMD_UPDATE
+            if reply != expected:
+                self._fail(f"Handshake failed: expected {expected!r}, got {reply!r}")
+                return
+            self._events.append(('connected', reply))
+            self._discard_input()
+            self._set_state('ack')
+            self._send(ACK)
+            self._expect(1, self.ack_timeout, now)
+        elif state == 'ack':
+            if reply != ACK:
+                self._fail(f"ACK failed: expected {ACK!r}, got {reply!r}")
+                return
+            self._send_command('erase', CMD_ERASE, 2, self.ack_timeout, now)
+        elif state in ('erase', 'program', 'end'):
+            if reply != ACK:
+                self._command_failed(f"expected {ACK!r}, got {reply!r}", now)
+            elif state == 'erase':
+                self._send_command('program', CMD_PRG, 1, self.ack_timeout, now)
+            elif state == 'program':
+                self._set_state('upload')
+                self._pump(now)
+            else:
+                self._finish()
+        elif state == 'upload':
+            self._block_done(reply == ACK, now)
+        elif state == 'retry':
+            addr = self.blocks[self._failed[0]].addr
+            if reply != ACK:
+                self._fail(f"Retry failed for block at {addr:#x}")
+                return
+            self._failed.pop(0)
+            if self._failed:
+                self._send_retry(now)
+            else:
+                self._send_command('end', self.plan.end_frame, 2, self.end_timeout, now)
+    
+    def _on_timeout(self, now):
+        state = self.state
+        if state in ('erase', 'program', 'end'):
+            if self._retry_pending:
+                # Retry delay is over: send the command again
+                self._retry_pending = False
+                self._send(self._command[0])
+                self._expect(1, self._command[2], now)
+            else:
+                self._command_failed("timeout waiting for ACK", now)
+        elif state == 'upload':
+            self._block_done(False, now)
+        elif state == 'retry':
+            self._fail(f"Timeout on retry for block at {self.blocks[self._failed[0]].addr:#x}")
+        elif state == 'handshake':
+            self._fail("No response from radio. Is the radio in update mode?")
+        else:
+            self._fail(f"Timeout in state {state}")
+
+class FontProtocol(ProtocolMachine):
+    """
+    Normal-mode font upload: handshake frames, 'Font', 4 KB blocks, END block.
+    
+    Events:
+        ('state', name), ('connected', reply), ('progress', acked, total),
+        ('complete',), ('failed', reason)
+    """
+    
+    def __init__(self, font_buffer, handshake_attempts=25, handshake_timeout=5.2, settle_time=0.2,
+                 ack_timeout=5):
+        super().__init__()
+        if len(font_buffer) < FONT_DATA_SIZE:
+            font_buffer = bytes(font_buffer) + b'\xFF' * (FONT_DATA_SIZE - len(font_buffer))
+        self.font = memoryview(font_buffer)[:FONT_DATA_SIZE]
+        self.handshake_attempts = handshake_attempts
+        self.handshake_timeout = handshake_timeout
+        self.settle_time = settle_time
+        self.ack_timeout = ack_timeout
+        self.total_blocks = (FONT_DATA_SIZE + FONT_BLOCK_SIZE - 1) // FONT_BLOCK_SIZE
+        self._attempt = 0
+        self._block = 0
+    
+    def start(self, now):
+        self._set_state('handshake')
+        self._send_handshake(now)
+    
+    def _send_handshake(self, now):
+        self._attempt += 1
+        self._send(FONT_HANDSHAKE)
+        self._expect(1, self.handshake_timeout, now)
+    
+    def _send_block(self, now):
+        start = self._block * FONT_BLOCK_SIZE
+        self._send(self.font[start:start + FONT_BLOCK_SIZE])
+        self._expect(1, self.ack_timeout, now)
+    
+    def receive_data(self, data, now):
+        if self.state == 'settle':
+            return  # Anything arriving now is discarded like reset_input_buffer()
+        super().receive_data(data, now)
+    
+    def _on_response(self, reply, now):
+        state = self.state
+        if state == 'handshake':
+            self._events.append(('connected', reply))
+            self._set_state('settle')
+            self._wait(self.settle_time, now)
+        elif state == 'font':
+            self._discard_input()
+            self._set_state('data')
+            self._send_block(now)
+        elif state == 'data':
+            if reply != ACK:
+                self._fail(f"ACK not received after data block at address "
+                           f"{self._block * FONT_BLOCK_SIZE}. Got: {reply.hex()}")
+                return
+            self._block += 1
+            self._events.append(('progress', self._block, self.total_blocks))
+            if self._block < self.total_blocks:
+                self._send_block(now)
+            else:
+                self._set_state('end')
+                self._send(FONT_END_BLOCK)
+                self._expect(1, self.ack_timeout, now)
+        elif state == 'end':
+            if reply != ACK:
+                self._fail(f"ACK not received after END block. Got: {reply.hex()}")
+                return
+            self._finish()
+    
+    def _on_timeout(self, now):
+        state = self.state
+        if state == 'handshake':
+            if self._attempt >= self.handshake_attempts:
+                self._fail("Handshake failed - no response from radio")
+            else:
+                self._send_handshake(now)
+        elif state == 'settle':
+            self._discard_input()
+            self._set_state('font')
+            self._send(CMD_FONT)
+            self._expect(1, self.ack_timeout, now)
+        elif state == 'font':
+            self._fail("No response after 'Font' command")
+        elif state == 'data':
+            self._fail(f"Timeout waiting for ACK at address {self._block * FONT_BLOCK_SIZE}")
+        else:
+            self._fail("Timeout waiting for final ACK")
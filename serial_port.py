@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Serial port helpers shared by fw_updater.py and font_updater.py.
+
+pyserial is imported the first time a port is opened or listed, so the
+offline commands (decrypt, encrypt, validate) and --help never pay for it.
+Code that catches pyserial errors uses serial_errors(), which is empty
+until pyserial has been loaded: before that no port can have raised one.
+
+    with safe_serial('/dev/ttyUSB0', 115200, timeout=1) as ser:
+        try:
+            ser.write(frame)
+        except serial_errors() as e:
+            ...
+"""
+
+import logging
+import re
+import sys
+from contextlib import contextmanager
+
+ADAPTER_KEYWORDS = ['CH340', 'CP210', 'FTDI', 'USB Serial', 'USB-Serial']
+
+def port_tag(port):
+    """Turn a port name into something usable in logger and file names"""
+    name = port[5:] if port.startswith('/dev/') else port
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'port'
+
+def pyserial():
+    """The serial module, imported on first use"""
+    import serial
+    return serial
+
+def serial_errors():
+    """Exception types pyserial raises, as a tuple for 'except' clauses"""
+    serial = sys.modules.get('serial')
+    return (serial.SerialException,) if serial is not None else ()
+
+def list_ports():
+    """Serial ports on this machine (pyserial ListPortInfo objects)"""
+    import serial.tools.list_ports
+    return list(serial.tools.list_ports.comports())
+
+def print_ports():
+    """Print the --list-ports table"""
+    print("Available serial ports:")
+    for port in list_ports():
+        print(f"  {port.device}: {port.description}")
+
+def confirm(question, prompt='ask'):
+    """Ask a y/n question, or answer it without prompting when 'prompt' is 'yes' or 'no'"""
+    if prompt == 'ask':
+        return input(question).lower() == 'y'
+    return prompt == 'yes'
+
+@contextmanager
+def safe_serial(port, baudrate, logger=None, trace=None, **kwargs):
+    """
+    Context manager for safer serial port handling. With 'trace' (a
+    serial_trace.SerialTrace) the port is wrapped to record all traffic.
+    """
+    serial = pyserial()
+    log = logger or logging
+    ser = None
+    try:
+        ser = serial.Serial(port, baudrate, **kwargs)
+        yield trace.wrap(ser) if trace is not None else ser
+    except serial.SerialException as e:
+        if trace is not None:
+            trace.note(f"Serial port error: {e}")
+        raise RuntimeError(f"Serial port error: {e}")
+    finally:
+        if ser and ser.is_open:
+            try:
+                ser.close()
+                log.debug("Serial port closed")
+            except Exception as e:
+                log.warning(f"Error closing serial port: {e}")
+
+def verify_serial_port(port, prompt='ask', logger=None):
+    """Check if the serial port is likely to be a programming adapter"""
+    log = logger or logging
+    try:
+        # Find our port in the system device list
+        port_info = next((p for p in list_ports() if p.device == port), None)
+        if not port_info:
+            log.warning(f"Port {port} not found in system device list")
+            return False
+            
+        # Check for known programming adapter keywords
+        if not any(keyword in port_info.description for keyword in ADAPTER_KEYWORDS):
+            log.warning(f"Port {port} ({port_info.description}) might not be a programming adapter")
+            if not confirm("This doesn't appear to be a programming adapter. Continue? (y/n): ", prompt):
+                return False
+        
+        return True
+    except Exception as e:
+        log.warning(f"Failed to verify serial port: {e}")
+        return True  # Continue anyway on error
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+"""
+Byte-level serial traces and a radio that replays them.
+
+SerialTrace keeps every read and write on a port, with monotonic
+timestamps, in a bounded in-memory ring. Nothing touches the disk until
+dump() is called, which the updaters do when a session fails (or always,
+with --trace-always). radio_emulator.ReplayRadio serves a saved trace on a
+pty as a fake radio, at the original speed or faster.
+
+    python fw_updater.py --port /dev/ttyUSB0 --flash fw.dat --trace failed.bftrace
+    python serial_trace.py failed.bftrace
+    python radio_emulator.py --replay failed.bftrace --speed 10
+
+File format: MAGIC, a '<I' length and that many bytes of JSON metadata,
+then records of RECORD ('<cQI': kind, ns since the first record, length)
+each followed by its data.
+"""
+
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import time
+from collections import deque
+
+MAGIC = b'BFTRACE\x01'
+META = struct.Struct('<I')
+RECORD = struct.Struct('<cQI')
+DEFAULT_CAPACITY = 4 << 20  # bytes of records kept; the oldest are dropped first
+
+# Record kinds
+WRITE = b'W'  # host -> radio
+READ = b'R'  # radio -> host, as returned by read(); empty when the read timed out
+RESET = b'I'  # host discarded its input buffer
+BAUD = b'B'  # host changed the line rate; data is the rate as '<I'
+NOTE = b'N'  # free text, e.g. the error that ended the session
+KIND_NAMES = {WRITE: 'write', READ: 'read', RESET: 'reset', BAUD: 'baud', NOTE: 'note'}
+
+class SerialTrace:
+    """
+    Ring buffer of serial traffic for one session.
+    
+    Args:
+        capacity: Bytes of packed records to keep before dropping the oldest
+        meta: JSON-serialisable dict saved with the trace (tool, port, ...)
+    """
+    
+    def __init__(self, capacity=DEFAULT_CAPACITY, meta=None):
+        self.capacity = capacity
+        self.meta = dict(meta or {})
+        self._records = deque()
+        self._size = 0
+        self.dropped = 0
+        self._origin = time.monotonic_ns()
+    
+    def __len__(self):
+        return len(self._records)
+    
+    def record(self, kind, data=b''):
+        packed = RECORD.pack(kind, time.monotonic_ns() - self._origin, len(data)) + bytes(data)
+        self._records.append(packed)
+        self._size += len(packed)
+        while self._size > self.capacity and len(self._records) > 1:
+            self._size -= len(self._records.popleft())
+            self.dropped += 1
+    
+    def note(self, text):
+        self.record(NOTE, str(text).encode('utf-8', 'replace'))
+    
+    def wrap(self, ser):
+        """A proxy for 'ser' that records into this trace"""
+        return TracingSerial(ser, self)
+    
+    def dump(self, path):
+        """Write the trace to 'path' and return it"""
+        meta = dict(self.meta, dropped=self.dropped,
+                    saved=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        encoded = json.dumps(meta, sort_keys=True).encode('utf-8')
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + META.pack(len(encoded)) + encoded)
+            f.writelines(self._records)
+        os.replace(tmp, path)
+        return path
+
+class TracingSerial:
+    """
+    Pass-through proxy around a pyserial port that records into a SerialTrace.
+    
+    Attribute reads and writes go to the real port. fileno() is hidden so
+    that fast paths which write to the descriptor directly (fw_updater's
+    writev, font_updater's os.write) fall back to write() and get recorded.
+    """
+    
+    def __init__(self, ser, trace):
+        object.__setattr__(self, '_ser', ser)
+        object.__setattr__(self, '_trace', trace)
+    
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+    
+    def __setattr__(self, name, value):
+        if name == 'baudrate':
+            self._trace.record(BAUD, struct.pack('<I', int(value)))
+        setattr(self._ser, name, value)
+    
+    def fileno(self):
+        raise io.UnsupportedOperation("traced ports are written through write()")
+    
+    def read(self, size=1):
+        data = self._ser.read(size)
+        self._trace.record(READ, data)
+        return data
+    
+    def write(self, data):
+        data = bytes(data)
+        self._trace.record(WRITE, data)
+        return self._ser.write(data)
+    
+    def reset_input_buffer(self):
+        self._trace.record(RESET)
+        return self._ser.reset_input_buffer()
+
+def trace_path_for(path, port_tag):
+    """Per-port trace file name for fleet sessions: name_<tag>.ext"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{port_tag}{ext or '.bftrace'}"
+
+def load_trace(path):
+    """Read a trace file; returns (meta, list of (kind, ns, data))"""
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if not blob.startswith(MAGIC):
+        raise ValueError(f"{path} is not a serial trace")
+    offset = len(MAGIC)
+    (meta_len,) = META.unpack_from(blob, offset)
+    offset += META.size
+    meta = json.loads(blob[offset:offset + meta_len].decode('utf-8'))
+    offset += meta_len
+    records = []
+    while offset < len(blob):
+        kind, ns, length = RECORD.unpack_from(blob, offset)
+        offset += RECORD.size
+        records.append((kind, ns, blob[offset:offset + length]))
+        offset += length
+    return meta, records
+
+def format_trace(meta, records, limit=None):
+    """Human-readable listing: time, gap, kind, length and the first bytes"""
+    lines = [f"{key}: {value}" for key, value in sorted(meta.items())]
+    totals = {}
+    shown = records if limit is None else records[:limit]
+    previous = records[0][1] if records else 0
+    for kind, ns, data in shown:
+        name = KIND_NAMES.get(kind, kind.decode('ascii', 'replace'))
+        if kind == BAUD:
+            detail = str(struct.unpack('<I', data)[0])
+        elif kind == NOTE:
+            detail = data.decode('utf-8', 'replace')
+        else:
+            detail = data[:16].hex(' ') + (' ...' if len(data) > 16 else '')
+        lines.append(f"{ns / 1e6:12.3f}ms {(ns - previous) / 1e6:+10.3f}ms {name:<5} {len(data):>5}  {detail}")
+        previous = ns
+    for kind, _, data in records:
+        count, size = totals.get(kind, (0, 0))
+        totals[kind] = (count + 1, size + len(data))
+    if limit is not None and len(records) > limit:
+        lines.append(f"... {len(records) - limit} more records")
+    lines.append(', '.join(f"{KIND_NAMES.get(k, k)}: {c} records, {s} bytes" for k, (c, s) in totals.items()))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='List the records in a serial trace saved by the updaters')
+    parser.add_argument('trace')
+    parser.add_argument('--limit', type=int, default=200, help='Records to list (default: 200, 0 = all)')
+    args = parser.parse_args()
+    try:
+        meta, records = load_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read trace: {e}")
+        sys.exit(1)
+    print(format_trace(meta, records, args.limit or None))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+flash_station against a temporary by-id directory: fake adapter links are
+created and removed while the station watches, and one firmware job runs
+end to end against radio_emulator.py.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from flash_station import FirmwareJob, FlashStation, InotifyWatcher, PollingWatcher, WatchLost
+from serial_port import port_tag
+from radio_emulator import emulator_for_image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, 'firmware', 'BF_5RH_501_v2_0_9.dat')
+TIMEOUT = 5
+
+def adapter_name(number):
+    return f"usb-1a86_USB_Serial_{number:04d}-if00-port0"
+
+@pytest.fixture
+def by_id(tmp_path):
+    """Empty by-id directory plus a dev directory for the link targets"""
+    (tmp_path / 'by-id').mkdir()
+    (tmp_path / 'dev').mkdir()
+    return tmp_path
+
+def plug(root, number, target=None):
+    """Create the device node and its by-id link; return the node's path"""
+    if target is None:
+        target = root / 'dev' / f'ttyUSB{number}'
+        target.touch()
+    os.symlink(target, root / 'by-id' / adapter_name(number))
+    return os.path.realpath(target)
+
+def unplug(root, number):
+    os.unlink(root / 'by-id' / adapter_name(number))
+
+def wait_until(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class RecordingLog(logging.Handler):
+    """Keeps the station's messages so tests can wait for plug events"""
+    
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+    
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+    
+    def seen(self, text):
+        return any(text in message for message in self.messages)
+
+def station_logger(name):
+    logger = logging.getLogger(f'test_flash_station.{name}')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = RecordingLog()
+    logger.addHandler(handler)
+    return logger, handler
+
+class BlockingJob:
+    """Records every call and holds each job until release()"""
+    
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+        self._release = threading.Event()
+    
+    def __call__(self, port):
+        with self._lock:
+            self.calls.append(port)
+        return self._release.wait(TIMEOUT)
+    
+    def release(self):
+        self._release.set()
+    
+    def count(self, port=None):
+        with self._lock:
+            return len(self.calls) if port is None else self.calls.count(port)
+
+# --- Watchers ---
+@pytest.mark.skipif(not InotifyWatcher.available(), reason="inotify is not available")
+def test_inotify_watcher_reports_plug_and_unplug(by_id):
+    watcher = InotifyWatcher(str(by_id / 'by-id'))
+    try:
+        assert not watcher.wait(0.05)
+        plug(by_id, 0)
+        assert watcher.wait(1)
+        assert not watcher.wait(0.05)
+        unplug(by_id, 0)
+        assert watcher.wait(1)
+        os.rmdir(by_id / 'by-id')
+        with pytest.raises(WatchLost):
+            watcher.wait(1)
+    finally:
+        watcher.close()
+
+def test_polling_watcher_wakes_up_every_interval(by_id):
+    watcher = PollingWatcher(str(by_id / 'by-id'), interval=0.05)
+    start = time.monotonic()
+    assert watcher.wait(1)
+    assert time.monotonic() - start < 0.5
+    start = time.monotonic()
+    assert watcher.wait(0)  # The timeout caps the interval
+    assert time.monotonic() - start < 0.05
+    watcher.close()
+
+# --- Station ---
+@pytest.mark.parametrize('use_inotify', [True, False], ids=['inotify', 'polling'])
+def test_one_job_per_adapter(by_id, use_inotify):
+    if use_inotify and not InotifyWatcher.available():
+        pytest.skip("inotify is not available")
+    job = BlockingJob()
+    logger, log = station_logger(f'one_job_{use_inotify}')
+    station = FlashStation(job, str(by_id / 'by-id'), workers=4, use_inotify=use_inotify, poll_interval=0.02,
+                           logger=logger)
+    runner = threading.Thread(target=station.run, daemon=True)
+    runner.start()
+    try:
+        assert wait_until(lambda: station.watcher_kind is not None)
+        assert station.watcher_kind == ('inotify' if use_inotify else 'polling')
+        
+        first = plug(by_id, 0)
+        second = plug(by_id, 1)
+        (by_id / 'by-id' / 'usb-Some_Keyboard-event-kbd').symlink_to(by_id / 'dev')
+        assert wait_until(lambda: job.count() == 2)
+        assert job.count(first) == 1 and job.count(second) == 1
+        
+        # Unplugged and plugged back while its job still runs: no second job
+        unplug(by_id, 0)
+        assert wait_until(lambda: log.seen(f"{adapter_name(0)}: unplugged"))
+        plug(by_id, 0, first)
+        third = plug(by_id, 2)  # Seen in the same scan as the re-add or a later one
+        assert wait_until(lambda: job.count(third) == 1)
+        assert job.count(first) == 1
+        assert job.count() == 3
+        
+        # Once its job has finished, plugging in again starts a new one
+        job.release()
+        assert wait_until(lambda: len(station.results) == 3)
+        unplug(by_id, 0)
+        assert wait_until(lambda: log.messages.count(f"{adapter_name(0)}: unplugged") == 2)
+        plug(by_id, 0, first)
+        assert wait_until(lambda: job.count(first) == 2)
+        assert job.count() == 4
+    finally:
+        job.release()
+        station.stop()
+        runner.join(TIMEOUT)
+    assert not runner.is_alive()
+    assert all(result['ok'] for result in station.results)
+
+def test_inotify_failure_falls_back_to_polling_once(by_id, monkeypatch):
+    def no_watches(self, directory):
+        raise OSError(28, f"Cannot watch {directory}: No space left on device")
+    monkeypatch.setattr(InotifyWatcher, 'available', classmethod(lambda cls: True))
+    monkeypatch.setattr(InotifyWatcher, '__init__', no_watches)
+    job = BlockingJob()
+    job.release()
+    logger, log = station_logger('inotify_failure')
+    station = FlashStation(job, str(by_id / 'by-id'), poll_interval=0.01, logger=logger)
+    runner = threading.Thread(target=station.run, kwargs={'max_jobs': 1}, daemon=True)
+    runner.start()
+    try:
+        assert wait_until(lambda: station.watcher_kind == 'polling')
+        time.sleep(0.3)  # Dozens of polling passes
+        new = plug(by_id, 0)
+        runner.join(TIMEOUT)
+    finally:
+        station.stop()
+        runner.join(TIMEOUT)
+    assert job.calls == [new]
+    assert sum('polling instead' in message for message in log.messages) == 1
+
+def test_existing_adapters_are_ignored_by_default(by_id):
+    plug(by_id, 0)
+    job = BlockingJob()
+    job.release()
+    logger, log = station_logger('existing')
+    station = FlashStation(job, str(by_id / 'by-id'), use_inotify=False, poll_interval=0.02, logger=logger)
+    runner = threading.Thread(target=station.run, kwargs={'max_jobs': 1}, daemon=True)
+    runner.start()
+    try:
+        assert wait_until(lambda: log.seen("Ignoring 1 adapter(s)"))
+        new = plug(by_id, 1)
+        runner.join(TIMEOUT)
+    finally:
+        station.stop()
+        runner.join(TIMEOUT)
+    assert job.calls == [new]
+
+# --- End to end ---
+def test_firmware_job_against_emulator(by_id, capsys):
+    job = FirmwareJob(IMAGE, connect_timeout=TIMEOUT, baud_cache=str(by_id / 'baud.json'), log_dir=str(by_id))
+    logger, _ = station_logger('firmware')
+    station = FlashStation(job, str(by_id / 'by-id'), workers=1, logger=logger)
+    with emulator_for_image(IMAGE) as radio:
+        runner = threading.Thread(target=station.run, kwargs={'max_jobs': 1}, daemon=True)
+        runner.start()
+        assert wait_until(lambda: station.watcher_kind is not None)
+        plug(by_id, 0, radio.port)
+        runner.join(60)
+        assert not runner.is_alive()
+        assert radio.wait(TIMEOUT)
+    
+    [result] = station.results
+    assert result['ok'], result['error']
+    assert result['port'] == os.path.realpath(radio.port)
+    with open(IMAGE, 'rb') as f:
+        payload = f.read()[0x50:]
+    assert radio.flash[:len(payload)] == payload
+    assert os.path.exists(by_id / f"fw_update_{port_tag(radio.port)}.log")
+    assert capsys.readouterr().out == ''  # quiet: nothing on the console
@@ -0,0 +1,366 @@
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+radio_protocol's state machines against a scripted radio on a fake clock:
+every frame the machine sends is answered (or ignored) by the script, and
+silence advances the clock to the machine's deadline. plan_frames is checked
+against the block loop fw_updater used before the framing moved here.
+"""
+
+import glob
+import os
+
+import pytest
+
+from radio_protocol import (ACK, CMD_DOWNLOAD, CMD_ERASE, CMD_FONT, CMD_NEW_HARDWARE, CMD_PRG, CMD_UPDATE,
+                            FONT_BLOCK_SIZE, FONT_DATA_SIZE, FONT_END_BLOCK, FONT_HANDSHAKE, FW_BLOCK_SIZE,
+                            HEADER_SIZE, MAX_FAILED_BLOCKS, RETRY_DELAY, FirmwareProtocol, FontProtocol,
+                            plan_frames)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = sorted(glob.glob(os.path.join(ROOT, 'firmware', '*.dat')))
+NACK = b'N'
+
+def make_image(data_end, payload_size=None, hardware=2):
+    """Header claiming 'data_end' bytes, followed by 'payload_size' bytes of data"""
+    header = bytearray(HEADER_SIZE)
+    header[0x31] = ord(str(hardware))
+    header[0x40:0x44] = data_end.to_bytes(4, 'big')
+    size = data_end if payload_size is None else payload_size
+    return bytes(header) + bytes((i * 7 + 3) & 0xFF for i in range(size))
+
+def drive(proto, radio, limit=100000):
+    """Run 'proto' to completion against 'radio'; returns the fake clock"""
+    now = 0.0
+    proto.start(now)
+    for _ in range(limit):
+        if proto.finished:
+            return now
+        out = proto.data_to_send()
+        reply = radio.receive(out) if out else b''
+        if reply:
+            proto.receive_data(reply, now)
+        else:
+            assert proto.deadline is not None, f"machine stalled in state {proto.state}"
+            now = proto.deadline
+            proto.handle_timeout(now)
+    raise AssertionError("protocol did not finish")
+
+class FirmwareRadio:
+    """
+    Bootloader that answers each command and block with the next scripted
+    reply for it (ACK once the script runs out; None means silence).
+    """
+    
+    def __init__(self, hardware=2, commands=None, blocks=None):
+        self.hardware = hardware
+        self.commands = {name: list(replies) for name, replies in (commands or {}).items()}
+        self.blocks = {addr: list(replies) for addr, replies in (blocks or {}).items()}
+        self.received = {}  # Block address -> payload of the last copy received
+        self.sent_commands = []
+        self.batches = []  # Block addresses carried by each write from the host
+        self.end_frames = []
+        self._data_end = None
+    
+    def _answer(self, script, default=ACK):
+        reply = script.pop(0) if script else default
+        return reply or b''
+    
+    def _command(self, name, default=ACK):
+        self.sent_commands.append(name)
+        return self._answer(self.commands.get(name), default)
+    
+    def receive(self, data):
+        replies = bytearray()
+        batch = []
+        while data:
+            if data.startswith(CMD_DOWNLOAD):
+                data = data[len(CMD_DOWNLOAD):]
+                replies += self._command('download', CMD_NEW_HARDWARE if self.hardware == 2 else CMD_UPDATE)
+            elif data.startswith(CMD_ERASE):
+                data = data[len(CMD_ERASE):]
+                replies += self._command('erase')
+            elif data.startswith(CMD_PRG):
+                data = data[len(CMD_PRG):]
+                replies += self._command('program')
+            elif data.startswith(b'END'):
+                self.end_frames.append(data[:9])
+                data = data[9:]
+                replies += self._command('end')
+            elif data == ACK:
+                data = b''
+                replies += self._command('ack')
+            else:
+                addr = int.from_bytes(data[:4], 'big')
+                assert data[4] == 0 and addr % FW_BLOCK_SIZE == 0
+                length = min(FW_BLOCK_SIZE, self._data_end - addr)
+                self.received[addr] = data[5:5 + length]
+                data = data[5 + length:]
+                batch.append(addr)
+                replies += self._answer(self.blocks.get(addr))
+        if batch:
+            self.batches.append(batch)
+        return bytes(replies)
+    
+    def expect_image(self, image):
+        self._data_end = int.from_bytes(image[0x40:0x44], 'big')
+    
+    def flash(self):
+        """Payload as programmed, in address order"""
+        return b''.join(self.received[addr] for addr in sorted(self.received))
+
+def firmware_session(image, window=1, **script):
+    radio = FirmwareRadio(hardware=2 if image[0x31] == ord('2') else 1, **script)
+    radio.expect_image(image)
+    proto = FirmwareProtocol(image, window=window)
+    now = drive(proto, radio)
+    return proto, radio, now
+
+def events_of(proto, kind):
+    return [event for event in proto.events() if event[0] == kind]
+
+def legacy_frames(image):
+    """Block frames and END frame as fw_updater built them before plan_frames"""
+    flash = bytes(image)
+    if len(flash) < 524288:
+        flash += b'\xFF' * (524288 - len(flash))
+    data_end = (flash[0x40] << 24) | (flash[0x41] << 16) | (flash[0x42] << 8) | flash[0x43]
+    frames = []
+    check_sum = 0
+    cur = 80
+    addr = 0
+    while addr < data_end:
+        remainder = addr % FW_BLOCK_SIZE
+        length = (FW_BLOCK_SIZE - remainder) if (addr + FW_BLOCK_SIZE <= data_end) else (data_end - addr)
+        header = bytes([(addr >> 24) & 0xFF, (addr >> 16) & 0xFF, (addr >> 8) & 0xFF, addr & 0xFF, 0])
+        data = flash[cur:cur + length]
+        frames.append((addr, header, data))
+        check_sum += sum(data)
+        cur += length
+        addr += length
+    end = bytearray(9)
+    end[0:3] = b'END'
+    end[3:5] = b'\xFF\xFF'
+    end[5:9] = [(check_sum >> 24) & 0xFF, (check_sum >> 16) & 0xFF, (check_sum >> 8) & 0xFF, check_sum & 0xFF]
+    return frames, bytes(end)
+
+# --- plan_frames ---
+@pytest.mark.parametrize('image', CORPUS + ['short-tail', 'padded'], ids=os.path.basename)
+def test_plan_frames_matches_legacy_framing(image):
+    if image == 'short-tail':
+        data = make_image(5 * FW_BLOCK_SIZE + 123)
+    elif image == 'padded':
+        data = make_image(3 * FW_BLOCK_SIZE + 10, payload_size=FW_BLOCK_SIZE + 5)
+    else:
+        with open(image, 'rb') as f:
+            data = f.read()
+    plan = plan_frames(data)
+    frames, end_frame = legacy_frames(data)
+    
+    assert [(b.addr, b.header, bytes(b.payload)) for b in plan.blocks] == frames
+    assert plan.end_frame == end_frame
+    assert plan.check_sum == int.from_bytes(end_frame[5:], 'big')
+
+def test_plan_frames_rejects_bad_headers():
+    with pytest.raises(ValueError):
+        plan_frames(b'\x00' * 10)
+    with pytest.raises(ValueError):
+        plan_frames(make_image(0))
+    with pytest.raises(ValueError):
+        plan_frames(make_image(524288 + 1, payload_size=16))
+
+# --- FirmwareProtocol ---
+@pytest.mark.parametrize('hardware', [1, 2])
+def test_firmware_ack_path(hardware):
+    image = make_image(10 * FW_BLOCK_SIZE + 300, hardware=hardware)
+    proto, radio, _ = firmware_session(image)
+    
+    assert proto.succeeded, proto.error
+    assert radio.sent_commands == ['download', 'ack', 'erase', 'program', 'end']
+    assert radio.flash() == image[HEADER_SIZE:]
+    assert radio.end_frames == [plan_frames(image).end_frame]
+    events = proto.events()
+    assert ('connected', CMD_NEW_HARDWARE if hardware == 2 else CMD_UPDATE) in events
+    assert [e for e in events if e[0] == 'progress'][-1] == ('progress', 11, 11)
+    assert events[-1] == ('complete',)
+
+def test_firmware_wrong_handshake_reply_fails():
+    image = make_image(4 * FW_BLOCK_SIZE)
+    proto, _, _ = firmware_session(image, commands={'download': [CMD_UPDATE]})
+    assert proto.state == 'failed'
+    assert 'Handshake failed' in proto.error
+
+@pytest.mark.parametrize('name, retries', [('erase', 2), ('program', 1), ('end', 2)])
+def test_firmware_command_nack_retried_up_to_limit(name, retries):
+    image = make_image(4 * FW_BLOCK_SIZE)
+    proto, radio, now = firmware_session(image, commands={name: [NACK] * retries})
+    assert proto.succeeded, proto.error
+    assert radio.sent_commands.count(name) == retries + 1
+    assert now == pytest.approx(retries * RETRY_DELAY)
+    
+    proto, radio, _ = firmware_session(image, commands={name: [NACK] * (retries + 1)})
+    assert proto.state == 'failed'
+    assert proto.error.startswith(f"{name}: expected")
+    assert radio.sent_commands.count(name) == retries + 1
+
+def test_firmware_command_timeout_counts_as_retry():
+    image = make_image(4 * FW_BLOCK_SIZE)
+    proto, radio, _ = firmware_session(image, commands={'erase': [None, None]})
+    assert proto.succeeded, proto.error
+    assert radio.sent_commands.count('erase') == 3
+
+def test_firmware_failed_blocks_retried_before_end():
+    image = make_image(20 * FW_BLOCK_SIZE)
+    failed = [addr * FW_BLOCK_SIZE for addr in range(2, 2 + MAX_FAILED_BLOCKS)]
+    proto, radio, _ = firmware_session(image, blocks={addr: [NACK] for addr in failed})
+    
+    assert proto.succeeded, proto.error
+    assert [e[1] for e in events_of(proto, 'block_failed')] == failed
+    assert radio.batches[-len(failed):] == [[addr] for addr in failed]
+    assert radio.flash() == image[HEADER_SIZE:]
+
+def test_firmware_too_many_failed_blocks():
+    image = make_image(20 * FW_BLOCK_SIZE)
+    failed = [addr * FW_BLOCK_SIZE for addr in range(MAX_FAILED_BLOCKS + 1)]
+    proto, radio, _ = firmware_session(image, blocks={addr: [NACK] for addr in failed})
+    assert proto.state == 'failed'
+    assert proto.error == "Too many block write failures"
+    assert 'end' not in radio.sent_commands
+
+def test_firmware_block_retry_nack_fails():
+    image = make_image(8 * FW_BLOCK_SIZE)
+    proto, _, _ = firmware_session(image, blocks={FW_BLOCK_SIZE: [NACK, NACK]})
+    assert proto.state == 'failed'
+    assert proto.error == f"Retry failed for block at {FW_BLOCK_SIZE:#x}"
+
+def test_firmware_window_pipelines_blocks():
+    image = make_image(16 * FW_BLOCK_SIZE)
+    proto, radio, _ = firmware_session(image, window=4)
+    assert proto.succeeded, proto.error
+    assert radio.batches[0] == [0, 1024, 2048, 3072]
+    assert all(len(batch) <= 4 for batch in radio.batches)
+    assert radio.flash() == image[HEADER_SIZE:]
+
+def test_firmware_window_falls_back_to_single_blocks():
+    image = make_image(16 * FW_BLOCK_SIZE)
+    bad = 2 * FW_BLOCK_SIZE
+    proto, radio, _ = firmware_session(image, window=4, blocks={bad: [NACK]})
+    
+    assert proto.succeeded, proto.error
+    assert proto.window == 1
+    # The radio answers the first write with A, A, N, A: the two ACKs ahead of
+    # the NACK refill the window, and from then on every write carries a
+    # single block, with the failed one retried last
+    assert radio.batches[0] == [0, 1024, bad, 3072]
+    assert radio.batches[1] == [4096, 5120]
+    assert all(len(batch) == 1 for batch in radio.batches[2:])
+    assert radio.batches[-1] == [bad]
+    assert radio.flash() == image[HEADER_SIZE:]
+    assert radio.end_frames == [plan_frames(image).end_frame]
+
+def test_firmware_silent_block_times_out_and_is_retried():
+    image = make_image(6 * FW_BLOCK_SIZE)
+    proto, radio, now = firmware_session(image, blocks={0: [None]})
+    assert proto.succeeded, proto.error
+    assert now == pytest.approx(proto.ack_timeout)
+    assert radio.batches[-1] == [0]
+
+def test_firmware_no_handshake_reply():
+    image = make_image(4 * FW_BLOCK_SIZE)
+    proto, _, now = firmware_session(image, commands={'download': [None]})
+    assert proto.state == 'failed'
+    assert 'No response from radio' in proto.error
+    assert now == proto.handshake_timeout
+
+# --- FontProtocol ---
+class FontRadio:
+    """Normal-mode radio that ignores the first 'silent' handshake frames"""
+    
+    def __init__(self, silent=0, data_replies=None, answer=b'\x06'):
+        self.silent = silent
+        self.answer = answer
+        self.data_replies = dict(data_replies or {})
+        self.handshakes = 0
+        self.font_commands = 0
+        self.blocks = []
+    
+    def receive(self, data):
+        if data == FONT_HANDSHAKE:
+            self.handshakes += 1
+            return self.answer if self.handshakes > self.silent else b''
+        if data == CMD_FONT:
+            self.font_commands += 1
+            return ACK
+        assert len(data) == FONT_BLOCK_SIZE
+        self.blocks.append(bytes(data))
+        return self.data_replies.get(len(self.blocks) - 1, ACK)
+
+def font_buffer():
+    return bytes((i * 31 + 7) & 0xFF for i in range(FONT_DATA_SIZE))
+
+def test_font_ack_path():
+    font = font_buffer()
+    proto = FontProtocol(font)
+    radio = FontRadio(silent=2)
+    now = drive(proto, radio)
+    
+    assert proto.succeeded, proto.error
+    assert radio.handshakes == 3
+    assert radio.font_commands == 1
+    assert b''.join(radio.blocks[:-1]) == font
+    assert radio.blocks[-1] == FONT_END_BLOCK
+    assert now == pytest.approx(2 * proto.handshake_timeout + proto.settle_time)
+    events = proto.events()
+    assert ('connected', b'\x06') in events
+    assert events[-1] == ('complete',)
+
+def test_font_handshake_timeout():
+    proto = FontProtocol(font_buffer(), handshake_attempts=4)
+    radio = FontRadio(silent=10)
+    now = drive(proto, radio)
+    
+    assert proto.state == 'failed'
+    assert proto.error == "Handshake failed - no response from radio"
+    assert radio.handshakes == 4
+    assert radio.font_commands == 0
+    assert now == pytest.approx(4 * proto.handshake_timeout)
+
+def test_font_data_nack_fails():
+    proto = FontProtocol(font_buffer())
+    radio = FontRadio(data_replies={3: NACK})
+    drive(proto, radio)
+    assert proto.state == 'failed'
+    assert proto.error == f"ACK not received after data block at address {3 * FONT_BLOCK_SIZE}. Got: {NACK.hex()}"
+    assert len(radio.blocks) == 4
+
+def test_font_short_buffer_padded():
+    proto = FontProtocol(b'\x01' * 100)
+    radio = FontRadio()
+    drive(proto, radio)
+    assert proto.succeeded, proto.error
+    sent = b''.join(radio.blocks[:-1])
+    assert sent == b'\x01' * 100 + b'\xFF' * (FONT_DATA_SIZE - 100)
@@ -0,0 +1,91 @@
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+Every XOR engine against the byte-at-a-time reference loop, on the firmware
+corpus and on lengths around the header and the engines' chunk size.
+"""
+
+import glob
+import mmap
+import os
+
+import pytest
+
+from firmware_image import OFFSET, XOR_KEY
+from xor_engine import XOR_CHUNK_SIZE, XOR_ENGINES, xor_payload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = sorted(glob.glob(os.path.join(ROOT, 'firmware', '*.dat')))
+# Empty, one byte short of the header, header only, one payload byte, and
+# one byte past a whole chunk of payload
+LENGTHS = [0, OFFSET - 1, OFFSET, OFFSET + 1, OFFSET + XOR_CHUNK_SIZE + 1]
+
+def reference_xor(data, start, key):
+    """The per-byte loop the engines replace"""
+    out = bytearray(data)
+    for i in range(start, len(out)):
+        out[i] ^= key
+    return bytes(out)
+
+def sample(length):
+    return bytes((i * 131 + 17) & 0xFF for i in range(length))
+
+def corpus_id(path):
+    return os.path.basename(path)
+
+@pytest.fixture(scope='module', params=CORPUS, ids=corpus_id)
+def image(request):
+    with open(request.param, 'rb') as f:
+        data = f.read()
+    return data, reference_xor(data, OFFSET, XOR_KEY)
+
+@pytest.mark.parametrize('engine', sorted(XOR_ENGINES))
+def test_engine_matches_reference_on_corpus(engine, image):
+    data, expected = image
+    assert bytes(xor_payload(bytearray(data), OFFSET, key=XOR_KEY, engine=engine)) == expected
+
+@pytest.mark.parametrize('length', LENGTHS)
+@pytest.mark.parametrize('engine', sorted(XOR_ENGINES))
+def test_engine_matches_reference_at_length(engine, length):
+    data = sample(length)
+    for key in (XOR_KEY, 0x01, 0xFF):
+        assert bytes(xor_payload(bytearray(data), OFFSET, key=key, engine=engine)) == reference_xor(data, OFFSET, key)
+
+@pytest.mark.parametrize('engine', sorted(XOR_ENGINES))
+def test_engine_on_mmap_and_end(engine, tmp_path):
+    data = sample(OFFSET + XOR_CHUNK_SIZE + 1)
+    path = tmp_path / 'image.dat'
+    path.write_bytes(data)
+    end = len(data) - 7
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        xor_payload(mm, OFFSET, end, key=XOR_KEY, engine=engine)
+        result = mm[:]
+    assert result == reference_xor(data[:end], OFFSET, XOR_KEY) + data[end:]
+
+def test_unknown_engine():
+    with pytest.raises(ValueError, match="Unknown XOR engine"):
+        xor_payload(bytearray(100), OFFSET, key=XOR_KEY, engine='nope')
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+#This is free and unencumbered software released into the public domain.
+#
+#Anyone is free to copy, modify, publish, use, compile, sell, or
+#distribute this software, either in source code form or as a compiled
+#binary, for any purpose, commercial or non-commercial, and by any
+#means.
+#
+#In jurisdictions that recognize copyright laws, the author or authors
+#of this software dedicate any and all copyright interest in the
+#software to the public domain. We make this dedication for the benefit
+#of the public at large and to the detriment of our heirs and
+#successors. We intend this dedication to be an overt act of
+#relinquishment in perpetuity of all present and future rights to this
+#software under copyright law.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+#
+#For more information, please refer to <http://unlicense.org/>
+
+
+"""
+XOR engines for the firmware payload cipher.
+
+Every byte past the header is XORed with one key byte, so the same call
+encrypts and decrypts. Several interchangeable engines do the work; they
+only differ in speed (see benchmarks/micro_bench.py):
+
+    translate  bytes.translate through a 256-entry table (the default)
+    int        one wide Python integer XOR per chunk
+    numpy      in place through a uint8 view, once NumPy is loaded
+    python     byte at a time, the reference loop
+
+This module knows nothing about the image layout; firmware_image passes
+the header size and key in, and fwtool and fw_inspect import from here.
+"""
+
+import importlib.util
+import sys
+from functools import lru_cache
+
+# NumPy is optional, the other engines cover it. Importing it takes longer
+# than XORing a whole image with 'translate', so it is only loaded when
+# something first needs it (see load_numpy())
+np = None
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# Work size for the chunked XOR engines (keeps temporaries small on mmaps)
+XOR_CHUNK_SIZE = 1 << 16
+
+def load_numpy():
+    """Import NumPy on first use and return the module"""
+    global np
+    if np is None:
+        import numpy as np
+    return np
+
+@lru_cache(maxsize=None)
+def xor_table(key):
+    """bytes.translate table that XORs every byte with 'key'"""
+    return bytes(b ^ key for b in range(256))
+
+def _xor_python(buf, start, end, key):
+    """Reference engine: XOR one byte at a time (the original loop)"""
+    for i in range(start, end):
+        buf[i] ^= key
+
+def _xor_translate(buf, start, end, key):
+    """XOR through a 256-entry bytes.translate table"""
+    table = xor_table(key)
+    view = memoryview(buf)
+    try:
+        for pos in range(start, end, XOR_CHUNK_SIZE):
+            stop = min(pos + XOR_CHUNK_SIZE, end)
+            view[pos:stop] = bytes(view[pos:stop]).translate(table)
+    finally:
+        view.release()
+
+def _xor_int(buf, start, end, key):
+    """XOR a whole chunk at once as one wide Python integer"""
+    view = memoryview(buf)
+    mask = int.from_bytes(bytes([key]) * XOR_CHUNK_SIZE, 'little')
+    try:
+        for pos in range(start, end, XOR_CHUNK_SIZE):
+            stop = min(pos + XOR_CHUNK_SIZE, end)
+            length = stop - pos
+            if length != XOR_CHUNK_SIZE:
+                mask = int.from_bytes(bytes([key]) * length, 'little')
+            value = int.from_bytes(view[pos:stop], 'little') ^ mask
+            view[pos:stop] = value.to_bytes(length, 'little')
+    finally:
+        view.release()
+
+def _xor_numpy(buf, start, end, key):
+    """XOR the buffer in place through a NumPy uint8 view"""
+    np = load_numpy()
+    arr = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+    np.bitwise_xor(arr, key, out=arr)
+    del arr  # Drop the buffer export so mmaps can be closed
+
+XOR_ENGINES = {
+    'translate': _xor_translate,
+    'int': _xor_int,
+    'python': _xor_python,
+}
+if HAVE_NUMPY:
+    XOR_ENGINES['numpy'] = _xor_numpy
+
+def default_xor_engine():
+    """
+    Return the name of the fastest XOR engine available here: numpy once
+    something has imported NumPy, otherwise translate, which converts a
+    single image well before NumPy would have finished importing
+    """
+    return 'numpy' if 'numpy' in XOR_ENGINES and 'numpy' in sys.modules else 'translate'
+
+def xor_payload(buf, start, end=None, *, key, engine=None):
+    """
+    XOR a writable buffer in place from 'start' to 'end'.
+
+    Args:
+        buf: bytearray, mmap or writable memoryview
+        start: First byte to process
+        end: Stop before this byte (default: end of buffer)
+        key: XOR key byte
+        engine: Name from XOR_ENGINES (default: default_xor_engine())
+
+    Returns:
+        buf
+    """
+    if end is None:
+        end = len(buf)
+    if engine is None:
+        engine = default_xor_engine()
+    try:
+        xor = XOR_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown XOR engine '{engine}' (available: {', '.join(sorted(XOR_ENGINES))})")
+    if start < end:
+        xor(buf, start, end, key)
+    return buf